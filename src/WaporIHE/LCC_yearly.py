@@ -4,12 +4,8 @@ Created on Tue Jul 23 11:25:33 2019
 
 @author: ntr002
 """
-import os
 from datetime import datetime
 import psutil
-import requests
-
-import numpy as np
 
 try:
     from . import download as WaPOR
@@ -18,17 +14,18 @@ except ImportError as err:
     from WaporIHE import download as WaPOR
 
 try:
-    from .download import GIS_functions as gis
+    from .download import Engine
 except ImportError as err:
     print(err)
-    from WaporIHE.download import GIS_functions as gis
+    from WaporIHE.download import Engine
 
 
 def main(APIToken='',
          Dir='',
          Startdate='2009-01-01', Enddate='2018-12-31',
          latlim=[-40.05, 40.05], lonlim=[-30.5, 65.05],
-         version=2, level=1, Waitbar=1):
+         version=2, level=1, Waitbar=1, incremental=False, skip_existing=True,
+         workers=4, processes=0):
     """
     This function downloads yearly WAPOR Land Cover Class data
 
@@ -38,6 +35,10 @@ def main(APIToken='',
     Enddate -- 'yyyy-mm-dd'
     latlim -- [ymin, ymax] (values must be between -40.05 and 40.05)
     lonlim -- [xmin, xmax] (values must be between -30.05 and 65.05)
+    incremental -- download only rasters after the last synced time code
+    skip_existing -- skip rasters with a valid output in WaPOR_manifest.sqlite
+    workers -- number of download threads
+    processes -- number of processes scaling rasters, 0 in download threads
     """
     print('WaPOR LCC: Download yearly WaPOR Land Cover Class data'
           ' for the period %s till %s' % (Startdate, Enddate))
@@ -59,113 +60,22 @@ def main(APIToken='',
                         ' only support level 1 and level 2 data.'
                         ' For higher level, use WaPORAPI module')
 
-    cube_info = WaPOR.API.getCubeInfo(
-        cube_code, version=version, level=level)
-    try:
-        multiplier = cube_info['measure']['multiplier']
-        # unit = cube_info['measure']['unit']
-    except BaseException:
-        raise Exception('WaPOR LCC ERROR: Cannot get cube info.'
-                        ' Check if WaPOR version has cube %s' % (cube_code))
-    finally:
-        cube_info = None
-
     time_range = '{0},{1}'.format(Startdate, Enddate)
 
-    df_avail = WaPOR.API.getAvailData(
-        cube_code, time_range=time_range, version=version, level=level)
-    # try:
-    # except:
-    #     print('WaPOR LCC ERROR: cannot get list of available data')
-    #     return None
-
-    # if Waitbar == 1:
-    #     import watools.Functions.Start.WaitbarConsole as WaitbarConsole
-    #     total_amount = len(df_avail)
-    #     amount = 0
-    #     WaitbarConsole.printWaitBar(
-    #         amount, total_amount, prefix='Progress:', suffix='Complete', length=50)
-
-    Dir = os.path.join(Dir, cube_code)
-    if not os.path.exists(Dir):
-        os.makedirs(Dir)
-
-    for index, row in df_avail.iterrows():
-        print('WaPOR LCC: ----- {} -----'.format(index))
-        checkMemory('{} AvailData loop start'.format(index))
-
-        # Download raster file name
-        download_file = os.path.join(Dir, '{0}.tif'.format(row['raster_id']))
-        print('WaPOR LCC: Downloaded file :', download_file)
-
-        # Local raster file name
-        # Date = datetime.strptime(row['YEAR'], '%Y')
-        filename = 'LCC_WAPOR.v%s_l%s-annually-1_%s.tif' % (
-            version, level,
-            datetime.strptime(row['YEAR'], '%Y').strftime('%Y'))
-        outfilename = os.path.join(Dir, filename)
-        print('WaPOR LCC: Local      file :', outfilename)
-
-        # Downloading raster file
-        checkMemory('{} Downloading start'.format(index))
-        resp = requests.get(WaPOR.API.getCropRasterURL(bbox,
-                                                       cube_code,
-                                                       row['time_code'],
-                                                       row['raster_id']))
-        with open(download_file, 'wb') as fp:
-            fp.write(resp.content)
-        resp = None
-        checkMemory('{} Downloading end'.format(index))
-
-        # GDAL download_file * multiplier => outfilename
-        driver, NDV, xsize, ysize, GeoT, Projection = gis.GetGeoInfo(
-            download_file)
-
-        Array = gis.OpenAsArray(download_file, nan_values=False)
-        print('WaPOR LCC: Array         : {t}'.format(
-            t=Array.dtype.name))
-
-        # checkMemory('{} Multiply start'.format(index))
-        # print('WaPOR AET: NDV           : {v} {t}'.format(
-        #     v=NDV, t=type(NDV)))
-        # print('WaPOR AET: multiplier    : {v} {t}'.format(
-        #     v=multiplier, t=type(multiplier)))
-
-        NDV = np.float32(NDV)
-        multiplier = np.float32(multiplier)
-        print('WaPOR LCC: NDV           : {v} {t}'.format(
-            v=NDV, t=NDV.dtype.name))
-        print('WaPOR LCC: multiplier    : {v} {t}'.format(
-            v=multiplier, t=multiplier.dtype.name))
-
-        NDV = NDV * multiplier
-        Array = Array * multiplier
-        print('WaPOR LCC: NDV           : {v} {t}'.format(
-            v=NDV, t=NDV.dtype.name))
-        print('WaPOR LCC: Array         : {t}'.format(
-            t=Array.dtype.name))
-        checkMemory('{} Multiply end'.format(index))
-
-        gis.CreateGeoTiff(outfilename, Array,
-                          driver, NDV, xsize, ysize, GeoT, Projection)
-
-        Array = None
-        checkMemory('{} AvailData loop end'.format(index))
+    Engine.run(WaPOR.API, Dir, cube_code, bbox, time_range, fileName,
+               version=version, level=level, nan_values=False,
+               tag='WaPOR LCC', incremental=incremental,
+               skip_existing=skip_existing,
+               workers=workers, processes=processes)
+    checkMemory('End')
 
-        # Remove downloaded raster file
-        try:
-            os.remove(download_file)
-        except OSError as err:
-            # if failed, report it back to the user
-            print("WaPOR LCC ERROR: %s - %s." % (err.filename, err.strerror))
 
-        # if Waitbar == 1:
-        #     amount += 1
-        #     WaitbarConsole.printWaitBar(amount, total_amount,
-        #                                 prefix='Progress:',
-        #                                 suffix='Complete',
-        #                                 length=50)
-    checkMemory('End')
+def fileName(row, version, level):
+    """Local raster file name of an Available Data row
+    """
+    return 'LCC_WAPOR.v%s_l%s-annually-1_%s.tif' % (
+        version, level,
+        datetime.strptime(row['YEAR'], '%Y').strftime('%Y'))
 
 
 def checkMemory(txt='', print_job=False):
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent download engine of WaPOR cubes, shared by the product modules.
+
+A product is a cube code plus a naming and scaling policy. The engine runs
+the stages
+
+- availability: available rasters of the cube in the time range, page by
+  page when the API page size is set, skipping valid outputs recorded in
+  the manifest,
+- job: CropRaster jobs, pipelined by :meth:`WaporAPI.iterCropRasterURLs`,
+- download: raster download, in ``workers`` threads,
+- scale and write: raster times the cube multiplier, written as GeoTIFF,
+  in the download thread, or in ``processes`` worker processes.
+
+With paged retrieval, jobs of the first availability page start while
+later pages are loading.
+Rasters are finished in the order of their jobs, in table order when
+incremental, so the sync state never skips a raster.
+"""
+import collections
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+try:
+    from . import GIS_functions as gis
+except ImportError as err:
+    print(err)
+    from WaporIHE.download import GIS_functions as gis
+
+from .JobJournal import JobJournal
+from .Manifest import Manifest
+
+ENGINE_WORKERS = 4  # Download threads
+JOURNAL_FILE = 'WaPOR_jobs.sqlite'
+MANIFEST_FILE = 'WaPOR_manifest.sqlite'
+SYNC_FILE = 'WaPOR_sync.json'
+
+
+def scaleRaster(download_file, outfilename, multiplier, nan_values=False):
+    """
+    Multiply a downloaded raster by the cube multiplier, write as GeoTIFF.
+
+    Parameters
+    ----------
+    download_file : str
+        Downloaded raster file.
+    outfilename : str
+        Output raster file.
+    multiplier : float
+        Cube measure multiplier.
+    nan_values : bool, optional
+        Convert the no-data-values into np.nan values, default False.
+
+    Returns
+    -------
+    shape : tuple
+        (xsize, ysize) of the output raster.
+    """
+    driver, NDV, xsize, ysize, GeoT, Projection = gis.GetGeoInfo(
+        download_file)
+
+    Array = gis.OpenAsArray(download_file, nan_values=nan_values)
+
+    NDV = np.float32(NDV)
+    multiplier = np.float32(multiplier)
+
+    NDV = NDV * multiplier
+    Array = Array * multiplier
+
+    gis.CreateGeoTiff(outfilename, Array,
+                      driver, NDV, xsize, ysize, GeoT, Projection)
+    Array = None
+    return xsize, ysize
+
+
+def run(API, Dir, cube_code, bbox, time_range, fileName,
+        version=2, level=1, nan_values=False, tag='WaPOR',
+        incremental=False, skip_existing=True, journal=True,
+        workers=ENGINE_WORKERS, processes=0):
+    """
+    Download a cube, the stages of the product modules.
+
+    Parameters
+    ----------
+    API : :obj:`WaporAPI.WaPOR_API_class`
+        WaPOR API, with the API token set.
+    Dir : str
+        Output folder, rasters are written to ``Dir/cube_code``.
+    cube_code : str
+        Cube code, ex. 'L1_AETI_D'.
+    bbox : list
+        [xmin, ymin, xmax, ymax].
+    time_range : str
+        'yyyy-mm-dd,yyyy-mm-dd'.
+    fileName : callable
+        Naming policy, ``fileName(row, version, level)`` returns the output
+        file name of an Available Data row.
+    version : int, optional
+        WaPOR version, default 2.
+    level : int, optional
+        WaPOR level, default 1.
+    nan_values : bool, optional
+        Scaling policy, convert the no-data-values into np.nan values
+        before the multiplier, default False.
+    tag : str, optional
+        Print prefix, ex. 'WaPOR AET'.
+    incremental : bool, optional
+        Download only rasters after the last synced time code,
+        default False.
+    skip_existing : bool, optional
+        Skip rasters with a valid output in the manifest, default True.
+    journal : bool, optional
+        Record CropRaster jobs in ``Dir/WaPOR_jobs.sqlite``, a restarted
+        run reattaches running jobs and reuses valid download urls,
+        default True. The journal of ``API`` is restored after the run.
+        Completed jobs are purged when the run finishes, otherwise when
+        their download urls expire.
+    workers : int, optional
+        Download threads, default 4. The HTTP connection pool of ``API``
+        is grown to ``workers`` times the download segments, its
+        ``max_workers`` is not changed.
+    processes : int, optional
+        Scale and write processes, default 0, in the download threads.
+
+    Returns
+    -------
+    outfilenames : list
+        Written output rasters.
+    """
+    if workers < 1:
+        raise ValueError(
+            '{t} ERROR: workers "{v}" is not correct!'.format(
+                t=tag, v=workers))
+
+    # Connections in use, downloads of all segments and the job poller
+    API.setPoolSize(workers * API.downloadSegments + 1)
+
+    cube_info = API.getCubeInfo(cube_code, version=version, level=level)
+    try:
+        multiplier = cube_info['measure']['multiplier']
+    except BaseException:
+        raise Exception('{t} ERROR: Cannot get cube info.'
+                        ' Check if WaPOR version has cube {c}'.format(
+                            t=tag, c=cube_code))
+    finally:
+        cube_info = None
+
+    # Manifest and journal key, outputs of both workspaces share Dir
+    cube = '{0}/{1}'.format(API.workspaces[version], cube_code)
+
+    # Journal of this run, the journal of API is restored after the run
+    previous = API.jobJournal
+    jobJournal = None
+    if journal:
+        jobJournal = JobJournal(os.path.join(Dir, JOURNAL_FILE))
+        pending = [job for job in jobJournal.pending()
+                   if job['cube'] == cube]
+        if pending:
+            print('{t}: {n} jobs of the last run to reattach'.format(
+                t=tag, n=len(pending)))
+    API.jobJournal = jobJournal
+
+    manifest = None
+    scale_executor = None
+    finished = False
+    try:
+        if incremental:
+            API.setSyncState(os.path.join(Dir, SYNC_FILE))
+            df_avail = API.syncAvailData(
+                cube_code, bbox, time_range=time_range,
+                version=version, level=level)
+            if df_avail is None:
+                raise Exception(
+                    '{t} ERROR: Cannot get list of available data'
+                    ' of {c}'.format(t=tag, c=cube_code))
+        else:
+            df_avail = API.iterAvailData(
+                cube_code, time_range=time_range, version=version, level=level)
+
+        Dir = os.path.join(Dir, cube_code)
+        if not os.path.exists(Dir):
+            os.makedirs(Dir)
+
+        def outputFile(row):
+            # Local raster file name
+            return os.path.join(Dir, fileName(row, version, level))
+
+        if skip_existing:
+            manifest = Manifest(os.path.join(Dir, MANIFEST_FILE))
+            missing = functools.partial(
+                manifest.missing, cube, bbox, multiplier,
+                shape=gis.GetShape, filename=outputFile)
+            if incremental:
+                df_avail = missing(df_avail)
+            else:
+                df_avail = (missing(page) for page in df_avail)
+
+        if processes > 0:
+            scale_executor = ProcessPoolExecutor(max_workers=processes)
+
+        def stage(row, download_url):
+            # Download raster file name
+            download_file = os.path.join(
+                Dir, '{0}.tif'.format(row['raster_id']))
+            outfilename = outputFile(row)
+            print('{t}: Local      file : {f}'.format(t=tag, f=outfilename))
+
+            if download_url is None:
+                raise Exception(
+                    '{t} ERROR: Cannot get download url of {r}'.format(
+                        t=tag, r=row['raster_id']))
+            API.downloadFile(
+                download_url, download_file,
+                refresh=functools.partial(
+                    API.refreshCropRasterURL,
+                    bbox, cube_code, row['time_code'], row['raster_id'],
+                    version))
+
+            # GDAL download_file * multiplier => outfilename
+            if scale_executor is None:
+                shape = scaleRaster(download_file, outfilename, multiplier,
+                                    nan_values)
+            else:
+                shape = scale_executor.submit(
+                    scaleRaster, download_file, outfilename, multiplier,
+                    nan_values).result()
+            if manifest is not None:
+                manifest.record(outfilename, cube, row['raster_id'], bbox,
+                                multiplier, shape)
+
+            # Remove downloaded raster file
+            try:
+                os.remove(download_file)
+            except OSError as err:
+                # if failed, report it back to the user
+                print('{t} ERROR: {f} - {e}.'.format(
+                    t=tag, f=err.filename, e=err.strerror))
+            return outfilename
+
+        def finish(row, future):
+            outfilenames.append(future.result())
+            if incremental:
+                API.commitAvailData(cube_code, bbox, row, version=version)
+
+        outfilenames = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            running = collections.deque()
+            try:
+                for index, row, download_url in API.iterCropRasterURLs(
+                        bbox, cube_code, df_avail, ordered=incremental,
+                        version=version):
+                    print('{t}: ----- {i} -----'.format(t=tag, i=index))
+                    running.append(
+                        (row, executor.submit(stage, row, download_url)))
+
+                    # Finish in yield order, bound rasters in flight
+                    while running and (running[0][1].done() or
+                                       len(running) > 2 * workers):
+                        finish(*running.popleft())
+
+                while running:
+                    finish(*running.popleft())
+            finally:
+                for row, future in running:
+                    future.cancel()
+        finished = True
+    finally:
+        if scale_executor is not None:
+            scale_executor.shutdown()
+        if manifest is not None:
+            manifest.close()
+        if jobJournal is not None:
+            # Records of a finished run are not needed to resume it,
+            # otherwise keep download urls until they expire
+            jobJournal.purge(cube=cube, expired=not finished)
+            jobJournal.close()
+        API.jobJournal = previous
+    return outfilenames
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Inter-process lock on a local file, used to share state files
+between threads and worker processes.
+"""
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+class FileLock(object):
+    """Exclusive lock on a local file
+
+    Use as context manager, blocks until the lock is acquired.
+
+    Parameters
+    ----------
+    path: str
+        Lock file, created when not exists.
+    """
+
+    def __init__(self, path):
+        """
+        """
+        self.path = path
+        self._fd = None
+        self._count = 0
+        self._lock = threading.RLock()
+
+        folder = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def acquire(self):
+        """Acquire the lock, reentrant within a thread
+        """
+        self._lock.acquire()
+        if self._count == 0:
+            try:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                else:
+                    msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+            except BaseException:
+                self._lock.release()
+                raise
+            self._fd = fd
+        self._count += 1
+
+    def release(self):
+        """Release the lock
+        """
+        self._count -= 1
+        if self._count == 0:
+            fd, self._fd = self._fd, None
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                else:
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+            finally:
+                os.close(fd)
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
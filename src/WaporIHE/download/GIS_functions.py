@@ -83,6 +83,29 @@ def GetGeoInfo(fh, subdataset=0, print_job=False):
     return driver, subNDV, xsize, ysize, GeoT, Projection
 
 
+def GetShape(fh):
+    """
+    Read the raster shape from the file header.
+
+    Parameters
+    ----------
+    fh : str
+        Filehandle to file to be scrutinized.
+
+    Returns
+    -------
+    shape : tuple
+        (xsize, ysize), None if the file cannot be opened.
+    """
+    SourceDS = gdal.Open(fh, gdal.GA_ReadOnly)
+    if SourceDS is None:
+        return None
+
+    shape = (SourceDS.RasterXSize, SourceDS.RasterYSize)
+    SourceDS = None
+    return shape
+
+
 def OpenAsArray(fh, bandnumber=1, dtype='float32', nan_values=False, print_job=False):
     """
     Open a map as an numpy array.
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Journal of submitted WaPOR jobs in a local SQLite database.
+
+Each CropRaster job is recorded with its request key, job url, cube,
+time code, bounding box and status. After a crash, running jobs are
+reattached, and download urls of completed jobs are reused until they
+expire, instead of submitting the jobs again.
+
+Status
+
+- ``SUBMITTED``: job is submitted, output is not known yet.
+- ``COMPLETED``: job is completed, download url is stored.
+- ``FAILED``: job is completed with errors, submit again.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+JOB_SUBMITTED = 'SUBMITTED'
+JOB_COMPLETED = 'COMPLETED'
+JOB_FAILED = 'FAILED'
+
+
+class JobJournal(object):
+    """SQLite job journal
+
+    Parameters
+    ----------
+    path: str
+        SQLite database file.
+    """
+
+    def __init__(self, path):
+        """
+        """
+        self.path = path
+
+        folder = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60,
+                                     check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                ' key TEXT PRIMARY KEY,'
+                ' cube TEXT NOT NULL,'
+                ' time_code TEXT NOT NULL,'
+                ' raster_id TEXT NOT NULL,'
+                ' bbox TEXT NOT NULL,'
+                ' job_url TEXT,'
+                ' status TEXT NOT NULL,'
+                ' download_url TEXT,'
+                ' expires REAL,'
+                ' created REAL NOT NULL,'
+                ' updated REAL NOT NULL)')
+
+    def get(self, key):
+        """Get job record
+
+        Parameters
+        ----------
+        key: str
+            Request key.
+
+        Returns
+        -------
+        job: dict
+            Job record, None if not recorded.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT * FROM jobs WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['bbox'] = json.loads(job['bbox'])
+        return job
+
+    def submitted(self, key, cube, time_code, raster_id, bbox, job_url):
+        """Record submitted job
+
+        Parameters
+        ----------
+        key: str
+            Request key.
+        cube: str
+            Workspace and cube code, ex. 'WAPOR_2/L1_AETI_D'.
+        time_code: str
+            Time code.
+        raster_id: str
+            Raster id.
+        bbox: list
+            [xmin, ymin, xmax, ymax].
+        job_url: str
+            Job url.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO jobs'
+                ' (key, cube, time_code, raster_id, bbox, job_url, status,'
+                ' download_url, expires, created, updated)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?, NULL, NULL, ?, ?)',
+                (key, cube, time_code, raster_id, json.dumps(list(bbox)),
+                 job_url, JOB_SUBMITTED, now, now))
+
+    def completed(self, key, download_url, expires):
+        """Record completed job
+
+        Parameters
+        ----------
+        key: str
+            Request key.
+        download_url: str
+            Download url.
+        expires: float
+            Download url expiry, seconds since epoch.
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                'UPDATE jobs SET status = ?, download_url = ?, expires = ?,'
+                ' updated = ? WHERE key = ?',
+                (JOB_COMPLETED, download_url, expires, time.time(), key))
+
+    def failed(self, key):
+        """Record job completed with errors
+
+        Parameters
+        ----------
+        key: str
+            Request key.
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                'UPDATE jobs SET status = ?, updated = ? WHERE key = ?',
+                (JOB_FAILED, time.time(), key))
+
+    def pending(self):
+        """Get submitted jobs, output not known yet
+
+        Returns
+        -------
+        jobs: list
+            Job records.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT key FROM jobs WHERE status = ?'
+                ' ORDER BY created ASC', (JOB_SUBMITTED,)).fetchall()
+        return [self.get(row['key']) for row in rows]
+
+    def purge(self, before=None, cube=None, expired=False):
+        """Remove completed and failed jobs
+
+        Parameters
+        ----------
+        before: float, optional
+            Only jobs updated before, seconds since epoch,
+            default None, all jobs.
+        cube: str, optional
+            Only jobs of a cube, ex. 'WAPOR_2/L1_AETI_D',
+            default None, all cubes.
+        expired: bool, optional
+            Only failed jobs, and completed jobs with an expired
+            download url, default False.
+        """
+        now = time.time()
+        if before is None:
+            before = now
+
+        sql = 'DELETE FROM jobs WHERE status != ? AND updated <= ?'
+        params = [JOB_SUBMITTED, before]
+        if cube is not None:
+            sql += ' AND cube = ?'
+            params.append(cube)
+        if expired:
+            sql += ' AND (status = ? OR expires IS NULL OR expires <= ?)'
+            params.extend([JOB_FAILED, now])
+
+        with self._lock, self._conn:
+            self._conn.execute(sql, params)
+
+    def close(self):
+        """Close database
+        """
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Manifest of written output rasters in a local SQLite database.
+
+Each output raster is recorded with its workspace and cube, source raster
+id, bounding box, file name, multiplier, file size, checksum, modification
+time and shape. On a re-run, a recorded output is reused when the file
+name is the expected one, the file size is unchanged, the GDAL header
+opens with the recorded shape, and the checksum matches if the file was
+modified.
+"""
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+
+MANIFEST_CHUNK_SIZE = 1024 * 1024  # Checksum read chunk, bytes
+
+
+class Manifest(object):
+    """SQLite output manifest
+
+    Parameters
+    ----------
+    path: str
+        SQLite database file, file names are kept relative to its folder.
+    """
+
+    def __init__(self, path):
+        """
+        """
+        self.path = path
+        self.folder = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60,
+                                     check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS outputs ('
+                ' cube TEXT NOT NULL,'
+                ' raster_id TEXT NOT NULL,'
+                ' bbox TEXT NOT NULL,'
+                ' filename TEXT NOT NULL,'
+                ' multiplier REAL NOT NULL,'
+                ' size INTEGER NOT NULL,'
+                ' checksum TEXT NOT NULL,'
+                ' mtime REAL NOT NULL,'
+                ' xsize INTEGER NOT NULL,'
+                ' ysize INTEGER NOT NULL,'
+                ' updated REAL NOT NULL,'
+                ' PRIMARY KEY (cube, raster_id, bbox))')
+
+    @staticmethod
+    def _bbox(bbox):
+        return json.dumps([round(float(v), 6) for v in bbox])
+
+    def _relpath(self, filename):
+        return os.path.relpath(os.path.abspath(filename), self.folder)
+
+    @staticmethod
+    def checksum(filename):
+        """SHA-256 checksum of file
+        """
+        digest = hashlib.sha256()
+        with open(filename, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(MANIFEST_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def get(self, cube, raster_id, bbox):
+        """Get output record
+
+        Parameters
+        ----------
+        cube: str
+            Workspace and cube code, ex. 'WAPOR_2/L1_AETI_D'.
+        raster_id: str
+            Source raster id.
+        bbox: list
+            [xmin, ymin, xmax, ymax].
+
+        Returns
+        -------
+        output: dict
+            Output record, None if not recorded.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT * FROM outputs'
+                ' WHERE cube = ? AND raster_id = ? AND bbox = ?',
+                (cube, raster_id, self._bbox(bbox))).fetchone()
+        if row is None:
+            return None
+        return dict(row)
+
+    def record(self, filename, cube, raster_id, bbox, multiplier, shape):
+        """Record written output raster
+
+        Parameters
+        ----------
+        filename: str
+            Output raster file.
+        cube: str
+            Workspace and cube code, ex. 'WAPOR_2/L1_AETI_D'.
+        raster_id: str
+            Source raster id.
+        bbox: list
+            [xmin, ymin, xmax, ymax].
+        multiplier: float
+            Multiplier applied to the source raster.
+        shape: tuple
+            (xsize, ysize) of the output raster.
+        """
+        stat = os.stat(filename)
+        checksum = self.checksum(filename)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO outputs'
+                ' (cube, raster_id, bbox, filename, multiplier, size,'
+                ' checksum, mtime, xsize, ysize, updated)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (cube, raster_id, self._bbox(bbox),
+                 self._relpath(filename),
+                 float(multiplier), stat.st_size, checksum, stat.st_mtime,
+                 int(shape[0]), int(shape[1]), time.time()))
+
+    def isValid(self, cube, raster_id, bbox, multiplier, shape=None,
+                checksum=False, filename=None):
+        """Check if the recorded output raster can be reused
+
+        Parameters
+        ----------
+        cube: str
+            Workspace and cube code, ex. 'WAPOR_2/L1_AETI_D'.
+        raster_id: str
+            Source raster id.
+        bbox: list
+            [xmin, ymin, xmax, ymax].
+        multiplier: float
+            Multiplier applied to the source raster.
+        shape: callable, optional
+            Returns (xsize, ysize) of a raster file, None if it cannot be
+            opened, ex. :func:`GIS_functions.GetShape`, default None,
+            shape not checked.
+        checksum: bool, optional
+            Always verify the checksum, default False, only if the file
+            modification time has changed.
+        filename: str, optional
+            Expected output raster file, default None, not checked.
+
+        Returns
+        -------
+        valid: bool
+            True if the output raster can be reused.
+        """
+        output = self.get(cube, raster_id, bbox)
+        if output is None:
+            return False
+        if not math.isclose(output['multiplier'], float(multiplier),
+                            rel_tol=1e-6):
+            return False
+        if filename is not None:
+            if self._relpath(filename) != output['filename']:
+                return False
+
+        filename = os.path.join(self.folder, output['filename'])
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return False
+        if stat.st_size != output['size']:
+            return False
+
+        if shape is not None:
+            if shape(filename) != (output['xsize'], output['ysize']):
+                return False
+
+        if checksum or stat.st_mtime != output['mtime']:
+            if self.checksum(filename) != output['checksum']:
+                return False
+        return True
+
+    def missing(self, cube, bbox, multiplier, df_avail, shape=None,
+                checksum=False, filename=None):
+        """Available rasters without a valid output raster
+
+        Parameters
+        ----------
+        cube: str
+            Workspace and cube code, ex. 'WAPOR_2/L1_AETI_D'.
+        bbox: list
+            [xmin, ymin, xmax, ymax].
+        multiplier: float
+            Multiplier applied to the source rasters.
+        df_avail: :obj:`pandas.DataFrame`
+            Available rasters, from :meth:`WaporAPI.getAvailData`.
+        shape: callable, optional
+            See :meth:`isValid`.
+        checksum: bool, optional
+            See :meth:`isValid`.
+        filename: callable, optional
+            Returns the expected output raster file of a df_avail row,
+            default None, not checked.
+
+        Returns
+        -------
+        df_avail: :obj:`pandas.DataFrame`
+            Rows of df_avail to download.
+        """
+        valid = [self.isValid(cube, row['raster_id'], bbox, multiplier,
+                              shape=shape, checksum=checksum,
+                              filename=None if filename is None
+                              else filename(row))
+                 for index, row in df_avail.iterrows()]
+        skip = sum(valid)
+        if skip:
+            print('WaPOR API: Skip {n}/{t} existing rasters'.format(
+                n=skip, t=len(valid)))
+        return df_avail[[not v for v in valid]]
+
+    def remove(self, cube=None):
+        """Remove output records
+
+        Parameters
+        ----------
+        cube: str, optional
+            Workspace and cube code, default None, all cubes.
+        """
+        with self._lock, self._conn:
+            if cube is None:
+                self._conn.execute('DELETE FROM outputs')
+            else:
+                self._conn.execute(
+                    'DELETE FROM outputs WHERE cube = ?', (cube,))
+
+    def close(self):
+        """Close database
+        """
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent cache of WaPOR metadata responses in a local SQLite database.
+
+Catalogs, cube measures, dimensions, dimension members and the LOCATION
+table change rarely, they are kept per entity for a time-to-live, and the
+least recently used entries are evicted when the cache grows too large.
+
+Modes
+
+- ``default``: use cached entries within their time-to-live.
+- ``refresh``: always query the server, and update the cache.
+- ``offline``: never query the server, use cached entries even if expired.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Time-to-live per entity, in seconds
+METADATA_TTL = {
+    'catalog': 7 * 24 * 3600,
+    'measures': 30 * 24 * 3600,
+    'dimensions': 30 * 24 * 3600,
+    'members': 24 * 3600,  # TIME members grow every dekad
+    'locations': 30 * 24 * 3600,
+    'index': 7 * 24 * 3600  # cube code to workspace and level
+}
+METADATA_MAX_SIZE = 256 * 1024 * 1024  # bytes
+METADATA_MODES = ['default', 'refresh', 'offline']
+
+
+class MetadataCache(object):
+    """SQLite metadata cache
+
+    Parameters
+    ----------
+    path: str
+        SQLite database file.
+    ttl: dict, optional
+        Time-to-live per entity in seconds, updates the default
+        :data:`METADATA_TTL`.
+    mode: str, optional
+        'default', 'refresh' or 'offline', default 'default'.
+    max_size: int, optional
+        Maximum size of cached values in bytes, default 256 MB.
+    """
+
+    def __init__(self, path, ttl=None, mode='default',
+                 max_size=METADATA_MAX_SIZE):
+        """
+        """
+        if mode not in METADATA_MODES:
+            raise ValueError(
+                'WaPOR API ERROR: MetadataCache: Mode "{m}"'
+                ' is not correct!'.format(m=mode))
+
+        self.path = path
+        self.mode = mode
+        self.max_size = max_size
+        self.ttl = dict(METADATA_TTL)
+        if ttl is not None:
+            self.ttl.update(ttl)
+
+        folder = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60,
+                                     check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS metadata ('
+                ' entity TEXT NOT NULL,'
+                ' key TEXT NOT NULL,'
+                ' value TEXT NOT NULL,'
+                ' size INTEGER NOT NULL,'
+                ' created REAL NOT NULL,'
+                ' accessed REAL NOT NULL,'
+                ' PRIMARY KEY (entity, key))')
+
+    def get(self, entity, key):
+        """Get cached value
+
+        Parameters
+        ----------
+        entity: str
+            Entity name, ex. 'catalog'.
+        key: str
+            Entity key, ex. request url.
+
+        Returns
+        -------
+        value: object
+            Cached JSON value, None if not cached, expired or refresh mode.
+        """
+        if self.mode == 'refresh':
+            return None
+
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, created FROM metadata'
+                ' WHERE entity = ? AND key = ?', (entity, key)).fetchone()
+            if row is None:
+                return None
+
+            value, created = row
+            now = time.time()
+            ttl = self.ttl.get(entity)
+            if self.mode != 'offline' and ttl is not None:
+                if now - created > ttl:
+                    return None
+
+            with self._conn:
+                self._conn.execute(
+                    'UPDATE metadata SET accessed = ?'
+                    ' WHERE entity = ? AND key = ?', (now, entity, key))
+        return json.loads(value)
+
+    def put(self, entity, key, value):
+        """Store value, and evict least recently used entries
+
+        Parameters
+        ----------
+        entity: str
+            Entity name, ex. 'catalog'.
+        key: str
+            Entity key, ex. request url.
+        value: object
+            JSON value.
+        """
+        text = json.dumps(value)
+        now = time.time()
+
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO metadata'
+                ' (entity, key, value, size, created, accessed)'
+                ' VALUES (?, ?, ?, ?, ?, ?)',
+                (entity, key, text, len(text), now, now))
+            self._evict()
+
+    def putMany(self, entity, values):
+        """Store values of one entity, and evict least recently used entries
+
+        Parameters
+        ----------
+        entity: str
+            Entity name, ex. 'index'.
+        values: dict
+            Entity key to JSON value.
+        """
+        now = time.time()
+        rows = []
+        for key, value in values.items():
+            text = json.dumps(value)
+            rows.append((entity, key, text, len(text), now, now))
+
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO metadata'
+                ' (entity, key, value, size, created, accessed)'
+                ' VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self._evict()
+
+    def invalidate(self, entity=None, prefix=None):
+        """Remove cached entries
+
+        Parameters
+        ----------
+        entity: str, optional
+            Entity name, default None, all entities.
+        prefix: str, optional
+            Key prefix, ex. catalog url of a workspace,
+            default None, all keys.
+        """
+        sql = 'DELETE FROM metadata WHERE 1 = 1'
+        params = []
+        if entity is not None:
+            sql += ' AND entity = ?'
+            params.append(entity)
+        if prefix is not None:
+            sql += ' AND substr(key, 1, ?) = ?'
+            params.extend([len(prefix), prefix])
+
+        with self._lock, self._conn:
+            self._conn.execute(sql, params)
+
+    def _evict(self):
+        """Evict least recently used entries above max_size
+        """
+        total = self._conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM metadata').fetchone()[0]
+        if total <= self.max_size:
+            return
+
+        rows = self._conn.execute(
+            'SELECT entity, key, size FROM metadata'
+            ' ORDER BY accessed ASC').fetchall()
+        for entity, key, size in rows:
+            if total <= self.max_size:
+                break
+            self._conn.execute(
+                'DELETE FROM metadata WHERE entity = ? AND key = ?',
+                (entity, key))
+            total -= size
+
+    def close(self):
+        """Close database
+        """
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Adaptive poll intervals of WaPOR jobs.
+
+The duration of finished jobs is kept per job type, ex. 'CROP RASTER' or
+'AREA STATS', as an exponentially weighted moving average. A job is first
+polled shortly before its expected completion, then with an interval that
+grows with the elapsed time, up to a maximum interval.
+"""
+import threading
+
+POLL_INTERVAL_SECOND = 0.5  # Shortest poll interval
+POLL_INTERVAL_MAX_SECOND = 30  # Longest poll interval
+POLL_BACKOFF = 0.25  # Poll interval as fraction of elapsed time
+POLL_EWMA_ALPHA = 0.3  # Weight of the last job duration
+
+
+class PollSchedule(object):
+    """Poll intervals from observed job durations
+
+    Parameters
+    ----------
+    interval: float, optional
+        Shortest poll interval in seconds, default 0.5.
+    max_interval: float, optional
+        Longest poll interval in seconds, default 30.
+    """
+
+    def __init__(self, interval=POLL_INTERVAL_SECOND,
+                 max_interval=POLL_INTERVAL_MAX_SECOND):
+        """
+        """
+        self.interval = interval
+        self.max_interval = max_interval
+
+        self._durations = {}
+        self._lock = threading.Lock()
+
+    def expected(self, jobType):
+        """Expected duration of job type in seconds, None if not observed
+        """
+        with self._lock:
+            return self._durations.get(jobType)
+
+    def delay(self, jobType, elapsed):
+        """Seconds to wait before the next poll
+
+        Parameters
+        ----------
+        jobType: str
+            Job type, ex. 'CROP RASTER', None if unknown.
+        elapsed: float
+            Seconds since the job was submitted.
+
+        Returns
+        -------
+        delay: float
+            Seconds to wait.
+        """
+        expected = self.expected(jobType)
+        if expected is not None and elapsed < expected:
+            wait = expected - elapsed
+        else:
+            wait = elapsed * POLL_BACKOFF
+        return min(max(wait, self.interval), self.max_interval)
+
+    def observe(self, jobType, duration):
+        """Add duration of a finished job
+
+        Parameters
+        ----------
+        jobType: str
+            Job type, ex. 'CROP RASTER'.
+        duration: float
+            Seconds from job submission to completion.
+        """
+        with self._lock:
+            expected = self._durations.get(jobType)
+            if expected is None:
+                self._durations[jobType] = duration
+            else:
+                self._durations[jobType] = (
+                    POLL_EWMA_ALPHA * duration +
+                    (1 - POLL_EWMA_ALPHA) * expected)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Client-side token-bucket rate limiter for the WaPOR GIS Manager API.
+
+Each budget is a token bucket, refilled at ``rate`` requests per second
+up to ``capacity`` requests. Buckets are kept in memory and shared by
+threads, or kept in a local state file and shared by worker processes.
+"""
+import json
+import os
+import threading
+import time
+
+from .FileLock import FileLock
+
+
+class RateLimiter(object):
+    """Token-bucket rate limiter
+
+    Parameters
+    ----------
+    budgets: dict
+        Budget name to ``(rate, capacity)``, requests per second and burst
+        size, ex. ``{'catalog': (20, 40)}``. Rate ``None`` is unlimited.
+    path: str, optional
+        State file shared by worker processes, default None, in memory.
+    """
+
+    def __init__(self, budgets, path=None):
+        """
+        """
+        self.budgets = dict(budgets)
+        self.path = path
+
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._file_lock = None
+        if path is not None:
+            self._file_lock = FileLock('{0}.lock'.format(path))
+
+    def acquire(self, name):
+        """Take one token from budget, wait until it is available
+
+        Parameters
+        ----------
+        name: str
+            Budget name, unknown budget is unlimited.
+
+        Returns
+        -------
+        wait: float
+            Seconds waited.
+        """
+        rate, capacity = self.budgets.get(name, (None, None))
+        if rate is None:
+            return 0.0
+
+        waited = 0.0
+        while True:
+            wait = self._take(name, rate, capacity)
+            if wait <= 0:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    def _take(self, name, rate, capacity):
+        """Refill and take one token, return seconds to wait if empty
+        """
+        if self._file_lock is None:
+            with self._lock:
+                return self._takeBucket(self._buckets, name, rate, capacity)
+        else:
+            with self._file_lock:
+                buckets = self._read()
+                wait = self._takeBucket(buckets, name, rate, capacity)
+                self._write(buckets)
+                return wait
+
+    @staticmethod
+    def _takeBucket(buckets, name, rate, capacity):
+        """Refill bucket by elapsed time, take one token if available
+        """
+        now = time.time()
+        tokens, last = buckets.get(name, (capacity, now))
+        tokens = min(capacity, tokens + (now - last) * rate)
+
+        if tokens >= 1:
+            buckets[name] = (tokens - 1, now)
+            return 0.0
+        else:
+            buckets[name] = (tokens, now)
+            return (1 - tokens) / rate
+
+    def _read(self):
+        """Read bucket states from state file
+        """
+        try:
+            with open(self.path, 'r') as fp:
+                return {k: tuple(v) for k, v in json.load(fp).items()}
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _write(self, buckets):
+        """Write bucket states to state file
+        """
+        tmp = '{0}.{1}.tmp'.format(self.path, os.getpid())
+        with open(tmp, 'w') as fp:
+            json.dump(buckets, fp)
+        os.replace(tmp, self.path)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental availability sync state, per cube and bounding box.
+
+The last downloaded time code and raster id of each cube and bounding box
+are kept in a local state file, shared by worker processes. The next sync
+only asks the server for time members after the last time code.
+"""
+import json
+import os
+import time
+
+from .FileLock import FileLock
+
+
+class SyncState(object):
+    """Last synced time code per cube and bounding box
+
+    Parameters
+    ----------
+    path: str
+        State file, created when not exists.
+    """
+
+    def __init__(self, path):
+        """
+        """
+        self.path = path
+        self._file_lock = FileLock('{0}.lock'.format(path))
+
+    @staticmethod
+    def _key(cube, bbox):
+        return '{0}|{1}'.format(
+            cube, ','.join('{0:.6f}'.format(float(v)) for v in bbox))
+
+    @staticmethod
+    def timeEnd(time_code):
+        """End date of time code, ex. '2009-01-11' of
+        '[2009-01-01,2009-01-11)'
+        """
+        return time_code.strip('[]()').split(',')[-1].strip()
+
+    def get(self, cube, bbox):
+        """Get last synced state
+
+        Parameters
+        ----------
+        cube: str
+            Workspace and cube code, ex. 'WAPOR_2/L1_AETI_D'.
+        bbox: list
+            [xmin, ymin, xmax, ymax].
+
+        Returns
+        -------
+        state: dict
+            Last 'time_code', 'raster_id' and 'end' date, None if not synced.
+        """
+        with self._file_lock:
+            return self._read().get(self._key(cube, bbox))
+
+    def update(self, cube, bbox, time_code, raster_id):
+        """Store synced time code, if later than the last synced
+
+        Parameters
+        ----------
+        cube: str
+            Workspace and cube code, ex. 'WAPOR_2/L1_AETI_D'.
+        bbox: list
+            [xmin, ymin, xmax, ymax].
+        time_code: str
+            Time code, ex. '[2009-01-01,2009-01-11)'.
+        raster_id: str
+            Raster id.
+        """
+        key = self._key(cube, bbox)
+        end = self.timeEnd(time_code)
+
+        with self._file_lock:
+            states = self._read()
+            state = states.get(key)
+            if state is not None and state['end'] >= end:
+                return
+            states[key] = {
+                'time_code': time_code,
+                'raster_id': raster_id,
+                'end': end,
+                'updated': time.time()
+            }
+            self._write(states)
+
+    def reset(self, cube=None, bbox=None):
+        """Remove synced states
+
+        Parameters
+        ----------
+        cube: str, optional
+            Workspace and cube code, default None, all cubes.
+        bbox: list, optional
+            [xmin, ymin, xmax, ymax], default None, all bounding boxes.
+        """
+        with self._file_lock:
+            states = self._read()
+            if cube is None:
+                states = {}
+            elif bbox is None:
+                prefix = '{0}|'.format(cube)
+                states = {k: v for k, v in states.items()
+                          if not k.startswith(prefix)}
+            else:
+                states.pop(self._key(cube, bbox), None)
+            self._write(states)
+
+    def _read(self):
+        """Read states from state file
+        """
+        try:
+            with open(self.path, 'r') as fp:
+                return json.load(fp)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _write(self, states):
+        """Write states to state file
+        """
+        tmp = '{0}.{1}.tmp'.format(self.path, os.getpid())
+        with open(tmp, 'w') as fp:
+            json.dump(states, fp, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
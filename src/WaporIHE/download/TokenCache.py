@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Cache of WaPOR sign-in tokens, keyed by API key.
+
+Tokens are kept in memory for all API instances of the process, and
+optionally in a local file, readable by the owner only, shared by
+worker processes. API keys are stored as SHA-256 hashes only.
+"""
+import datetime
+import hashlib
+import json
+import os
+import threading
+
+from .FileLock import FileLock
+
+
+class TokenCache(object):
+    """Access and refresh token cache
+
+    Parameters
+    ----------
+    path: str, optional
+        Token file shared by worker processes, default None, in memory.
+    """
+    _memory = {}
+    _memory_lock = threading.RLock()
+
+    def __init__(self, path=None):
+        """
+        """
+        self.path = path
+        self._file_lock = None
+        if path is not None:
+            self._file_lock = FileLock('{0}.lock'.format(path))
+
+    @staticmethod
+    def _key(APIToken):
+        return hashlib.sha256(APIToken.encode('utf-8')).hexdigest()
+
+    def lock(self):
+        """Lock shared by threads, and worker processes when path is set
+        """
+        if self._file_lock is None:
+            return self._memory_lock
+        return self._file_lock
+
+    def get(self, APIToken, before_second=0):
+        """Get cached token
+
+        Parameters
+        ----------
+        APIToken: str
+            WaPOR API token.
+        before_second: int, optional
+            Ignore token expires within before_second, default 0.
+
+        Returns
+        -------
+        token: dict
+            'Access', 'Refresh' and 'time' of token, None if not cached.
+        """
+        key = self._key(APIToken)
+
+        Token = None
+        if self.path is not None:
+            Token = self._read().get(key)
+        if Token is None:
+            Token = self._memory.get(key)
+        if Token is None:
+            return None
+
+        dt_now = datetime.datetime.now().timestamp()
+        dt_start = Token['time']['start']
+        dt_expire = Token['time']['expire']
+        if dt_now - dt_start > dt_expire - before_second:
+            return None
+        return Token
+
+    def put(self, APIToken, Token):
+        """Store token
+
+        Parameters
+        ----------
+        APIToken: str
+            WaPOR API token.
+        Token: dict
+            'Access', 'Refresh' and 'time' of token.
+        """
+        key = self._key(APIToken)
+        Token = {
+            'Access': Token['Access'],
+            'Refresh': Token['Refresh'],
+            'time': {
+                'expire': Token['time']['expire'],
+                'start': Token['time']['start']
+            }
+        }
+
+        with self._memory_lock:
+            self._memory[key] = Token
+
+        if self.path is not None:
+            with self._file_lock:
+                tokens = self._read()
+                tokens[key] = Token
+                self._write(tokens)
+
+    def _read(self):
+        """Read tokens from token file
+        """
+        try:
+            with open(self.path, 'r') as fp:
+                return json.load(fp)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _write(self, tokens):
+        """Write tokens to token file, owner read and write only
+        """
+        tmp = '{0}.{1}.tmp'.format(self.path, os.getpid())
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as fp:
+            json.dump(tokens, fp)
+        os.replace(tmp, self.path)
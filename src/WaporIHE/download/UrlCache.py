@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory cache of job download urls, keyed by request fingerprint.
+
+Download urls are kept with their expiry, the least recently used urls
+are evicted when the cache is full.
+"""
+import collections
+import threading
+import time
+
+URL_CACHE_SIZE = 4096  # Number of download urls
+
+
+class UrlCache(object):
+    """LRU cache of download urls with expiry
+
+    Parameters
+    ----------
+    max_size: int, optional
+        Maximum number of urls, default 4096.
+    """
+
+    def __init__(self, max_size=URL_CACHE_SIZE):
+        """
+        """
+        self.max_size = max_size
+
+        self._urls = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, margin=0):
+        """Get download url
+
+        Parameters
+        ----------
+        key: str
+            Request fingerprint.
+        margin: float, optional
+            Ignore url expires within margin seconds, default 0.
+
+        Returns
+        -------
+        url: str
+            Download url, None if not cached, expired or expires
+            within margin.
+        """
+        with self._lock:
+            value = self._urls.get(key)
+            if value is None:
+                return None
+
+            url, expires = value
+            now = time.time()
+            if expires <= now:
+                del self._urls[key]
+                return None
+            # Still valid, kept for callers with a smaller margin
+            if expires - margin <= now:
+                return None
+
+            self._urls.move_to_end(key)
+            return url
+
+    def put(self, key, url, expires):
+        """Store download url, and evict least recently used urls
+
+        Parameters
+        ----------
+        key: str
+            Request fingerprint.
+        url: str
+            Download url.
+        expires: float
+            Url expiry, seconds since epoch.
+        """
+        with self._lock:
+            self._urls[key] = (url, expires)
+            self._urls.move_to_end(key)
+            while len(self._urls) > self.max_size:
+                self._urls.popitem(last=False)
+
+    def pop(self, key):
+        """Remove download url
+
+        Parameters
+        ----------
+        key: str
+            Request fingerprint.
+        """
+        with self._lock:
+            self._urls.pop(key, None)
+
+    def clear(self):
+        """Remove all urls
+        """
+        with self._lock:
+            self._urls.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._urls)
@@ -6,19 +6,85 @@ Contact: b.tran@un-ihe.org
 
 `FAO WaPOR GIS Manager API <https://io.apps.fao.org/gismgr/api/v1/swagger-ui.html>`_
 """
+import os
 import sys
 
+import asyncio
+import collections
+import copy
+import email.utils
+import functools
+import hashlib
+import queue
+import random
 import requests
+import threading
 import time
 import datetime
-# import json
+from concurrent.futures import ThreadPoolExecutor
+import json
+import re
+import urllib.parse
 import pandas as pd
+import psutil
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from .JobJournal import JobJournal, JOB_COMPLETED, JOB_SUBMITTED
+from .MetadataCache import MetadataCache, METADATA_MAX_SIZE
+from .PollSchedule import PollSchedule
+from .RateLimiter import RateLimiter
+from .SyncState import SyncState
+from .TokenCache import TokenCache
+from .UrlCache import UrlCache, URL_CACHE_SIZE
 
 TIME_EXPIRES_BEFORE_SECOND = 120  # From API expires time is 3600-120sec
 # TIME_EXPIRES_BEFORE_SECOND = 600  # From API expires time is 3600-600sec
-TIME_REQUEST_AFTER_SECOND = 600  # Request start time+600sec
+TIME_REQUEST_AFTER_SECOND = 600  # Request start time+600sec, job deadline
 TIME_SLEEP_SECOND = 2
 
+MAX_WORKERS = 4  # Default concurrency, also the HTTP connection pool size
+JOB_WINDOW = 8  # Jobs running at a time in pipelined job submission
+ASYNC_POLLS = 32  # Job polls in flight at a time in AsyncWaPOR_API
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # Download chunk, bytes
+DOWNLOAD_SEGMENTS = 4  # Connections per file in segmented download
+DOWNLOAD_SEGMENT_MIN_SIZE = 4 * 1024 * 1024  # bytes
+DOWNLOAD_SEGMENT_MAX_SIZE = 64 * 1024 * 1024  # bytes
+DOWNLOAD_SEGMENT_SECOND = 5  # Target download time of a segment
+DOWNLOAD_EXPIRED_STATUS = [400, 403, 410]  # Signed download url expired
+DOWNLOAD_URL_TTL_SECOND = 3600  # Download url lifetime, if not in url
+DOWNLOAD_URL_MARGIN_SECOND = 300  # Reuse download url with time to download
+POOL_CONNECTIONS = 10  # Number of hosts kept in the connection pool
+
+RETRY_TOTAL = 5  # Retries after the first attempt
+RETRY_BACKOFF_SECOND = 1  # Backoff base, 1, 2, 4, 8...sec with full jitter
+RETRY_BACKOFF_MAX_SECOND = 60
+RETRY_AFTER_MAX_SECOND = 300  # Upper limit to honor server Retry-After
+REQUEST_TIMEOUT_SECOND = (10, 120)  # (connect, read) timeout of a request
+RETRY_STATUS = [429, 500, 502, 503, 504]
+RETRY_STATUS_REJECTED = [429, 503]  # Request was not processed by server
+# Query types without side effects, safe to send again
+QUERY_IDEMPOTENT = ['MDAQuery_Table', 'TableQuery_GetList_1', 'PixelTimeSeries']
+
+PAGE_SIZE = 1000  # Items per page of paged retrieval
+# Cube lookup order of getCubeInfo, (version, level)
+CUBE_CANDIDATES = [(2, 3), (2, 2), (2, 1), (1, 3), (1, 2), (1, 1)]
+
+# Request budgets, (requests per second, burst size)
+RATE_LIMIT = {
+    'catalog': (20, 40),  # catalog GETs
+    'query': (5, 10),  # query/ POSTs
+    'jobs': (10, 20)  # job polls
+}
+
+
+class _RetryRequest(Exception):
+    """Internal signal to send request again
+    """
+
 
 class WaPOR_API_class(object):
     """WaPOR API Class
@@ -38,14 +104,42 @@ class WaPOR_API_class(object):
         Input WaPOR API token.
     print_job: bool
         Print job details, default True.
+    max_workers: int
+        Number of concurrent requests the caller makes,
+        sets the HTTP connection pool size, default 4.
     """
 
-    def __init__(self, print_job=True):
+    def __init__(self, print_job=True, max_workers=MAX_WORKERS):
         """
         """
         self.isAPIToken = False
         self.print_job = print_job
 
+        self.max_workers = max_workers
+        self.session = None
+        self.poolSize = 0
+        self._pool_lock = threading.Lock()
+        self.retry = {
+            'total': RETRY_TOTAL,
+            'backoff': RETRY_BACKOFF_SECOND,
+            'backoff_max': RETRY_BACKOFF_MAX_SECOND
+        }
+        self.timeout = REQUEST_TIMEOUT_SECOND
+        self.stats = {
+            'requests': 0,
+            'connections': 0,
+            'reused': 0,
+            'retries': 0,
+            'backoff_seconds': 0.0,
+            'throttle_seconds': 0.0,
+            'metadata_hits': 0,
+            'download_bytes': 0,
+            'download_seconds': 0.0
+        }
+        self._stats_lock = threading.Lock()
+        self.setMaxWorkers(max_workers)
+        self.limiter = RateLimiter(RATE_LIMIT)
+
         self.workspaces = {
             1: 'WAPOR',
             2: 'WAPOR_2'
@@ -61,6 +155,10 @@ class WaPOR_API_class(object):
         #     'expire': 0
         # }
 
+        self._token_lock = threading.Lock()
+        self.tokenCache = TokenCache()
+        self._refresher = None
+        self._refresher_stop = threading.Event()
         self.token = {
             'API': '',
             'Access': '',
@@ -91,6 +189,20 @@ class WaPOR_API_class(object):
         self.wkspaces = None
 
         self.catalog = None
+        self.catalogs = {}
+        self.cubes = {}
+        self.cubeIndex = {}
+        self.metaCache = None
+        self._catalog_lock = threading.RLock()
+        self.streamDecode = False
+        self.pageSize = None
+        self.syncState = None
+        self.jobDeadline = TIME_REQUEST_AFTER_SECOND
+        self.pollSchedule = PollSchedule()
+        self.jobJournal = None
+        self.urlCache = UrlCache()
+        self.downloadSegments = 1
+        self.downloadSegmentSize = DOWNLOAD_SEGMENT_MIN_SIZE
 
         self.locationsTable = None
         self.list_countries = None
@@ -99,9 +211,329 @@ class WaPOR_API_class(object):
         # # Initiate Token
         # self.setAPIToken(APIToken)
 
+    def setMaxWorkers(self, max_workers):
+        """Set concurrency and rebuild the pooled HTTP session
+
+        All API queries, job polls and raster downloads share one
+        keep-alive session, its pool holds ``max_workers`` connections
+        per host, see :meth:`setPoolSize` to keep more.
+
+        Parameters
+        ----------
+        max_workers: int
+            Number of concurrent requests.
+        """
+        if not isinstance(max_workers, int) or max_workers < 1:
+            raise ValueError(
+                'WaPOR API ERROR: max_workers "{v}"'
+                ' is not correct!'.format(v=max_workers))
+
+        if self.session is not None:
+            self._collectPoolStats()
+            self.session.close()
+
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=POOL_CONNECTIONS,
+            pool_maxsize=max_workers)
+
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        self.max_workers = max_workers
+        self.poolSize = max_workers
+        self.session = session
+
+    def setPoolSize(self, pool_size):
+        """Grow the HTTP connection pool of the session
+
+        For callers with more requests in flight than ``max_workers``,
+        like job polls of :class:`AsyncWaPOR_API` and segmented downloads.
+        Concurrency of the client, ``max_workers``, is unchanged. The
+        session is kept, the pool only grows, a smaller or equal
+        ``pool_size`` does nothing.
+
+        Parameters
+        ----------
+        pool_size: int
+            Number of connections kept per host.
+        """
+        if not isinstance(pool_size, int) or pool_size < 1:
+            raise ValueError(
+                'WaPOR API ERROR: pool_size "{v}"'
+                ' is not correct!'.format(v=pool_size))
+
+        with self._pool_lock:
+            if pool_size <= self.poolSize:
+                return
+
+            # Requests in flight finish on the old pools
+            self._collectPoolStats()
+            adapter = self.session.get_adapter('https://')
+            poolmanager = adapter.poolmanager
+            adapter.init_poolmanager(POOL_CONNECTIONS, pool_size)
+            poolmanager.clear()
+            self.poolSize = pool_size
+
+    def request(self, method, url, raise_for_status=True, idempotent=None,
+                **kwargs):
+        """Send request through the pooled session
+
+        Failed requests are retried with exponential backoff and jitter,
+        ``Retry-After`` is honored on 429 and 503. Requests with side
+        effects, like CropRaster job submission and token refresh, are only
+        retried when the server did not process them. Requests time out
+        after :attr:`timeout`, see :meth:`setRetry`.
+
+        Parameters
+        ----------
+        method: str
+            HTTP method, 'GET' or 'POST'.
+        url: str
+            Request url.
+        raise_for_status: bool, optional
+            Raise error on HTTP error status, default True.
+        idempotent: bool, optional
+            Request is safe to send again, default guessed from
+            method, url and query type.
+        kwargs:
+            Passed to :meth:`requests.Session.request`.
+
+        Returns
+        -------
+        response: :obj:`requests.Response`
+            Server response.
+        """
+        if idempotent is None:
+            idempotent = self._isIdempotent(method, url, kwargs.get('json'))
+        kwargs.setdefault('timeout', self.timeout)
+
+        budget = self._endpoint(url)
+
+        attempt = 0
+        while True:
+            throttle = self.limiter.acquire(budget)
+            with self._stats_lock:
+                self.stats['requests'] += 1
+                self.stats['throttle_seconds'] += throttle
+
+            retry_after = None
+            try:
+                resq = self.session.request(method, url, **kwargs)
+
+                if resq.status_code in RETRY_STATUS:
+                    if idempotent or resq.status_code in RETRY_STATUS_REJECTED:
+                        retry_after = self._retryAfter(resq)
+                        if attempt < self.retry['total']:
+                            resq.close()
+                            raise _RetryRequest()
+                if raise_for_status:
+                    resq.raise_for_status()
+            except _RetryRequest:
+                pass
+            except requests.exceptions.HTTPError as err:
+                raise Exception("WaPOR API Http Error: {e}".format(e=err))
+            except requests.exceptions.ConnectionError as err:
+                if not self._isRetry(err, idempotent, attempt):
+                    raise Exception("WaPOR API Error Connecting: {e}".format(e=err))
+            except requests.exceptions.Timeout as err:
+                if not self._isRetry(err, idempotent, attempt):
+                    raise Exception("WaPOR API Timeout Error: {e}".format(e=err))
+            except requests.exceptions.RequestException as err:
+                if not self._isRetry(err, idempotent, attempt):
+                    raise Exception("WaPOR API OOps: Something Else {e}".format(e=err))
+            else:
+                return resq
+
+            wait = self._retryBackoff(attempt, retry_after)
+            if self.print_job:
+                print('WaPOR API: Retry {i}/{n} in {t:.1f}sec {url}'.format(
+                    i=attempt + 1, n=self.retry['total'], t=wait, url=url))
+            with self._stats_lock:
+                self.stats['retries'] += 1
+                self.stats['backoff_seconds'] += wait
+            time.sleep(wait)
+            attempt += 1
+
+    def setRetry(self, total=None, backoff=None, backoff_max=None,
+                 timeout=None):
+        """Set request retries and timeout
+
+        Parameters
+        ----------
+        total: int, optional
+            Retries after the first attempt, default unchanged, initially 5.
+        backoff: float, optional
+            Backoff base in seconds, default unchanged, initially 1.
+        backoff_max: float, optional
+            Longest backoff in seconds, default unchanged, initially 60.
+        timeout: float, tuple, optional
+            Request timeout in seconds, or (connect, read) timeout,
+            default unchanged, initially (10, 120).
+        """
+        if total is not None:
+            self.retry['total'] = total
+        if backoff is not None:
+            self.retry['backoff'] = backoff
+        if backoff_max is not None:
+            self.retry['backoff_max'] = backoff_max
+        if timeout is not None:
+            self.timeout = timeout
+
+    def setRateLimit(self, catalog=None, query=None, jobs=None, path=None):
+        """Set client-side request budgets
+
+        Each budget is ``(rate, capacity)``, requests per second and burst
+        size, rate ``None`` is unlimited. Pass the same ``path`` in every
+        worker process to share the budgets between processes.
+
+        Parameters
+        ----------
+        catalog: tuple, optional
+            Budget of catalog GETs, default unchanged.
+        query: tuple, optional
+            Budget of query/ POSTs, default unchanged.
+        jobs: tuple, optional
+            Budget of job polls, default unchanged.
+        path: str, optional
+            Local state file, default unchanged.
+        """
+        if path is None:
+            path = self.limiter.path
+
+        budgets = dict(self.limiter.budgets)
+        for name, budget in [('catalog', catalog),
+                             ('query', query),
+                             ('jobs', jobs)]:
+            if budget is not None:
+                budgets[name] = tuple(budget)
+        self.limiter = RateLimiter(budgets, path=path)
+
+    def _endpoint(self, url):
+        """Request budget name of url
+        """
+        if '/jobs/' in url:
+            return 'jobs'
+        if url.startswith(self.path['query']):
+            return 'query'
+        if url.startswith(self.path['catalog']):
+            return 'catalog'
+        return None
+
+    def _isIdempotent(self, method, url, request_json=None):
+        """Check request is safe to send again
+        """
+        if method.upper() in ['GET', 'HEAD', 'OPTIONS']:
+            return True
+        if url.startswith(self.path['sign_in']):
+            return True
+        if url.startswith(self.path['query']) and request_json is not None:
+            return request_json.get('type') in QUERY_IDEMPOTENT
+        return False
+
+    def _isRetry(self, err, idempotent, attempt):
+        """Check failed request can be retried
+        """
+        if attempt >= self.retry['total']:
+            return False
+        if idempotent:
+            return True
+        # Connection was never established, request not sent
+        return isinstance(err, requests.exceptions.ConnectTimeout)
+
+    def _retryAfter(self, resq):
+        """Parse Retry-After header, in seconds or HTTP date
+        """
+        value = resq.headers.get('Retry-After')
+        if value is None:
+            return None
+        try:
+            seconds = float(value)
+        except ValueError:
+            try:
+                dt = email.utils.parsedate_to_datetime(value)
+                seconds = dt.timestamp() - time.time()
+            except (TypeError, ValueError):
+                return None
+        return min(max(seconds, 0.0), RETRY_AFTER_MAX_SECOND)
+
+    def _retryBackoff(self, attempt, retry_after=None):
+        """Exponential backoff with full jitter
+        """
+        if retry_after is not None:
+            return retry_after
+        cap = min(self.retry['backoff_max'],
+                  self.retry['backoff'] * 2 ** attempt)
+        return random.uniform(0, cap)
+
+    def _poolStats(self):
+        """Count requests and new connections of the session pools
+        """
+        num_requests, num_connections = 0, 0
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is not None:
+                    num_requests += pool.num_requests
+                    num_connections += pool.num_connections
+        return num_requests, num_connections
+
+    def _collectPoolStats(self):
+        """Keep pool counters before the session is closed
+        """
+        num_requests, num_connections = self._poolStats()
+        with self._stats_lock:
+            self.stats['connections'] += num_connections
+            self.stats['reused'] += num_requests - num_connections
+
+    def getStats(self):
+        """Get request statistics
+
+        Returns
+        -------
+        stats: dict
+            ``requests`` sent, new ``connections`` opened,
+            ``reused`` keep-alive connections, ``retries``,
+            ``backoff_seconds`` spent waiting before retries,
+            ``throttle_seconds`` spent waiting on the rate limiter,
+            ``metadata_hits`` of the persistent metadata cache,
+            ``download_bytes`` and ``download_seconds`` of file
+            downloads and ``peak_rss`` of the process in bytes.
+        """
+        num_requests, num_connections = self._poolStats()
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['connections'] += num_connections
+        stats['reused'] += num_requests - num_connections
+        stats['peak_rss'] = self._peakRSS()
+        return stats
+
+    @staticmethod
+    def _peakRSS():
+        """Peak resident set size of the process in bytes
+        """
+        if resource is not None:
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            if sys.platform == 'darwin':
+                return peak
+            return peak * 1024
+
+        memory = psutil.Process().memory_info()
+        return getattr(memory, 'peak_wset', memory.rss)
+
+    @staticmethod
+    def _currentRSS():
+        """Current resident set size of the process in bytes
+        """
+        return psutil.Process().memory_info().rss
+
     def setAPIToken(self, APIToken):
         """Initiate AccessToken and RefreshToken
 
+        A valid token pair of the same APIToken in the token cache is
+        reused, otherwise sign-in and store the new pair in the cache.
+
         Parameters
         ----------
         APIToken: str
@@ -112,22 +544,56 @@ class WaPOR_API_class(object):
 
         print('WaPOR API: Loading sign-in...')
 
+        with self.tokenCache.lock():
+            Token = self.tokenCache.get(APIToken, TIME_EXPIRES_BEFORE_SECOND)
+            if Token is not None:
+                print('WaPOR API: Loading sign-in found.')
+            else:
+                Token = self._signIn(APIToken)
+                self.tokenCache.put(APIToken, Token)
+
+        with self._token_lock:
+            dt_now = datetime.datetime.now().timestamp()
+            self.token = {
+                'API': APIToken,
+                'Access': Token['Access'],
+                'Refresh': Token['Refresh'],
+                'time': {
+                    'expire': Token['time']['expire'],
+                    'start': Token['time']['start'],
+                    'now': dt_now
+                },
+            }
+            self.isAPIToken = True
+
+    def setTokenCache(self, path=None):
+        """Set token cache
+
+        Parameters
+        ----------
+        path: str, optional
+            Token file shared by worker processes,
+            default None, in memory only.
+        """
+        self.tokenCache = TokenCache(path)
+
+    def _signIn(self, APIToken):
+        """Sign-in, return token dict
+        """
         Token = self._query_accessToken(APIToken)
         if Token is None:
             sys.exit('WaPOR API ERROR: The data with specified level version'
                      ' is not available in this version')
         else:
-            self.token = {
-                'API': APIToken,
+            dt_now = datetime.datetime.now().timestamp()
+            return {
                 'Access': Token['accessToken'],
                 'Refresh': Token['refreshToken'],
                 'time': {
                     'expire': Token['expiresIn'],
-                    'start': datetime.datetime.now().timestamp(),
-                    'now': datetime.datetime.now().timestamp()
-                },
+                    'start': dt_now
+                }
             }
-            self.isAPIToken = True
 
     def _query_accessToken(self, APIToken):
         """Query AccessToken and RefreshToken
@@ -150,34 +616,25 @@ class WaPOR_API_class(object):
             'X-GISMGR-API-KEY': APIToken}
 
         # requests
+        resq = self.request(
+            'POST',
+            request_url,
+            headers=request_headers,
+            raise_for_status=False)
+        resq_json = resq.json()
         try:
-            resq = requests.post(
-                request_url,
-                headers=request_headers)
-            # resq.raise_for_status()
-        except requests.exceptions.HTTPError as err:
-            raise Exception("WaPOR API Http Error: {e}".format(e=err))
-        except requests.exceptions.ConnectionError as err:
-            raise Exception("WaPOR API Error Connecting: {e}".format(e=err))
-        except requests.exceptions.Timeout as err:
-            raise Exception("WaPOR API Timeout Error: {e}".format(e=err))
-        except requests.exceptions.RequestException as err:
-            raise Exception("WaPOR API OOps: Something Else {e}".format(e=err))
-        else:
-            resq_json = resq.json()
-            try:
-                resp = resq_json['response']
-                # print(resp)
+            resp = resq_json['response']
+            # print(resp)
 
-                if resq_json['message'] == 'OK':
-                    return resp
-                else:
-                    print(resq_json['message'])
-            except BaseException:
-                print('WaPOR API ERROR: APIToken "{v}"'.format(
-                    v=APIToken))
-                print('WaPOR API ERROR: Cannot get {url}'.format(
-                    url=request_url))
+            if resq_json['message'] == 'OK':
+                return resp
+            else:
+                print(resq_json['message'])
+        except BaseException:
+            print('WaPOR API ERROR: APIToken "{v}"'.format(
+                v=APIToken))
+            print('WaPOR API ERROR: Cannot get {url}'.format(
+                url=request_url))
 
     def isAPITokenSet(self):
         if not self.isAPIToken:
@@ -186,29 +643,117 @@ class WaPOR_API_class(object):
     def isAPITokenExpired(self):
 
         """Check AccessToken expires, and refresh token
+
+        Safe to call from many threads, only one refresh runs
+        while the other callers wait for its result.
         """
         print('WaPOR API: Checking token...')
         self.isAPITokenSet()
 
-        # APIToken = self.token['API']
-        RefToken = self.token['Refresh']
+        if self._isTokenExpiring(TIME_EXPIRES_BEFORE_SECOND):
+            with self._token_lock:
+                # Token may be refreshed while waiting for the lock
+                if self._isTokenExpiring(TIME_EXPIRES_BEFORE_SECOND):
+                    self._refreshAPIToken()
+
+    def _isTokenExpiring(self, before_second):
+        """Check AccessToken expires within before_second
+        """
         dt_start = self.token['time']['start']
         dt_expire = self.token['time']['expire']
 
         dt_now = datetime.datetime.now().timestamp()
-        if dt_now - dt_start > dt_expire - TIME_EXPIRES_BEFORE_SECOND:
-            Token = self._query_refreshToken(RefToken)
+        return dt_now - dt_start > dt_expire - before_second
 
-            if Token is None:
-                raise Exception(
-                    'WaPOR API ERROR: The data with specified level version'
-                    ' is not available in this version')
-            else:
-                self.token['Access'] = Token['accessToken']
-                self.token['Refresh'] = Token['refreshToken']
-                self.token['time']['expire'] = Token['expiresIn']
-                self.token['time']['start'] = dt_now
-                self.token['time']['now'] = dt_now
+    def _refreshAPIToken(self, before_second=TIME_EXPIRES_BEFORE_SECOND):
+        """Refresh token, caller holds the token lock
+
+        A newer token in the token cache, refreshed by another worker,
+        is reused. Sign-in again when the refresh token is rejected.
+        """
+        APIToken = self.token['API']
+        RefToken = self.token['Refresh']
+
+        with self.tokenCache.lock():
+            Token = self.tokenCache.get(APIToken, before_second)
+            if Token is None or Token['Access'] == self.token['Access']:
+                dt_now = datetime.datetime.now().timestamp()
+                try:
+                    Token = self._query_refreshToken(RefToken)
+                except Exception as err:
+                    print('WaPOR API ERROR: {e}'.format(e=err))
+                    Token = None
+
+                if Token is None:
+                    Token = self._signIn(APIToken)
+                else:
+                    Token = {
+                        'Access': Token['accessToken'],
+                        'Refresh': Token['refreshToken'],
+                        'time': {
+                            'expire': Token['expiresIn'],
+                            'start': dt_now
+                        }
+                    }
+                self.tokenCache.put(APIToken, Token)
+
+        # Replace whole dict, readers never see a half updated token
+        self.token = {
+            'API': APIToken,
+            'Access': Token['Access'],
+            'Refresh': Token['Refresh'],
+            'time': {
+                'expire': Token['time']['expire'],
+                'start': Token['time']['start'],
+                'now': datetime.datetime.now().timestamp()
+            },
+        }
+
+    def startTokenRefresher(self):
+        """Renew token in a background thread before it expires
+
+        The token is renewed ``TIME_EXPIRES_BEFORE_SECOND`` before the
+        request path would refresh it, so requests never wait on a refresh.
+        """
+        self.isAPITokenSet()
+        if self._refresher is not None and self._refresher.is_alive():
+            return
+
+        self._refresher_stop.clear()
+        self._refresher = threading.Thread(
+            target=self._runTokenRefresher,
+            name='WaPOR-token-refresher')
+        self._refresher.daemon = True
+        self._refresher.start()
+
+    def stopTokenRefresher(self):
+        """Stop the background token refresher
+        """
+        self._refresher_stop.set()
+        if self._refresher is not None:
+            self._refresher.join()
+            self._refresher = None
+
+    def _runTokenRefresher(self):
+        """Background token refresher loop
+        """
+        while not self._refresher_stop.is_set():
+            before_second = min(2 * TIME_EXPIRES_BEFORE_SECOND,
+                                self.token['time']['expire'] / 2)
+            dt_now = datetime.datetime.now().timestamp()
+            dt_refresh = self.token['time']['start'] \
+                + self.token['time']['expire'] - before_second
+
+            if self._refresher_stop.wait(max(dt_refresh - dt_now, 0)):
+                break
+
+            try:
+                with self._token_lock:
+                    if self._isTokenExpiring(before_second):
+                        self._refreshAPIToken(before_second)
+            except BaseException as err:
+                print('WaPOR API ERROR: Token refresher {e}'.format(e=err))
+                self._refresher_stop.wait(TIME_SLEEP_SECOND)
 
     def _query_refreshToken(self, RefreshToken):
         """Query AccessToken expires, and refresh token
@@ -227,32 +772,22 @@ class WaPOR_API_class(object):
             'refreshToken': RefreshToken}
 
         # requests
+        resq = self.request(
+            'POST',
+            request_url,
+            json=request_json)
+        resq_json = resq.json()
         try:
-            resq = requests.post(
-                request_url,
-                json=request_json)
-            resq.raise_for_status()
-        except requests.exceptions.HTTPError as err:
-            raise Exception("WaPOR API Http Error: {e}".format(e=err))
-        except requests.exceptions.ConnectionError as err:
-            raise Exception("WaPOR API Error Connecting: {e}".format(e=err))
-        except requests.exceptions.Timeout as err:
-            raise Exception("WaPOR API Timeout Error: {e}".format(e=err))
-        except requests.exceptions.RequestException as err:
-            raise Exception("WaPOR API OOps: Something Else {e}".format(e=err))
-        else:
-            resq_json = resq.json()
-            try:
-                resp = resq_json['response']
-                # print(resp)
+            resp = resq_json['response']
+            # print(resp)
 
-                if resq_json['message'] == 'OK':
-                    return resp
-                else:
-                    print(resq_json['message'])
-            except BaseException:
-                print('WaPOR API ERROR: Cannot get {url}'.format(
-                    url=request_url))
+            if resq_json['message'] == 'OK':
+                return resp
+            else:
+                print(resq_json['message'])
+        except BaseException:
+            print('WaPOR API ERROR: Cannot get {url}'.format(
+                url=request_url))
 
     def getWorkspaces(self):
         """Get workspace
@@ -282,35 +817,324 @@ class WaPOR_API_class(object):
             print(request_url)
 
         # requests
+        resq = self.request(
+            'GET',
+            request_url)
+        resq_json = resq.json()
         try:
-            resq = requests.get(
-                request_url)
-            resq.raise_for_status()
-        except requests.exceptions.HTTPError as err:
-            raise Exception("WaPOR API Http Error: {e}".format(e=err))
-        except requests.exceptions.ConnectionError as err:
-            raise Exception("WaPOR API Error Connecting: {e}".format(e=err))
-        except requests.exceptions.Timeout as err:
-            raise Exception("WaPOR API Timeout Error: {e}".format(e=err))
-        except requests.exceptions.RequestException as err:
-            raise Exception("WaPOR API OOps: Something Else {e}".format(e=err))
-        else:
-            resq_json = resq.json()
+            resp = resq_json['response']
+            # print(resp)
+
+            if resq_json['message'] == 'OK':
+                return resp
+            else:
+                print(resq_json['message'])
+        except BaseException:
+            print('WaPOR API ERROR: Cannot get {url}'.format(
+                url=request_url))
+
+    def setMetadataCache(self, path=None, ttl=None, mode='default',
+                         max_size=METADATA_MAX_SIZE):
+        """Set persistent metadata cache
+
+        Catalogs, cube measures, dimensions, dimension members and
+        the LOCATION table are kept in a local SQLite database.
+
+        Parameters
+        ----------
+        path: str, optional
+            SQLite database file, default None, no persistent cache.
+        ttl: dict, optional
+            Time-to-live per entity in seconds, ex. ``{'members': 3600}``.
+        mode: str, optional
+            'default', 'refresh' or 'offline', default 'default'.
+        max_size: int, optional
+            Maximum size of cached values in bytes, default 256 MB.
+        """
+        if self.metaCache is not None:
+            self.metaCache.close()
+            self.metaCache = None
+
+        if path is not None:
+            self.metaCache = MetadataCache(path, ttl=ttl, mode=mode,
+                                           max_size=max_size)
+
+    def setStreamDecode(self, stream=True):
+        """Set streaming JSON decoding of large query responses
+
+        Catalog, dimension members, LOCATION table and available data
+        responses are decoded from the byte stream into columns,
+        the whole response body is never held in memory.
+        Requires `ijson <https://pypi.org/project/ijson/>`_.
+
+        Parameters
+        ----------
+        stream: bool, optional
+            Decode responses from the byte stream, default True.
+        """
+        if stream:
             try:
-                resp = resq_json['response']
-                # print(resp)
+                import ijson  # noqa: F401
+            except ImportError:
+                raise ImportError(
+                    'WaPOR API ERROR: setStreamDecode: ijson is required,'
+                    ' pip install ijson')
+        self.streamDecode = stream
+
+    def setPageSize(self, page_size=PAGE_SIZE):
+        """Set paged retrieval of listing queries
+
+        Catalog, dimension members, LOCATION table and available data
+        are fetched in pages of ``page_size`` items, ``max_workers``
+        pages concurrently, instead of one ``paged=false`` response.
+        Pages are decoded with ``resq.json()``, streaming decoding is
+        not used for paged requests.
 
-                if resq_json['message'] == 'OK':
-                    return resp
-                else:
-                    print(resq_json['message'])
-            except BaseException:
-                print('WaPOR API ERROR: Cannot get {url}'.format(
-                    url=request_url))
+        Parameters
+        ----------
+        page_size: int, optional
+            Items per page, default 1000, None disables paged retrieval.
+        """
+        if page_size is not None:
+            if not isinstance(page_size, int) or page_size < 1:
+                raise ValueError(
+                    'WaPOR API ERROR: page_size "{v}"'
+                    ' is not correct!'.format(v=page_size))
+        self.pageSize = page_size
+
+    def _query_json(self, method, request_url, stream_items=None,
+                    flatten=False, paged=False, **kwargs):
+        """Send request, return response json
+
+        In streaming mode, the records at ``stream_items``,
+        ex. 'response.items', are decoded into columns.
+        With ``paged`` and page size set, the records of all pages
+        are returned at ``stream_items``.
+        """
+        if paged and self.pageSize is not None and stream_items is not None:
+            items = []
+            for page in self._iterPages(method, request_url, **kwargs):
+                items.extend(page)
+
+            keys = stream_items.split('.')
+            value = items
+            for key in reversed(keys[1:]):
+                value = {key: value}
+            return {
+                'message': 'OK',
+                keys[0]: value
+            }
+
+        if not self.streamDecode or stream_items is None:
+            return self.request(method, request_url, **kwargs).json()
+
+        rss = self._currentRSS()
+        resq = self.request(method, request_url, stream=True, **kwargs)
+        try:
+            resq_json = self._streamJSON(resq, stream_items, flatten)
+        finally:
+            resq.close()
+
+        if self.print_job:
+            after = self._currentRSS()
+            print('WaPOR API: RSS {0:.1f}MB before, {1:.1f}MB after,'
+                  ' {2:+.1f}MB {url}'.format(rss / 1048576.0,
+                                             after / 1048576.0,
+                                             (after - rss) / 1048576.0,
+                                             url=request_url))
+        return resq_json
+
+    def _streamJSON(self, resq, stream_items, flatten=False):
+        """Decode response json from byte stream
+
+        Records at ``stream_items`` become a dict of columns, missing
+        values are None. Other nested values are skipped.
+        With ``flatten``, nested objects of a record are split into
+        columns by path, ex. '1.metadata.raster.id', only one record is
+        held as objects at a time.
+        """
+        import ijson
+
+        columns = {}
+        nrows = 0
+        found = False
+        resq_json = {}
+
+        item_path = '{0}.item'.format(stream_items)
+        builder = None
+        depth = 0
+
+        resq.raw.decode_content = True
+        for path, event, value in ijson.parse(resq.raw, use_float=True):
+            if builder is None:
+                if path == stream_items and event == 'start_array':
+                    found = True
+                elif path == item_path and event in ['start_map',
+                                                     'start_array']:
+                    builder = ijson.ObjectBuilder()
+                elif '.' not in path and event in ['string', 'number',
+                                                   'boolean', 'null']:
+                    resq_json[path] = value
+                if builder is None:
+                    continue
+
+            if event == 'map_key':
+                value = sys.intern(value)
+            builder.event(event, value)
+            if event in ['start_map', 'start_array']:
+                depth += 1
+            elif event in ['end_map', 'end_array']:
+                depth -= 1
+            if depth > 0:
+                continue
+
+            record = builder.value
+            builder = None
+            if isinstance(record, list):
+                record = dict(enumerate(record))
+            if flatten:
+                record = self._flattenRecord(record)
+            for key in record:
+                if key not in columns:
+                    columns[key] = [None] * nrows
+            for key, column in columns.items():
+                column.append(record.get(key))
+            nrows += 1
+
+        if found:
+            keys = stream_items.split('.')
+            value = columns
+            for key in reversed(keys[1:]):
+                value = {key: value}
+            resq_json[keys[0]] = value
+        return resq_json
+
+    def _iterPages(self, method, request_url, page_size=None, **kwargs):
+        """Fetch pages concurrently, yield page items in page order
+
+        Up to ``max_workers`` pages are requested ahead, until a page has
+        less than ``page_size`` items.
+        """
+        if page_size is None:
+            page_size = self.pageSize
+        if page_size is None:
+            page_size = PAGE_SIZE
+
+        def fetch(page_no):
+            url, request_json = self._pageRequest(
+                request_url, kwargs.get('json'), page_size, page_no)
+            page_kwargs = dict(kwargs)
+            if request_json is not None:
+                page_kwargs['json'] = request_json
+
+            resq_json = self.request(method, url, **page_kwargs).json()
+            if resq_json.get('message') != 'OK':
+                raise Exception(
+                    'WaPOR API ERROR: Cannot get page {n} of {url},'
+                    ' {msg}'.format(n=page_no, url=request_url,
+                                    msg=resq_json.get('message')))
+            resp = resq_json['response']
+            if isinstance(resp, dict):
+                resp = resp.get('items', [])
+            return resp
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = collections.deque()
+            page_no = 1
+            try:
+                while True:
+                    while len(futures) < self.max_workers:
+                        futures.append(executor.submit(fetch, page_no))
+                        page_no += 1
+
+                    items = futures.popleft().result()
+                    if items:
+                        yield items
+                    if len(items) < page_size:
+                        return
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    @staticmethod
+    def _pageRequest(request_url, request_json, page_size, page_no):
+        """Request url and json of one page
+        """
+        if request_json is None:
+            page = 'paged=true&pageSize={0}&pageNo={1}'.format(
+                page_size, page_no)
+            if 'paged=false' in request_url:
+                request_url = request_url.replace('paged=false', page)
+            elif '?' in request_url:
+                request_url = '{0}&{1}'.format(request_url, page)
+            else:
+                request_url = '{0}?{1}'.format(request_url, page)
+        else:
+            request_json = copy.deepcopy(request_json)
+            properties = request_json['params'].setdefault('properties', {})
+            properties['paged'] = True
+            properties['pageSize'] = page_size
+            properties['pageNo'] = page_no
+        return request_url, request_json
+
+    @staticmethod
+    def _flattenRecord(record, prefix=''):
+        """Split nested objects of record into columns by path
+        """
+        flat = {}
+        for key, value in record.items():
+            name = sys.intern('{0}{1}'.format(prefix, key))
+            if isinstance(value, dict) and value:
+                flat.update(WaPOR_API_class._flattenRecord(
+                    value, '{0}.'.format(name)))
+            else:
+                flat[name] = value
+        return flat
+
+    def _query_metadata(self, entity, method, request_url,
+                        stream_items=None, refresh=False, **kwargs):
+        """Query metadata through the metadata cache, return response json
+
+        With ``refresh``, the cached entry is not used, and is replaced
+        by the server response.
+        """
+        if self.metaCache is None:
+            return self._query_json(method, request_url,
+                                    stream_items=stream_items, **kwargs)
+
+        key = request_url
+        if 'json' in kwargs:
+            key = '{0} {1}'.format(
+                request_url, json.dumps(kwargs['json'], sort_keys=True))
+
+        resp = None
+        if not refresh:
+            resp = self.metaCache.get(entity, key)
+        if resp is not None:
+            with self._stats_lock:
+                self.stats['metadata_hits'] += 1
+            return {
+                'message': 'OK',
+                'response': resp
+            }
+
+        if self.metaCache.mode == 'offline':
+            raise Exception(
+                'WaPOR API ERROR: "{url}" is not in metadata cache,'
+                ' offline mode'.format(url=request_url))
+
+        resq_json = self._query_json(method, request_url,
+                                     stream_items=stream_items, **kwargs)
+        if resq_json.get('message') == 'OK' and 'response' in resq_json:
+            self.metaCache.put(entity, key, resq_json['response'])
+        return resq_json
 
     def getCatalog(self, version=None, level=None, cubeInfo=True):
         """Get catalog from workspace
 
+        Catalogs are cached per (version, level), each catalog is
+        queried once, see :meth:`invalidateCatalog`.
+
         Parameters
         ----------
         version: int, optional
@@ -329,112 +1153,232 @@ class WaPOR_API_class(object):
             v=version, lv=level))
         self.isAPITokenSet()
 
-        isFound = False
+        key = self._catalogKey(version, level)
 
-        # if isinstance(version, int) and isinstance(level, int):
-        #     print('| int')
-        #     if 0 < version < 3 and 0 < level < 4:
-        #         print('|  range')
-        if version == self.version and level == self.level:
-            # print('|   equal')
-            if self.catalog is not None:
-                # print('|    not None')
-                isFound = True
+        with self._catalog_lock:
+            df = self.catalogs.get(key)
 
-        if isFound:
-            df = self.catalog
+            if df is not None:
+                print('WaPOR API: Loading catalog WaPOR.v{v}_l{lv} found.'.format(
+                    v=version, lv=level))
+            else:
+                df = self._query_catalog(*key)
+                if df is None:
+                    return None
+                if key[1] is not None:
+                    self._indexCatalog(df, *key)
 
-            print('WaPOR API: Loading catalog WaPOR.v{v}_l{lv} found.'.format(
-                v=version, lv=level))
-        else:
-            df = self._query_catalog(version, level)
+                print('WaPOR API: Loading catalog WaPOR.v{v}_l{lv} loaded.'.format(
+                    v=version, lv=level))
 
-            print('WaPOR API: Loading catalog WaPOR.v{v}_l{lv} loaded.'.format(
-                v=version, lv=level))
+            if cubeInfo and 'measure' not in df.columns:
+                cubes_meta = self._query_cubesMeta(df['code'].values, key[0])
+                df['measure'] = [meta['measure'] for meta in cubes_meta]
+                df['dimension'] = [meta['dimension'] for meta in cubes_meta]
 
-        if cubeInfo:
-            cubes_measure = []
-            cubes_dimension = []
-            for cube_code in df['code'].values:
-                cubes_measure.append(self._query_cubeMeasures(cube_code))
-                cubes_dimension.append(self._query_cubeDimensions(cube_code))
-            df['measure'] = cubes_measure
-            df['dimension'] = cubes_dimension
+            self.catalogs[key] = df
+            self.version, self.level = key
 
         self.catalog = df
         return self.catalog
 
-    def _query_catalog(self, version=None, level=None):
-        """Query catalog from workspace
+    def getCubeMeta(self, cube_code, version=None):
+        """Get cube measure and dimensions
+
+        Only the requested cube is queried, results are cached per cube.
+
+        Parameters
+        ----------
+        cube_code: str
+            Cube code.
+        version: int, optional
+            WaPOR workspace version, default current version.
+
+        Returns
+        -------
+        cube_meta: dict
+            Cube 'measure' and 'dimension'.
         """
-        print('WaPOR API:   _query_catalog')
+        if version is None:
+            version = self.version
+        return self._query_cubesMeta([cube_code], version)[0]
 
-        if isinstance(version, int):
-            if 0 < version < 3:
-                self.version = version
-            else:
-                raise ValueError(
-                    'WaPOR API ERROR: _query_catalog: Version "{v}"'
-                    ' is not correct!'.format(v=version))
+    def _query_cubesMeta(self, cube_codes, version):
+        """Query measures and dimensions of cubes concurrently
 
-        if isinstance(level, int):
-            if 0 < level < 4:
-                self.level = level
-            else:
+        Runs on ``max_workers`` threads, results are cached per cube.
+        """
+        missing = [cube_code for cube_code in cube_codes
+                   if (version, cube_code) not in self.cubes]
+
+        if missing:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                measures = executor.map(
+                    functools.partial(self._query_cubeMeasures,
+                                      version=version), missing)
+                dimensions = executor.map(
+                    functools.partial(self._query_cubeDimensions,
+                                      version=version), missing)
+
+                for cube_code, measure, dimension in zip(
+                        missing, measures, dimensions):
+                    if measure is None or dimension is None:
+                        continue
+                    self.cubes[(version, cube_code)] = {
+                        'measure': measure,
+                        'dimension': dimension
+                    }
+
+        cubes_meta = []
+        for cube_code in cube_codes:
+            meta = self.cubes.get((version, cube_code),
+                                  {'measure': None, 'dimension': None})
+            cubes_meta.append(meta)
+        return cubes_meta
+
+    def invalidateCatalog(self, version=None, level=None):
+        """Remove catalogs from cache
+
+        Catalogs, and measures, dimensions and index entries of their
+        cubes, are removed from memory and from the metadata cache.
+
+        Parameters
+        ----------
+        version: int, optional
+            WaPOR workspace version, default None, all versions.
+        level: int, optional
+            Data resolution level, default None, all levels.
+        """
+        with self._catalog_lock:
+            cube_codes = {}
+            for key in list(self.catalogs.keys()):
+                if version is not None and key[0] != version:
+                    continue
+                if level is not None and key[1] != level:
+                    continue
+                catalog = self.catalogs.pop(key)
+                for cube_code in catalog['code'].values:
+                    self.cubes.pop((key[0], cube_code), None)
+                    self.cubeIndex.pop((key[0], cube_code), None)
+                    cube_codes.setdefault(key[0], set()).add(cube_code)
+            self.catalog = None
+
+            if self.metaCache is not None:
+                versions = [version]
+                if version is None:
+                    versions = list(self.workspaces.keys())
+                for cube_version in versions:
+                    self._invalidateMetadata(
+                        cube_version, level,
+                        cube_codes.get(cube_version, set()))
+
+    def _invalidateMetadata(self, version, level, cube_codes):
+        """Remove catalogs of a workspace from the metadata cache
+        """
+        catalog_url = self._catalogURL(version, level)
+        cubes_url = '{0}{1}/cubes/'.format(self.path['catalog'],
+                                           self.workspaces[version])
+
+        if level is None:
+            # Catalog url without level tag prefixes all levels
+            self.metaCache.invalidate('catalog', catalog_url)
+            for entity in ['measures', 'dimensions', 'members']:
+                self.metaCache.invalidate(entity, cubes_url)
+            self.metaCache.invalidate(
+                'index', '{0}/'.format(self.workspaces[version]))
+            return
+
+        # Cube codes of the catalog, if not loaded
+        resp = self.metaCache.get('catalog', catalog_url)
+        if resp:
+            catalog = pd.DataFrame.from_dict(resp, orient='columns')
+            if 'code' in catalog.columns:
+                cube_codes = cube_codes | set(catalog['code'].values)
+
+        self.metaCache.invalidate('catalog', catalog_url)
+        for cube_code in cube_codes:
+            cube_url = '{0}{1}/'.format(cubes_url, cube_code)
+            for entity in ['measures', 'dimensions', 'members']:
+                self.metaCache.invalidate(entity, cube_url)
+            self.metaCache.invalidate(
+                'index', self._indexKey(version, cube_code))
+
+    def _catalogKey(self, version=None, level=None):
+        """Catalog cache key (version, level)
+        """
+        if version is None:
+            version = self.version
+        if not isinstance(version, int) or not 0 < version < 3:
+            raise ValueError(
+                'WaPOR API ERROR: getCatalog: Version "{v}"'
+                ' is not correct!'.format(v=version))
+        if level is not None:
+            if not isinstance(level, int) or not 0 < level < 4:
                 raise ValueError(
-                    'WaPOR API ERROR: _query_catalog: Level "{lv}"'
+                    'WaPOR API ERROR: getCatalog: Level "{lv}"'
                     ' is not correct!'.format(lv=level))
-        elif level is None:
-            self.version = version
-        else:
-            raise ValueError(
-                'WaPOR API ERROR: _query_catalog: Level "{lv}"'
-                ' is not correct!'.format(lv=level))
+        return version, level
 
-        if self.level is None:
+    def _catalogURL(self, version, level=None):
+        """Catalog request url of a workspace and level
+        """
+        if level is None:
             base_url = '{0}{1}/cubes?overview=false&paged=false'
             request_url = base_url.format(
                 self.path['catalog'],
-                self.workspaces[self.version])
+                self.workspaces[version])
         else:
             base_url = '{0}{1}/cubes?overview=false&paged=false&tags=L{2}'
             request_url = base_url.format(
                 self.path['catalog'],
-                self.workspaces[self.version],
-                self.level)
+                self.workspaces[version],
+                level)
+        return request_url
+
+    def _query_catalog(self, version=None, level=None):
+        """Query catalog from workspace
+        """
+        print('WaPOR API:   _query_catalog')
+
+        if version is None:
+            version = self.version
+        if not isinstance(version, int) or not 0 < version < 3:
+            raise ValueError(
+                'WaPOR API ERROR: _query_catalog: Version "{v}"'
+                ' is not correct!'.format(v=version))
+
+        if level is not None:
+            if not isinstance(level, int) or not 0 < level < 4:
+                raise ValueError(
+                    'WaPOR API ERROR: _query_catalog: Level "{lv}"'
+                    ' is not correct!'.format(lv=level))
+
+        request_url = self._catalogURL(version, level)
 
         if self.print_job:
             print(request_url)
 
         # requests
-        try:
-            resq = requests.get(
-                request_url)
-            resq.raise_for_status()
-        except requests.exceptions.HTTPError as err:
-            raise Exception("WaPOR API Http Error: {e}".format(e=err))
-        except requests.exceptions.ConnectionError as err:
-            raise Exception("WaPOR API Error Connecting: {e}".format(e=err))
-        except requests.exceptions.Timeout as err:
-            raise Exception("WaPOR API Timeout Error: {e}".format(e=err))
-        except requests.exceptions.RequestException as err:
-            raise Exception("WaPOR API OOps: Something Else {e}".format(e=err))
-        else:
-            resq_json = resq.json()
+        resq_json = self._query_metadata(
+            'catalog',
+            'GET',
+            request_url,
+            stream_items='response',
+            paged=True)
 
-            try:
-                resp = resq_json['response']
-                # print(resp)
+        try:
+            resp = resq_json['response']
+            # print(resp)
 
-                if resq_json['message'] == 'OK':
-                    df = pd.DataFrame.from_dict(resp, orient='columns')
-                    return df
-                    # return df.sort_values(['code'], ascending=[True])
-                else:
-                    print(resq_json['message'])
-            except BaseException:
-                print('WaPOR API ERROR: Cannot get {url}'.format(
-                    url=request_url))
+            if resq_json['message'] == 'OK':
+                df = pd.DataFrame.from_dict(resp, orient='columns')
+                return df
+                # return df.sort_values(['code'], ascending=[True])
+            else:
+                print(resq_json['message'])
+        except BaseException:
+            print('WaPOR API ERROR: Cannot get {url}'.format(
+                url=request_url))
 
     # def _query_cubeInfo(self,cube_code):
     #     request_url = r'{0}{1}/cubes/{2}?overview=false'.format(self.path['catalog'],
@@ -450,6 +1394,9 @@ class WaPOR_API_class(object):
     def getCubeInfo(self, cube_code, version=None, level=None):
         """Get cube info
 
+        Without valid version and level, the workspace and level of the
+        cube are resolved by :meth:`resolveCube`.
+
         Parameters
         ----------
         cube_code: str
@@ -468,141 +1415,188 @@ class WaPOR_API_class(object):
             c_code=cube_code))
         self.isAPITokenSet()
 
-        isFound = False
-
-        if isinstance(version, int) and isinstance(level, int):
-            if 0 < version < 3 and 0 < level < 4:
-                isFound = True
-
-        if not isFound:
-            version, level = 2, 3
-            catalog = self.getCatalog(version, level, cubeInfo=False)
-            if cube_code in catalog['code'].tolist():
-                isFound = True
-
-        if not isFound:
-            version, level = 2, 2
-            catalog = self.getCatalog(version, level, cubeInfo=False)
-            if cube_code in catalog['code'].tolist():
-                isFound = True
-
-        if not isFound:
-            version, level = 2, 1
-            catalog = self.getCatalog(version, level, cubeInfo=False)
-            if cube_code in catalog['code'].tolist():
-                isFound = True
-
-        if not isFound:
-            version, level = 1, 3
-            catalog = self.getCatalog(version, level, cubeInfo=False)
-            if cube_code in catalog['code'].tolist():
-                isFound = True
-
-        if not isFound:
-            version, level = 1, 2
-            catalog = self.getCatalog(version, level, cubeInfo=False)
-            if cube_code in catalog['code'].tolist():
-                isFound = True
-
-        if not isFound:
-            version, level = 1, 1
-            catalog = self.getCatalog(version, level, cubeInfo=False)
-            if cube_code in catalog['code'].tolist():
-                isFound = True
+        version, level = self._resolveVersion(cube_code, version, level)
 
-        if isFound:
+        if version is not None:
             print('WaPOR API: "{c_code}" is found in WaPOR.v{v}_l{lv}'.format(
                 c_code=cube_code, v=version, lv=level))
 
-            catalog = self.getCatalog(version, level, cubeInfo=True)
-            cube_info = catalog.loc[catalog['code'] == cube_code].to_dict('records')[0]
+            catalog = self.getCatalog(version, level, cubeInfo=False)
+            cube_info = catalog.loc[catalog['code'] == cube_code].to_dict('records')
+            if not cube_info:
+                raise ValueError(
+                    'WaPOR API ERROR: "{c_code}" is not available in'
+                    ' WaPOR.v{v}_l{lv}'.format(
+                        c_code=cube_code, v=version, lv=level))
+
+            cube_info = cube_info[0]
+            cube_info.update(self.getCubeMeta(cube_code, version))
             return cube_info
         else:
             raise ValueError(
                 'WaPOR API ERROR: "{c_code}" is not available in WaPOR'.format(
                     c_code=cube_code))
 
-    def _query_cubeMeasures(self, cube_code):
-        """Query cube measures
+    def _resolveVersion(self, cube_code, version=None, level=None):
+        """Workspace version and level of a cube, (None, None) if not found
+
+        Valid version and level are used as is, otherwise resolved by
+        :meth:`resolveCube`.
+        """
+        if isinstance(version, int) and isinstance(level, int):
+            if 0 < version < 3 and 0 < level < 4:
+                return version, level
+
+        cube = self.resolveCube(cube_code)
+        if cube is None:
+            return None, None
+        return cube['version'], cube['level']
+
+    def resolveCube(self, cube_code):
+        """Resolve workspace version and level of a cube code
+
+        Catalogs are searched in the order WaPOR.v2 L3, L2, L1, then
+        WaPOR.v1 L3, L2, L1, a code in both workspaces resolves to v2.
+        Within a workspace the level of the "L1_", "L2_" or "L3_" prefix
+        is searched first. Each catalog is checked against the cube code
+        index, built from the loaded catalogs and kept in the metadata
+        cache, before the catalog is loaded.
+
+        Parameters
+        ----------
+        cube_code: str
+            Cube code, ex. 'L2_AETI_D'.
+
+        Returns
+        -------
+        cube: dict
+            Cube 'version', 'workspace' and 'level', None if not found.
+        """
+        candidates = list(CUBE_CANDIDATES)
+
+        prefix = re.match(r'^L([1-3])_', cube_code)
+        if prefix is not None:
+            level = int(prefix.group(1))
+            candidates.sort(key=lambda key: (-key[0], key[1] != level))
+
+        for version, level in candidates:
+            cube = self._lookupIndex(version, cube_code)
+            if cube is not None:
+                return cube
+
+            self.getCatalog(version, level, cubeInfo=False)
+            cube = self._lookupIndex(version, cube_code)
+            if cube is not None:
+                return cube
+        return None
+
+    def _lookupIndex(self, version, cube_code):
+        """Look up cube code of a workspace in the cube code index
+        """
+        key = (version, cube_code)
+        cube = self.cubeIndex.get(key)
+        if cube is None and self.metaCache is not None:
+            cube = self.metaCache.get('index', self._indexKey(*key))
+            if cube is not None:
+                self.cubeIndex[key] = cube
+        return cube
+
+    def _indexKey(self, version, cube_code):
+        """Metadata cache key of the cube code index, 'workspace/code'
+        """
+        return '{0}/{1}'.format(self.workspaces[version], cube_code)
+
+    def _indexCatalog(self, catalog, version, level):
+        """Add catalog cube codes to the cube code index
+
+        A cube code found in two levels of a workspace keeps the level
+        searched first by :meth:`resolveCube`.
+        """
+        rank = CUBE_CANDIDATES.index((version, level))
+
+        cubes = {}
+        for cube_code in catalog['code'].values:
+            cube = self.cubeIndex.get((version, cube_code))
+            if cube is not None and \
+                    CUBE_CANDIDATES.index((version, cube['level'])) < rank:
+                continue
+
+            cube = {
+                'version': version,
+                'workspace': self.workspaces[version],
+                'level': level
+            }
+            self.cubeIndex[(version, cube_code)] = cube
+            cubes[self._indexKey(version, cube_code)] = cube
+
+        if self.metaCache is not None and cubes:
+            self.metaCache.putMany('index', cubes)
+
+    def _query_cubeMeasures(self, cube_code, version=None):
+        """Query cube measures
         """
         # print('WaPOR API:   _query_cubeMeasures')
+        if version is None:
+            version = self.version
 
         base_url = '{0}{1}/cubes/{2}/measures?overview=false&paged=false'
         request_url = base_url.format(
             self.path['catalog'],
-            self.workspaces[self.version],
+            self.workspaces[version],
             cube_code)
 
         if self.print_job:
             print(request_url)
 
         # requests
-        try:
-            resq = requests.get(
-                request_url)
-            resq.raise_for_status()
-        except requests.exceptions.HTTPError as err:
-            raise Exception("WaPOR API Http Error: {e}".format(e=err))
-        except requests.exceptions.ConnectionError as err:
-            raise Exception("WaPOR API Error Connecting: {e}".format(e=err))
-        except requests.exceptions.Timeout as err:
-            raise Exception("WaPOR API Timeout Error: {e}".format(e=err))
-        except requests.exceptions.RequestException as err:
-            raise Exception("WaPOR API OOps: Something Else {e}".format(e=err))
-        else:
-            resq_json = resq.json()
+        resq_json = self._query_metadata(
+            'measures',
+            'GET',
+            request_url)
 
-            try:
-                resp = resq_json['response']
-                # print(resp)
+        try:
+            resp = resq_json['response']
+            # print(resp)
 
-                if resq_json['message'] == 'OK':
-                    return resp[0]
-                else:
-                    print(resq_json['message'])
-            except BaseException:
-                print('WaPOR API ERROR: Cannot get {url}'.format(
-                    url=request_url))
+            if resq_json['message'] == 'OK':
+                return resp[0]
+            else:
+                print(resq_json['message'])
+        except BaseException:
+            print('WaPOR API ERROR: Cannot get {url}'.format(
+                url=request_url))
 
-    def _query_cubeDimensions(self, cube_code):
+    def _query_cubeDimensions(self, cube_code, version=None):
         """Query cube dimensions
         """
         # print('WaPOR API:   _query_cubeDimensions')
+        if version is None:
+            version = self.version
 
         base_url = '{0}{1}/cubes/{2}/dimensions?overview=false&paged=false'
         request_url = base_url.format(
             self.path['catalog'],
-            self.workspaces[self.version],
+            self.workspaces[version],
             cube_code)
 
         if self.print_job:
             print(request_url)
 
         # requests
+        resq_json = self._query_metadata(
+            'dimensions',
+            'GET',
+            request_url)
         try:
-            resq = requests.get(
-                request_url)
-            resq.raise_for_status()
-        except requests.exceptions.HTTPError as err:
-            raise Exception("WaPOR API Http Error: {e}".format(e=err))
-        except requests.exceptions.ConnectionError as err:
-            raise Exception("WaPOR API Error Connecting: {e}".format(e=err))
-        except requests.exceptions.Timeout as err:
-            raise Exception("WaPOR API Timeout Error: {e}".format(e=err))
-        except requests.exceptions.RequestException as err:
-            raise Exception("WaPOR API OOps: Something Else {e}".format(e=err))
-        else:
-            resq_json = resq.json()
-            try:
-                resp = resq_json['response']
-                # print(resp)
+            resp = resq_json['response']
+            # print(resp)
 
-                if resq_json['message'] == 'OK':
-                    return resp
-                else:
-                    print(resq_json['message'])
-            except BaseException:
-                print('WaPOR API ERROR: Cannot get {url}'.format(url=request_url))
+            if resq_json['message'] == 'OK':
+                return resp
+            else:
+                print(resq_json['message'])
+        except BaseException:
+            print('WaPOR API ERROR: Cannot get {url}'.format(url=request_url))
 
     def getAvailData(self, cube_code, time_range='2009-01-01,2018-12-31',
                      location=[], season=[], stage=[],
@@ -635,6 +1629,314 @@ class WaPOR_API_class(object):
         self.isAPITokenExpired()
         # AccessToken = self.token['Access']
 
+        try:
+            df_sorted = self._availData(cube_code, time_range,
+                                        location, season, stage,
+                                        version, level)
+        except BaseException:
+            print('WaPOR API ERROR:Cannot get list of available data')
+            return None
+        return df_sorted
+
+    def _availData(self, cube_code, time_range, location, season, stage,
+                   version, level):
+        """Query Available Data in one response, raise on errors
+        """
+        version, level = self._resolveVersion(cube_code, version, level)
+        query = self._query_availDims(cube_code, time_range,
+                                      location, season, stage,
+                                      version, level)
+        (cube_measure_code, dims_ls, columns_codes, rows_codes,
+         time_dims_code, df_time) = query
+
+        df = self._query_availData(cube_code, cube_measure_code,
+                                   dims_ls, columns_codes, rows_codes,
+                                   version)
+        if df is None:
+            raise Exception(
+                'WaPOR API ERROR: Cannot get list of available data'
+                ' of "{c_code}"'.format(c_code=cube_code))
+
+        # sorted df
+        keys = rows_codes + ['raster_id', 'bbox', 'time_code']
+        return self._parse_availData(
+            df, keys, time_dims_code, df_time,
+            refresh_time=functools.partial(
+                self._query_dimensionsMembers, cube_code, time_dims_code,
+                version, refresh=True))
+
+    def getAvailDataMany(self, cube_codes, time_range='2009-01-01,2018-12-31',
+                         location=[], season=[], stage=[],
+                         version=None, level=None):
+        """Get Available Data of many cubes
+
+        Catalogs and cube metadata are loaded once for all cubes,
+        the cube queries run on ``max_workers`` threads.
+
+        Parameters
+        ----------
+        cube_codes: list
+            ex. ['L1_AETI_D', 'L1_PCP_D'].
+        time_range: str, optional
+            ex. '2009-01-01,2018-12-31'.
+        location: list, str, optional
+            default: empty list, return all available locations, ex. ['ETH'].
+        season: list, str, optional
+            default: empty list, return all available seasons, ex. ['S1'].
+        stage: list, str, optional
+            default: empty list, return all available stages, ex. ['EOS','SOS'].
+        version: int, optional
+            WaPOR workspace version, default None, resolved per cube.
+        level: int, optional
+            Data resolution level, default None, resolved per cube.
+
+        Returns
+        -------
+        data: :obj:`pandas.DataFrame`
+            Available Data table of all cubes,
+            indexed by 'cube_code' and 'time_code'.
+        """
+        # Check AccessToken expires
+        self.isAPITokenExpired()
+
+        # Resolve workspace and level, group cubes by workspace
+        workspaces = {}
+        cube_keys = {}
+        for cube_code in cube_codes:
+            if isinstance(version, int) and isinstance(level, int):
+                cube = {'version': version, 'level': level}
+            else:
+                cube = self.resolveCube(cube_code)
+            if cube is None:
+                print('WaPOR API ERROR: "{c_code}" is not available'
+                      ' in WaPOR'.format(c_code=cube_code))
+                continue
+            workspaces.setdefault(cube['version'], []).append(cube_code)
+            cube_keys[cube_code] = (cube['version'], cube['level'])
+
+        for cube_version, codes in workspaces.items():
+            self._query_cubesMeta(codes, cube_version)
+
+        # Version and level are passed to each query, not shared
+        def query(cube_code):
+            cube_version, cube_level = cube_keys[cube_code]
+            return self.getAvailData(cube_code, time_range=time_range,
+                                     location=location, season=season,
+                                     stage=stage, version=cube_version,
+                                     level=cube_level)
+
+        codes = list(cube_keys.keys())
+        frames = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for cube_code, df in zip(codes, executor.map(query, codes)):
+                if df is not None:
+                    frames[cube_code] = df
+
+        if not frames:
+            return None
+
+        dfs = []
+        for cube_code in cube_codes:
+            if cube_code in frames:
+                df = frames[cube_code]
+                df.insert(0, 'cube_code', cube_code)
+                dfs.append(df)
+        df = pd.concat(dfs, ignore_index=True, sort=False)
+        return df.set_index(['cube_code', 'time_code'])
+
+    def iterAvailData(self, cube_code, time_range='2009-01-01,2018-12-31',
+                      location=[], season=[], stage=[],
+                      version=None, level=None, page_size=None):
+        """Iterate Available Data page by page
+
+        Pages are fetched ``max_workers`` at a time, and yielded in order
+        as they arrive, first rows can be processed while later pages
+        are loading. Without page size, see :meth:`setPageSize`, the
+        table is queried as one ``paged=false`` response and yielded
+        as one page. Unlike :meth:`getAvailData`, errors are raised.
+
+        Parameters
+        ----------
+        cube_code: str
+            ex. 'L2_CTY_PHE_S'.
+        time_range: str, optional
+            ex. '2009-01-01,2018-12-31'.
+        location: list, str, optional
+            default: empty list, return all available locations, ex. ['ETH'].
+        season: list, str, optional
+            default: empty list, return all available seasons, ex. ['S1'].
+        stage: list, str, optional
+            default: empty list, return all available stages, ex. ['EOS','SOS'].
+        version: int, optional
+            WaPOR workspace version, default 2.
+        level: int, optional
+            Data resolution level, default None.
+        page_size: int, optional
+            Rows per page, default None, the page size of the client.
+
+        Yields
+        ------
+        data: :obj:`pandas.DataFrame`
+            Available Data table of one page, same columns as
+            :meth:`getAvailData`.
+        """
+        # Check AccessToken expires
+        self.isAPITokenExpired()
+
+        if page_size is None:
+            page_size = self.pageSize
+        if page_size is None:
+            yield self._availData(cube_code, time_range,
+                                  location, season, stage, version, level)
+            return
+
+        version, level = self._resolveVersion(cube_code, version, level)
+        query = self._query_availDims(cube_code, time_range,
+                                      location, season, stage,
+                                      version, level)
+        (cube_measure_code, dims_ls, columns_codes, rows_codes,
+         time_dims_code, df_time) = query
+        keys = rows_codes + ['raster_id', 'bbox', 'time_code']
+
+        members = {'time': df_time}
+
+        def refresh_time():
+            members['time'] = self._query_dimensionsMembers(
+                cube_code, time_dims_code, version, refresh=True)
+            return members['time']
+
+        request_json = self._availDataJSON(cube_code, cube_measure_code,
+                                           dims_ls, columns_codes, rows_codes,
+                                           version)
+        offset = 0
+        for items in self._iterPages('POST', self.path['query'],
+                                     page_size=page_size,
+                                     json=request_json):
+            df = self._parse_availData(pd.DataFrame(items), keys,
+                                       time_dims_code, members['time'],
+                                       refresh_time=refresh_time)
+            # Row index continues over pages
+            df.index += offset
+            offset += len(df)
+            yield df
+
+    def setSyncState(self, path=None):
+        """Set incremental availability sync state file
+
+        Parameters
+        ----------
+        path: str, optional
+            Local state file, shared by worker processes,
+            default None, no sync state.
+        """
+        self.syncState = None
+        if path is not None:
+            self.syncState = SyncState(path)
+
+    def syncAvailData(self, cube_code, bbox,
+                      time_range='2009-01-01,2018-12-31',
+                      location=[], season=[], stage=[],
+                      version=None, level=None):
+        """Get Available Data after the last synced time code
+
+        Only time members after the last committed time code of the cube
+        and bounding box are queried, see :meth:`commitAvailData`.
+
+        Parameters
+        ----------
+        cube_code: str
+            ex. 'L1_AETI_D'.
+        bbox: list
+            [xmin, ymin, xmax, ymax].
+        time_range: str, optional
+            ex. '2009-01-01,2018-12-31'.
+        location: list, str, optional
+            default: empty list, return all available locations, ex. ['ETH'].
+        season: list, str, optional
+            default: empty list, return all available seasons, ex. ['S1'].
+        stage: list, str, optional
+            default: empty list, return all available stages, ex. ['EOS','SOS'].
+        version: int, optional
+            WaPOR workspace version, default 2.
+        level: int, optional
+            Data resolution level, default None.
+
+        Returns
+        -------
+        data: :obj:`pandas.DataFrame`
+            Available Data table of new rasters.
+        """
+        if self.syncState is None:
+            raise Exception('WaPOR API ERROR: syncAvailData:'
+                            ' Sync state is not set, see setSyncState!')
+
+        cube = self._syncCube(cube_code, version)
+        start, end = [date.strip() for date in time_range.split(',')]
+
+        state = self.syncState.get(cube, bbox)
+        if state is not None:
+            if state['end'] > start:
+                start = state['end']
+            if start > end:
+                print('WaPOR API: Sync "{c}" up to date, last {t}'.format(
+                    c=cube_code, t=state['time_code']))
+                return pd.DataFrame(columns=['raster_id', 'bbox', 'time_code'])
+
+        df = self.getAvailData(cube_code, '{0},{1}'.format(start, end),
+                               location=location, season=season, stage=stage,
+                               version=version, level=level)
+        if df is None:
+            return None
+
+        if state is not None and len(df) > 0:
+            ends = df['time_code'].map(SyncState.timeEnd)
+            df = df.loc[ends > state['end']].reset_index(drop=True)
+
+        print('WaPOR API: Sync "{c}" {n} new rasters after {t}'.format(
+            c=cube_code, n=len(df),
+            t=None if state is None else state['time_code']))
+        return df
+
+    def commitAvailData(self, cube_code, bbox, data, version=None):
+        """Store synced rasters of Available Data
+
+        Parameters
+        ----------
+        cube_code: str
+            ex. 'L1_AETI_D'.
+        bbox: list
+            [xmin, ymin, xmax, ymax].
+        data: :obj:`pandas.DataFrame`, :obj:`pandas.Series`
+            Available Data table, or one row, that has been downloaded.
+        version: int, optional
+            WaPOR workspace version, default 2.
+        """
+        if self.syncState is None:
+            raise Exception('WaPOR API ERROR: commitAvailData:'
+                            ' Sync state is not set, see setSyncState!')
+
+        cube = self._syncCube(cube_code, version)
+        if isinstance(data, pd.DataFrame):
+            rows = zip(data['time_code'], data['raster_id'])
+        else:
+            rows = [(data['time_code'], data['raster_id'])]
+
+        for time_code, raster_id in rows:
+            self.syncState.update(cube, bbox, time_code, raster_id)
+
+    def _syncCube(self, cube_code, version=None):
+        """Sync state name of cube, workspace and cube code
+        """
+        if version is None:
+            version = self.version
+        return '{0}/{1}'.format(self.workspaces[version], cube_code)
+
+    def _query_availDims(self, cube_code, time_range,
+                         location, season, stage, version, level):
+        """Query cube measure and dimensions members of Available Data
+
+        ``version`` and ``level`` are resolved, see :meth:`_resolveVersion`.
+        """
         # Get measure_code and dimension_code
         try:
             cube_info = self.getCubeInfo(cube_code, version=version, level=level)
@@ -650,70 +1952,121 @@ class WaPOR_API_class(object):
         dims_ls = []
         columns_codes = ['MEASURES']
         rows_codes = []
-        try:
-            for dims in cube_dimensions:
-                if dims['type'] == 'TIME':  # get time dims
-                    time_dims_code = dims['code']
-                    df_time = self._query_dimensionsMembers(cube_code, time_dims_code)
-
-                    time_dims = {
-                        "code": time_dims_code,
-                        "range": '[{0})'.format(time_range)
-                    }
-                    dims_ls.append(time_dims)
-                    rows_codes.append(time_dims_code)
-
-                if dims['type'] == 'WHAT':
-                    dims_code = dims['code']
-                    df_dims = self._query_dimensionsMembers(cube_code, dims_code)
-
-                    members_ls = [row['code'] for i, row in df_dims.iterrows()]
-                    if (dims_code == 'COUNTRY' or dims_code == 'BASIN'):
-                        if location:
-                            members_ls = location
-                    if (dims_code == 'SEASON'):
-                        if season:
-                            members_ls = season
-                    if (dims_code == 'STAGE'):
-                        if stage:
-                            members_ls = stage
-
-                    what_dims = {
-                        "code": dims['code'],
-                        "values": members_ls
-                    }
-                    dims_ls.append(what_dims)
-                    rows_codes.append(dims['code'])
+        time_dims_code = None
+        df_time = None
+        for dims in cube_dimensions:
+            if dims['type'] == 'TIME':  # get time dims
+                time_dims_code = dims['code']
+                df_time = self._query_dimensionsMembers(
+                    cube_code, time_dims_code, version)
+
+                time_dims = {
+                    "code": time_dims_code,
+                    "range": '[{0})'.format(time_range)
+                }
+                dims_ls.append(time_dims)
+                rows_codes.append(time_dims_code)
+
+            if dims['type'] == 'WHAT':
+                dims_code = dims['code']
+                df_dims = self._query_dimensionsMembers(
+                    cube_code, dims_code, version)
+
+                members_ls = df_dims['code'].tolist()
+                if (dims_code == 'COUNTRY' or dims_code == 'BASIN'):
+                    if location:
+                        members_ls = location
+                if (dims_code == 'SEASON'):
+                    if season:
+                        members_ls = season
+                if (dims_code == 'STAGE'):
+                    if stage:
+                        members_ls = stage
+
+                what_dims = {
+                    "code": dims['code'],
+                    "values": members_ls
+                }
+                dims_ls.append(what_dims)
+                rows_codes.append(dims['code'])
 
-            df = self._query_availData(cube_code, cube_measure_code,
-                                       dims_ls, columns_codes, rows_codes)
-        except BaseException:
-            print('WaPOR API ERROR:Cannot get list of available data')
-            return None
+        return (cube_measure_code, dims_ls, columns_codes, rows_codes,
+                time_dims_code, df_time)
+
+    def _parse_availData(self, df, keys, time_dims_code, df_time,
+                         refresh_time=None):
+        """Decode MDAQuery_Table cells column by column
+
+        Cells are objects by position, or flattened columns by path from
+        streaming decoding, ex. '1.metadata.raster.id'.
+        Time captions are mapped to time codes by a hash map. A caption
+        missing from ``df_time``, a time member published after the
+        members were cached, loads the members once by ``refresh_time``.
+        """
+        time_codes = self._timeCodes(df_time)
+
+        positions = sorted(set(int(str(col).split('.')[0])
+                               for col in df.columns))
 
-        # sorted df
-        keys = rows_codes + ['raster_id', 'bbox', 'time_code']
         df_dict = {i: [] for i in keys}
-        for irow, row in df.iterrows():
-            for i in range(len(row) - 1):
-                if row[i]['type'] == 'ROW_HEADER':
-                    key_info = row[i]['value']
-
-                    df_dict[keys[i]].append(key_info)
-                    if keys[i] == time_dims_code:
-                        time_info = df_time.loc[df_time['caption'] == key_info].to_dict(
-                            orient='records')
-                        df_dict['time_code'].append(time_info[0]['code'])
-                if row[i]['type'] == 'DATA_CELL':
-                    raster_info = row[i]['metadata']['raster']
-
-                    df_dict['raster_id'].append(raster_info['id'])
-                    df_dict['bbox'].append(raster_info['bbox'])
-        df_sorted = pd.DataFrame.from_dict(df_dict)
-        return df_sorted
+        for i in positions[:-1]:
+            if i in df.columns:
+                cells = df[i].values
+                types = [cell['type'] for cell in cells]
+                values = [cell.get('value') for cell in cells]
+                raster_ids = [cell['metadata']['raster']['id']
+                              if cell['type'] == 'DATA_CELL' else None
+                              for cell in cells]
+                raster_bboxs = [cell['metadata']['raster']['bbox']
+                                if cell['type'] == 'DATA_CELL' else None
+                                for cell in cells]
+            else:
+                def column(name):
+                    name = '{0}.{1}'.format(i, name)
+                    if name in df.columns:
+                        return df[name].values
+                    return [None] * len(df)
+
+                types = column('type')
+                values = column('value')
+                raster_ids = column('metadata.raster.id')
+                raster_bboxs = column('metadata.raster.bbox')
+
+            headers = [value for cell_type, value in zip(types, values)
+                       if cell_type == 'ROW_HEADER']
+            rasters = [(raster_id, raster_bbox)
+                       for cell_type, raster_id, raster_bbox
+                       in zip(types, raster_ids, raster_bboxs)
+                       if cell_type == 'DATA_CELL']
+
+            if headers:
+                df_dict[keys[i]].extend(headers)
+                if keys[i] == time_dims_code:
+                    if refresh_time is not None and any(
+                            header not in time_codes for header in headers):
+                        time_codes = self._timeCodes(refresh_time())
+                        refresh_time = None
+                    df_dict['time_code'].extend(
+                        [time_codes[header] for header in headers])
+            if rasters:
+                df_dict['raster_id'].extend(
+                    [raster[0] for raster in rasters])
+                df_dict['bbox'].extend(
+                    [raster[1] for raster in rasters])
+        return pd.DataFrame.from_dict(df_dict)
+
+    @staticmethod
+    def _timeCodes(df_time):
+        """Map of time member captions to time codes
+        """
+        time_codes = {}
+        if df_time is not None:
+            df_time = df_time.drop_duplicates('caption')
+            time_codes = dict(zip(df_time['caption'], df_time['code']))
+        return time_codes
 
     def _query_availData(self, cube_code, measure_code,
-                         dims_ls, columns_codes, rows_codes):
+                         dims_ls, columns_codes, rows_codes, version=None):
         """Query Available Data
         """
         print('WaPOR API:   _query_availData')
@@ -725,6 +2078,42 @@ class WaPOR_API_class(object):
         if self.print_job:
             print(request_url)
 
+        request_json = self._availDataJSON(cube_code, measure_code,
+                                           dims_ls, columns_codes, rows_codes,
+                                           version)
+
+        # requests
+        resq_json = self._query_json(
+            'POST',
+            request_url,
+            stream_items='response.items',
+            flatten=True,
+            paged=True,
+            json=request_json)
+        try:
+            resp = resq_json['response']
+            # print(resp)
+
+            if resq_json['message'] == 'OK':
+                try:
+                    df = pd.DataFrame(resp['items'])
+                    # df = pd.DataFrame.from_dict(resp, orient='columns')
+                    return df
+                except BaseException:
+                    print('WaPOR API ERROR: Cannot get list of available data')
+            else:
+                print(resq_json['message'])
+        except BaseException:
+            print('WaPOR API ERROR: Cannot get {url}'.format(
+                url=request_url))
+
+    def _availDataJSON(self, cube_code, measure_code,
+                       dims_ls, columns_codes, rows_codes, version=None):
+        """MDAQuery_Table request json of Available Data
+        """
+        if version is None:
+            version = self.version
+
         request_json = {
             "type": "MDAQuery_Table",
             "params": {
@@ -733,7 +2122,7 @@ class WaPOR_API_class(object):
                     "paged": False,
                 },
                 "cube": {
-                    "workspaceCode": self.workspaces[self.version],
+                    "workspaceCode": self.workspaces[version],
                     "code": cube_code,
                     "language": "en"
                 },
@@ -745,49 +2134,23 @@ class WaPOR_API_class(object):
                 }
             }
         }
+        return request_json
 
-        # requests
-        try:
-            resq = requests.post(
-                request_url,
-                json=request_json)
-            resq.raise_for_status()
-        except requests.exceptions.HTTPError as err:
-            raise Exception("WaPOR API Http Error: {e}".format(e=err))
-        except requests.exceptions.ConnectionError as err:
-            raise Exception("WaPOR API Error Connecting: {e}".format(e=err))
-        except requests.exceptions.Timeout as err:
-            raise Exception("WaPOR API Timeout Error: {e}".format(e=err))
-        except requests.exceptions.RequestException as err:
-            raise Exception("WaPOR API OOps: Something Else {e}".format(e=err))
-        else:
-            resq_json = resq.json()
-            try:
-                resp = resq_json['response']
-                # print(resp)
-
-                if resq_json['message'] == 'OK':
-                    try:
-                        df = pd.DataFrame(resp['items'])
-                        # df = pd.DataFrame.from_dict(resp, orient='columns')
-                        return df
-                    except BaseException:
-                        print('WaPOR API ERROR: Cannot get list of available data')
-                else:
-                    print(resq_json['message'])
-            except BaseException:
-                print('WaPOR API ERROR: Cannot get {url}'.format(
-                    url=request_url))
-
-    def _query_dimensionsMembers(self, cube_code, dims_code):
+    def _query_dimensionsMembers(self, cube_code, dims_code, version=None,
+                                 refresh=False):
         """Query dimensions members
+
+        With ``refresh``, the members are queried from the server,
+        not from the metadata cache.
         """
         print('WaPOR API:   _query_dimensionsMembers')
+        if version is None:
+            version = self.version
 
         base_url = '{0}{1}/cubes/{2}/dimensions/{3}/members?overview=false&paged=false'
         request_url = base_url.format(
             self.path['catalog'],
-            self.workspaces[self.version],
+            self.workspaces[version],
             cube_code,
             dims_code)
 
@@ -795,35 +2158,28 @@ class WaPOR_API_class(object):
             print(request_url)
 
         # requests
+        resq_json = self._query_metadata(
+            'members',
+            'GET',
+            request_url,
+            stream_items='response',
+            refresh=refresh,
+            paged=True)
         try:
-            resq = requests.get(
-                request_url)
-            resq.raise_for_status()
-        except requests.exceptions.HTTPError as err:
-            raise Exception("WaPOR API Http Error: {e}".format(e=err))
-        except requests.exceptions.ConnectionError as err:
-            raise Exception("WaPOR API Error Connecting: {e}".format(e=err))
-        except requests.exceptions.Timeout as err:
-            raise Exception("WaPOR API Timeout Error: {e}".format(e=err))
-        except requests.exceptions.RequestException as err:
-            raise Exception("WaPOR API OOps: Something Else {e}".format(e=err))
-        else:
-            resq_json = resq.json()
-            try:
-                resp = resq_json['response']
-                # print(resp)
+            resp = resq_json['response']
+            # print(resp)
 
-                if resq_json['message'] == 'OK':
-                    try:
-                        df = pd.DataFrame.from_dict(resp, orient='columns')
-                        return df
-                    except BaseException:
-                        print('WaPOR API ERROR: Cannot get dimensions Members')
-                else:
-                    print(resq_json['message'])
-            except BaseException:
-                print('WaPOR API ERROR: Cannot get {url}'.format(
-                    url=request_url))
+            if resq_json['message'] == 'OK':
+                try:
+                    df = pd.DataFrame.from_dict(resp, orient='columns')
+                    return df
+                except BaseException:
+                    print('WaPOR API ERROR: Cannot get dimensions Members')
+            else:
+                print(resq_json['message'])
+        except BaseException:
+            print('WaPOR API ERROR: Cannot get {url}'.format(
+                url=request_url))
 
     def getLocations(self, version=None, level=None):
         """Get Locations
@@ -845,29 +2201,27 @@ class WaPOR_API_class(object):
                 v=version, lv=level))
         self.isAPITokenSet()
 
-        self.version = 2
-        self.level = None
-        if isinstance(version, int):
-            if 0 < version < 3:
-                self.version = version
-        if isinstance(level, int):
-            if 0 < level < 4:
-                self.level = level
+        if not isinstance(version, int) or not 0 < version < 3:
+            version = 2
+        if not isinstance(level, int) or not 0 < level < 4:
+            level = None
 
         if self.locationsTable is not None:
             df_loc = self.locationsTable
         else:
-            df_loc = self._query_locations(version, self.level)
+            df_loc = self._query_locations(version, level)
             df_loc = self.locationsTable
 
-        if self.level is not None:
-            df_loc = df_loc.loc[df_loc["l{0}".format(self.level)]]
+        if level is not None:
+            df_loc = df_loc.loc[df_loc["l{0}".format(level)]]
         return df_loc
 
     def _query_locations(self, version=None, level=None):
         """Query Locations
         """
         print('WaPOR API:   _query_locations')
+        if version is None:
+            version = self.version
 
         base_url = '{0}'
         request_url = base_url.format(
@@ -881,7 +2235,7 @@ class WaPOR_API_class(object):
             "type": "TableQuery_GetList_1",
             "params": {
                 "table": {
-                    "workspaceCode": self.workspaces[self.version],
+                    "workspaceCode": self.workspaces[version],
                     "code": "LOCATION"
                 },
                 "properties": {
@@ -895,47 +2249,39 @@ class WaPOR_API_class(object):
             }
         }
 
+        resq_json = self._query_metadata(
+            'locations',
+            'POST',
+            request_url,
+            stream_items='response',
+            paged=True,
+            json=request_json)
         try:
-            resq = requests.post(
-                request_url,
-                json=request_json)
-            resq.raise_for_status()
-        except requests.exceptions.HTTPError as err:
-            raise Exception("WaPOR API Http Error: {e}".format(e=err))
-        except requests.exceptions.ConnectionError as err:
-            raise Exception("WaPOR API Error Connecting: {e}".format(e=err))
-        except requests.exceptions.Timeout as err:
-            raise Exception("WaPOR API Timeout Error: {e}".format(e=err))
-        except requests.exceptions.RequestException as err:
-            raise Exception("WaPOR API OOps: Something Else {e}".format(e=err))
-        else:
-            resq_json = resq.json()
-            try:
-                resp = resq_json['response']
-                # print(resp)
+            resp = resq_json['response']
+            # print(resp)
 
-                if resq_json['message'] == 'OK':
-                    df_loc = pd.DataFrame.from_dict(resp, orient='columns')
+            if resq_json['message'] == 'OK':
+                df_loc = pd.DataFrame.from_dict(resp, orient='columns')
 
-                    self.locationsTable = df_loc
-                    df_CTY = df_loc.loc[(df_loc["l2"]) &
-                                        (df_loc["type"] == 'COUNTRY')]
-                    df_BAS = df_loc.loc[(df_loc["l2"]) &
-                                        (df_loc["type"] == 'BASIN')]
+                self.locationsTable = df_loc
+                df_CTY = df_loc.loc[(df_loc["l2"]) &
+                                    (df_loc["type"] == 'COUNTRY')]
+                df_BAS = df_loc.loc[(df_loc["l2"]) &
+                                    (df_loc["type"] == 'BASIN')]
 
-                    self.list_countries = [rows['code']
-                                           for index, rows in df_CTY.iterrows()]
+                self.list_countries = [rows['code']
+                                       for index, rows in df_CTY.iterrows()]
 
-                    self.list_basins = [rows['code']
-                                        for index, rows in df_BAS.iterrows()]
-                    return df_loc
-                else:
-                    print(resq_json['message'])
-            except BaseException:
-                print('WaPOR API ERROR: Cannot get {url}'.format(
-                    url=request_url))
+                self.list_basins = [rows['code']
+                                    for index, rows in df_BAS.iterrows()]
+                return df_loc
+            else:
+                print(resq_json['message'])
+        except BaseException:
+            print('WaPOR API ERROR: Cannot get {url}'.format(
+                url=request_url))
 
-    def getRasterUrl(self, cube_code, rasterId, APIToken=""):
+    def getRasterUrl(self, cube_code, rasterId, APIToken="", version=None):
         """Get Raster Url
 
         Parameters
@@ -944,6 +2290,8 @@ class WaPOR_API_class(object):
             Cube code.
         rasterId: str
             Raster ID, from Available Data table "raster_id", ex. "L1_PCP_0901M".
+        version: int, optional
+            WaPOR workspace version, default current version.
 
         Returns
         -------
@@ -953,22 +2301,28 @@ class WaPOR_API_class(object):
         # Check AccessToken expires
         self.isAPITokenExpired()
         AccessToken = self.token['Access']
+        if version is None:
+            version = self.version
 
-        print('WaPOR API: Loading "{c_code}" url from WaPOR.v{v}_l{lv}...'.format(
-            c_code=cube_code, v=self.version, lv=self.level))
+        print('WaPOR API: Loading "{c_code}" url from WaPOR.v{v}...'.format(
+            c_code=cube_code, v=version))
 
-        download_url = self._query_rasterUrl(cube_code, rasterId, AccessToken)
+        download_url = self._query_rasterUrl(cube_code, rasterId, AccessToken,
+                                             version)
         return download_url
 
-    def _query_rasterUrl(self, cube_code, rasterId, AccessToken):
+    def _query_rasterUrl(self, cube_code, rasterId, AccessToken,
+                         version=None):
         """Query Raster Url
         """
         print('WaPOR API:   _query_rasterUrl')
+        if version is None:
+            version = self.version
 
         base_url = '{0}{1}'
         request_url = base_url.format(
             self.path['download'],
-            self.workspaces[self.version])
+            self.workspaces[version])
 
         if self.print_job:
             print(request_url)
@@ -982,42 +2336,32 @@ class WaPOR_API_class(object):
             'rasterId': rasterId}
 
         # requests
+        resq = self.request(
+            'GET',
+            request_url,
+            headers=request_headers,
+            params=request_params)
+        resq_json = resq.json()
         try:
-            resq = requests.get(
-                request_url,
-                headers=request_headers,
-                params=request_params)
-            resq.raise_for_status()
-        except requests.exceptions.HTTPError as err:
-            raise Exception("WaPOR API Http Error: {e}".format(e=err))
-        except requests.exceptions.ConnectionError as err:
-            raise Exception("WaPOR API Error Connecting: {e}".format(e=err))
-        except requests.exceptions.Timeout as err:
-            raise Exception("WaPOR API Timeout Error: {e}".format(e=err))
-        except requests.exceptions.RequestException as err:
-            raise Exception("WaPOR API OOps: Something Else {e}".format(e=err))
-        else:
-            resq_json = resq.json()
-            try:
-                resp = resq_json['response']
-                # print(resp)
+            resp = resq_json['response']
+            # print(resp)
 
-                if resq_json['message'] == 'OK':
-                    expiry_date = datetime.datetime.now() \
-                                  + datetime.timedelta(seconds=int(resp['expiresIn']))
+            if resq_json['message'] == 'OK':
+                expiry_date = datetime.datetime.now() \
+                              + datetime.timedelta(seconds=int(resp['expiresIn']))
 
-                    output = {
-                        'url': resp['downloadUrl'],
-                        'expiry_datetime': expiry_date}
-                    return output
-                else:
-                    print(resq_json['message'])
-            except BaseException:
-                print('WaPOR API ERROR: Cannot get {url}'.format(
-                    url=request_url))
+                output = {
+                    'url': resp['downloadUrl'],
+                    'expiry_datetime': expiry_date}
+                return output
+            else:
+                print(resq_json['message'])
+        except BaseException:
+            print('WaPOR API ERROR: Cannot get {url}'.format(
+                url=request_url))
 
     def getCropRasterURL(self, bbox, cube_code,
-                         time_code, rasterId):
+                         time_code, rasterId, version=None):
         """Get Crop Raster Url
 
         Do need Authorization
@@ -1034,58 +2378,403 @@ class WaPOR_API_class(object):
         rasterId: str
             Raster ID, from Available Data table "raster_id",
             ex. "L1_PCP_0901M".
+        version: int, optional
+            WaPOR workspace version, default current version.
 
         Returns
         -------
         download: str
             Download url.
         """
-        # Check AccessToken expires
-        self.isAPITokenExpired()
-        AccessToken = self.token['Access']
-
-        # Get measure_code and dimension_code
-        try:
-            # cube_info = self.getCubeInfo(cube_code)
-            catalog = self.getCatalog(self.version, self.level, cubeInfo=True)
-            cube_info = catalog.loc[catalog['code'] == cube_code].to_dict('records')[
-                0]
+        if version is None:
+            version = self.version
+
+        key, download_url, job_url = self._startCropRaster(
+            bbox, cube_code, time_code, rasterId, version)
+        if download_url is not None:
+            return download_url
+        if job_url is None:
+            return None
 
-            # get measures
-            cube_measure_code = cube_info['measure']['code']
-            # get dimension
-            cube_dimensions = cube_info['dimension']
+        download_url = self._query_jobOutput(job_url, jobType='CROP RASTER')
+        self._finishCropRaster(key, download_url)
+        return download_url
 
-            for cube_dimension in cube_dimensions:
-                if cube_dimension['type'] == 'TIME':
-                    cube_dimension_code = cube_dimension['code']
-        except BaseException:
-            print('WaPOR API ERROR: Cannot get cube info')
+    def iterCropRasterURLs(self, bbox, cube_code, df_avail,
+                           window=JOB_WINDOW, ordered=False, version=None):
+        """Iterate Crop Raster Urls of Available Data rows
 
-        print('WaPOR API: Loading "{c_code}" url from WaPOR.v{v}_l{lv}...'.format(
-            c_code=cube_code, v=self.version, lv=self.level))
+        CropRaster jobs are submitted for all rows, up to ``window`` jobs
+        running at a time, and one poller tracks all running jobs.
+        Urls are yielded as soon as their job completes. With pages of
+        :meth:`iterAvailData`, jobs of the first page start while later
+        pages are loading.
 
-        # Create Polygon
-        xmin, ymin, xmax, ymax = bbox[0], bbox[1], bbox[2], bbox[3]
-        Polygon = [
-            [xmin, ymin],
-            [xmin, ymax],
-            [xmax, ymax],
-            [xmax, ymin],
-            [xmin, ymin]
-        ]
+        Parameters
+        ----------
+        bbox: list
+            [xmin,ymin,xmax,ymax], latitude and longitude.
+        cube_code: str
+            Cube code.
+        df_avail: :obj:`pandas.DataFrame`, iterable
+            Available Data table, from :meth:`getAvailData`, or its pages,
+            from :meth:`iterAvailData`.
+        window: int, optional
+            Number of jobs running at a time, default 8.
+        ordered: bool, optional
+            Yield in table order, default False, in completion order.
+        version: int, optional
+            WaPOR workspace version, default current version.
+
+        Yields
+        ------
+        index: object
+            Row index of Available Data table.
+        row: :obj:`pandas.Series`
+            Row of Available Data table.
+        download: str
+            Download url, None if the job failed.
+        """
+        if version is None:
+            version = self.version
+
+        pages = df_avail
+        if isinstance(df_avail, pd.DataFrame):
+            pages = [df_avail]
+        rows = (item for page in pages for item in page.iterrows())
+        results = queue.Queue()
+        stop = threading.Event()
+
+        worker = threading.Thread(
+            target=self._runCropRasterJobs,
+            args=(bbox, cube_code, rows, window, results, stop, version))
+        worker.daemon = True
+        worker.start()
 
-        # Query payload
-        base_url = '{0}'
-        request_url = base_url.format(
-            self.path['query'])
+        try:
+            held = {}
+            next_pos = 0
+            while True:
+                result = results.get()
+                if result is None:
+                    break
+                if isinstance(result, BaseException):
+                    raise result
+
+                pos, index, row, output = result
+                if not ordered:
+                    yield index, row, output
+                    continue
+
+                held[pos] = (index, row, output)
+                while next_pos in held:
+                    yield held.pop(next_pos)
+                    next_pos += 1
+        finally:
+            stop.set()
+            worker.join()
+
+    def _runCropRasterJobs(self, bbox, cube_code, rows, window, results, stop,
+                           version):
+        """Submit and poll CropRaster jobs, put (pos, index, row, url)
+        into results, and None when all rows are done
+
+        Rows are taken from the ``rows`` iterator as jobs are submitted.
+        """
+        try:
+            jobs = {}
+            next_pos = 0
+            exhausted = False
+            while not exhausted or jobs:
+                if stop.is_set():
+                    return
+
+                # Submit jobs up to window
+                while not exhausted and len(jobs) < window:
+                    item = next(rows, None)
+                    if item is None:
+                        exhausted = True
+                        break
+                    index, row = item
+                    key, download_url, job_url = self._startCropRaster(
+                        bbox, cube_code, row['time_code'], row['raster_id'],
+                        version)
+                    if job_url is None:
+                        results.put((next_pos, index, row, download_url))
+                    else:
+                        now = time.time()
+                        jobs[next_pos] = {
+                            'key': key,
+                            'url': job_url,
+                            'index': index,
+                            'row': row,
+                            'type': 'CROP RASTER',
+                            'start': now,
+                            'poll': now + self._query_jobDelay(
+                                'CROP RASTER', 0.0),
+                            'last_time': 0.0,
+                            'ijob': 0
+                        }
+                    next_pos += 1
+
+                if not jobs:
+                    continue
+
+                # Poll the job due first
+                pos = min(jobs, key=lambda key: jobs[key]['poll'])
+                job = jobs[pos]
+                delay = job['poll'] - time.time()
+                if delay > 0 and stop.wait(delay):
+                    return
+
+                wait_time = time.time() - job['start']
+                resp = self._query_jobStatus(job['url'])
+
+                isDone, output = False, None
+                if resp is not None:
+                    job['type'] = resp.get('type', job['type'])
+                    isDone, output = self._query_jobCheck(
+                        resp, job['type'], job['last_time'], wait_time,
+                        job['ijob'])
+                if not isDone:
+                    try:
+                        self._query_jobDeadline(job['url'], resp, wait_time)
+                    except TimeoutError as err:
+                        # Job may still finish, reattached by next run
+                        print(err)
+                        del jobs[pos]
+                        results.put((pos, job['index'], job['row'], None))
+                        continue
+
+                if isDone:
+                    self._finishCropRaster(job['key'], output)
+                    del jobs[pos]
+                    results.put((pos, job['index'], job['row'], output))
+                else:
+                    job['last_time'] = wait_time
+                    job['ijob'] += 1
+                    job['poll'] = time.time() + self._query_jobDelay(
+                        job['type'], wait_time)
+            results.put(None)
+        except BaseException as err:
+            results.put(err)
 
-        if self.print_job:
-            print(request_url)
+    def refreshCropRasterURL(self, bbox, cube_code, time_code, rasterId,
+                             version=None):
+        """Get new Crop Raster Url, when the download url has expired
+
+        The url is removed from the url cache and the job journal,
+        and the job is submitted again.
+
+        Parameters
+        ----------
+        bbox: list
+            [xmin,ymin,xmax,ymax], latitude and longitude.
+        cube_code: str
+            Cube code.
+        time_code: str
+            Time code, ex. "[2009-01-01,2009-02-01)".
+        rasterId: str
+            Raster ID, ex. "L1_PCP_0901M".
+        version: int, optional
+            WaPOR workspace version, default current version.
+
+        Returns
+        -------
+        download: str
+            Download url.
+        """
+        if version is None:
+            version = self.version
+
+        key = self._cropRasterKey(bbox, cube_code, time_code, rasterId,
+                                  version)
+        self.urlCache.pop(key)
+        if self.jobJournal is not None:
+            self.jobJournal.failed(key)
+        return self.getCropRasterURL(bbox, cube_code, time_code, rasterId,
+                                     version)
+
+    def setUrlCache(self, max_size=URL_CACHE_SIZE):
+        """Set download url cache size
+
+        Download urls of CropRaster jobs are cached in memory by request
+        fingerprint, and reused while they are valid.
+
+        Parameters
+        ----------
+        max_size: int, optional
+            Maximum number of urls, default 4096, 0 disables the cache.
+        """
+        self.urlCache = UrlCache(max_size)
+
+    def setJobJournal(self, path=None):
+        """Set persistent job journal
+
+        Submitted CropRaster jobs are recorded in a local SQLite database.
+        After a restart, running jobs are reattached and download urls of
+        completed jobs are reused until they expire.
+
+        Parameters
+        ----------
+        path: str, optional
+            SQLite database file, default None, no job journal.
+        """
+        if self.jobJournal is not None:
+            self.jobJournal.close()
+            self.jobJournal = None
+
+        if path is not None:
+            self.jobJournal = JobJournal(path)
+
+    def _cropRasterKey(self, bbox, cube_code, time_code, rasterId,
+                       version=None):
+        """Request fingerprint of Crop Raster job
+
+        Hash of the request json, cube, time code, raster id and crop
+        properties, with the bbox polygon normalized.
+        """
+        request_json = self._cropRasterJSON(bbox, cube_code,
+                                            time_code, rasterId, version)
+
+        xmin, xmax = sorted([round(float(bbox[0]), 6),
+                             round(float(bbox[2]), 6)])
+        ymin, ymax = sorted([round(float(bbox[1]), 6),
+                             round(float(bbox[3]), 6)])
+        request_json['params']['shape']['coordinates'] = [[
+            [xmin, ymin],
+            [xmin, ymax],
+            [xmax, ymax],
+            [xmax, ymin],
+            [xmin, ymin]
+        ]]
+
+        key = json.dumps(request_json, sort_keys=True)
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def _startCropRaster(self, bbox, cube_code, time_code, rasterId,
+                         version=None):
+        """Start Crop Raster job, return (key, download_url, job_url)
+
+        A valid download url, or a running job, of the job journal is
+        reused, otherwise the job is submitted and recorded.
+        """
+        if version is None:
+            version = self.version
+
+        key = self._cropRasterKey(bbox, cube_code, time_code, rasterId,
+                                  version)
+
+        download_url = self.urlCache.get(key, DOWNLOAD_URL_MARGIN_SECOND)
+        if download_url is not None:
+            print('WaPOR API: Reuse "{c_code}" "{r_id}" download url'.format(
+                c_code=cube_code, r_id=rasterId))
+            return key, download_url, None
+
+        if self.jobJournal is None:
+            return key, None, self.submitCropRaster(
+                bbox, cube_code, time_code, rasterId, version)
+
+        job = self.jobJournal.get(key)
+        if job is not None:
+            if job['status'] == JOB_COMPLETED:
+                dt_expire = time.time() + DOWNLOAD_URL_MARGIN_SECOND
+                if job['expires'] > dt_expire:
+                    self.urlCache.put(key, job['download_url'], job['expires'])
+                    print('WaPOR API: Reuse "{c_code}" "{r_id}"'
+                          ' download url'.format(c_code=cube_code,
+                                                 r_id=rasterId))
+                    return key, job['download_url'], None
+            if job['status'] == JOB_SUBMITTED:
+                if self._isJobRunning(job['job_url']):
+                    print('WaPOR API: Reattach "{c_code}" "{r_id}"'
+                          ' job'.format(c_code=cube_code, r_id=rasterId))
+                    return key, None, job['job_url']
+
+        job_url = self.submitCropRaster(bbox, cube_code, time_code, rasterId,
+                                        version)
+        if job_url is not None:
+            self.jobJournal.submitted(key, self._syncCube(cube_code, version),
+                                      time_code, rasterId, bbox, job_url)
+        return key, None, job_url
+
+    def _finishCropRaster(self, key, download_url):
+        """Record Crop Raster job output in the url cache and job journal
+        """
+        if download_url is None:
+            if self.jobJournal is not None:
+                self.jobJournal.failed(key)
+            return
+
+        dt_expire = self._downloadExpires(download_url)
+        self.urlCache.put(key, download_url, dt_expire)
+        if self.jobJournal is not None:
+            self.jobJournal.completed(key, download_url, dt_expire)
+
+    def _isJobRunning(self, job_url):
+        """Check journal job still exists on server, and did not fail
+        """
+        try:
+            resp = self._query_jobStatus(job_url)
+        except Exception:
+            return False
+        if resp is None:
+            return False
+        return resp['status'] in ['WAITING', 'RUNNING', 'COMPLETED']
+
+    @staticmethod
+    def _downloadExpires(download_url):
+        """Download url expiry, from signed url parameters
+        """
+        query = urllib.parse.parse_qs(
+            urllib.parse.urlparse(download_url).query)
+        try:
+            if 'Expires' in query:
+                return float(query['Expires'][0])
+            for prefix in ['X-Goog', 'X-Amz']:
+                dt_start = query.get('{0}-Date'.format(prefix))
+                dt_expire = query.get('{0}-Expires'.format(prefix))
+                if dt_start and dt_expire:
+                    dt = datetime.datetime.strptime(
+                        dt_start[0], '%Y%m%dT%H%M%SZ').replace(
+                        tzinfo=datetime.timezone.utc)
+                    return dt.timestamp() + float(dt_expire[0])
+        except ValueError:
+            pass
+        return time.time() + DOWNLOAD_URL_TTL_SECOND
+
+    def _cropRasterJSON(self, bbox, cube_code, time_code, rasterId,
+                        version=None):
+        """CropRaster request json
+        """
+        if version is None:
+            version = self.version
+
+        # Get measure_code and dimension_code
+        try:
+            cube_info = self.getCubeMeta(cube_code, version)
+
+            # get measures
+            cube_measure_code = cube_info['measure']['code']
+            # get dimension
+            cube_dimensions = cube_info['dimension']
+
+            for cube_dimension in cube_dimensions:
+                if cube_dimension['type'] == 'TIME':
+                    cube_dimension_code = cube_dimension['code']
+        except BaseException:
+            print('WaPOR API ERROR: Cannot get cube info')
+
+        # Create Polygon
+        xmin, ymin, xmax, ymax = bbox[0], bbox[1], bbox[2], bbox[3]
+        Polygon = [
+            [xmin, ymin],
+            [xmin, ymax],
+            [xmax, ymax],
+            [xmax, ymin],
+            [xmin, ymin]
+        ]
 
-        request_headers = {
-            'Authorization': 'Bearer {0}'.format(AccessToken)
-        }
         request_json = {
             "type": "CropRaster",
             "params": {
@@ -1098,7 +2787,7 @@ class WaPOR_API_class(object):
                 },
                 "cube": {
                     "code": cube_code,
-                    "workspaceCode": self.workspaces[self.version],
+                    "workspaceCode": self.workspaces[version],
                     "language": "en"
                 },
                 "dimensions": [
@@ -1123,49 +2812,90 @@ class WaPOR_API_class(object):
                 }
             }
         }
+        return request_json
+
+    def submitCropRaster(self, bbox, cube_code,
+                         time_code, rasterId, version=None):
+        """Submit Crop Raster job, without waiting for the job output
+
+        Do need Authorization
+
+        Parameters
+        ----------
+        bbox: list
+            [xmin,ymin,xmax,ymax], latitude and longitude.
+        cube_code: str
+            Cube code.
+        time_code: str
+            Time code, from Available Data table "raster_id",
+            ex. "[2009-01-01,2009-02-01)".
+        rasterId: str
+            Raster ID, from Available Data table "raster_id",
+            ex. "L1_PCP_0901M".
+        version: int, optional
+            WaPOR workspace version, default current version.
+
+        Returns
+        -------
+        job_url: str
+            Job url, pass to :meth:`_query_jobOutput`.
+        """
+        # Check AccessToken expires
+        self.isAPITokenExpired()
+        AccessToken = self.token['Access']
+        if version is None:
+            version = self.version
+
+        request_json = self._cropRasterJSON(bbox, cube_code,
+                                            time_code, rasterId, version)
+
+        print('WaPOR API: Loading "{c_code}" url from WaPOR.v{v}...'.format(
+            c_code=cube_code, v=version))
+
+        # Query payload
+        base_url = '{0}'
+        request_url = base_url.format(
+            self.path['query'])
+
+        if self.print_job:
+            print(request_url)
+
+        request_headers = {
+            'Authorization': 'Bearer {0}'.format(AccessToken)
+        }
 
         # requests
+        resq = self.request(
+            'POST',
+            request_url,
+            headers=request_headers,
+            json=request_json)
+        resq_json = resq.json()
         try:
-            resq = requests.post(
-                request_url,
-                headers=request_headers,
-                json=request_json)
-            resq.raise_for_status()
-        except requests.exceptions.HTTPError as err:
-            raise Exception("WaPOR API Http Error: {e}".format(e=err))
-        except requests.exceptions.ConnectionError as err:
-            raise Exception("WaPOR API Error Connecting: {e}".format(e=err))
-        except requests.exceptions.Timeout as err:
-            raise Exception("WaPOR API Timeout Error: {e}".format(e=err))
-        except requests.exceptions.RequestException as err:
-            raise Exception("WaPOR API OOps: Something Else {e}".format(e=err))
-        else:
-            resq_json = resq.json()
-            try:
-                resp = resq_json['response']
-                # print(resp)
+            resp = resq_json['response']
+            # print(resp)
 
-                if resq_json['message'] == 'OK':
-                    try:
-                        job_url = resp['links'][0]['href']
+            if resq_json['message'] == 'OK':
+                try:
+                    job_url = resp['links'][0]['href']
 
-                        if self.print_job:
-                            print('WaPOR API: Downloading "{c_code}" "{t}"...'.format(
-                                c_code=cube_code, t=resp['type']))
+                    if self.print_job:
+                        print('WaPOR API: Downloading "{c_code}" "{t}"...'.format(
+                            c_code=cube_code, t=resp['type']))
 
-                        output = self._query_jobOutput(job_url)
-                        return output
-                    except BaseException:
-                        print('WaPOR API ERROR: Server response is empty')
-                        return None
-                else:
-                    print(resq_json['message'])
-            except BaseException:
-                print('WaPOR API ERROR: Cannot get {url}'.format(
-                    url=request_url))
+                    return job_url
+                except BaseException:
+                    print('WaPOR API ERROR: Server response is empty')
+                    return None
+            else:
+                print(resq_json['message'])
+        except BaseException:
+            print('WaPOR API ERROR: Cannot get {url}'.format(
+                url=request_url))
 
     def getAreaTimeseries(self, shapefile_fh, cube_code,
-                          time_range="2009-01-01,2018-12-31", APIToken=""):
+                          time_range="2009-01-01,2018-12-31", APIToken="",
+                          version=None):
         """Get Area Timeseries
 
         Do need Authorization
@@ -1180,22 +2910,53 @@ class WaPOR_API_class(object):
             "YYYY-MM-DD,YYYY-MM-DD".
         APIToken: str
             WaPOR API Token.
+        version: int, optional
+            WaPOR workspace version, default current version.
 
         Returns
         -------
         timeseries: :obj:`pandas.DataFrame`
             Area timeseries table.
         """
+        job_url = self.submitAreaTimeseries(shapefile_fh, cube_code,
+                                            time_range=time_range,
+                                            version=version)
+        if job_url is None:
+            return None
+        return self._query_jobOutput(job_url, jobType='AREA STATS')
+
+    def submitAreaTimeseries(self, shapefile_fh, cube_code,
+                             time_range="2009-01-01,2018-12-31",
+                             version=None):
+        """Submit Area Timeseries job, without waiting for the job output
+
+        Do need Authorization
+
+        Parameters
+        ----------
+        shapefile_fh: str
+            ex. "E:/Area.shp".
+        cube_code: str
+            Cube code.
+        time_range: str, optional
+            "YYYY-MM-DD,YYYY-MM-DD".
+        version: int, optional
+            WaPOR workspace version, default current version.
+
+        Returns
+        -------
+        job_url: str
+            Job url, pass to :meth:`_query_jobOutput`.
+        """
         # Check AccessToken expires
         self.isAPITokenExpired()
         AccessToken = self.token['Access']
+        if version is None:
+            version = self.version
 
         # Get measure_code and dimension_code
         try:
-            # cube_info = self.getCubeInfo(cube_code)
-            catalog = self.getCatalog(self.version, self.level, cubeInfo=True)
-            cube_info = catalog.loc[catalog['code'] == cube_code].to_dict('records')[
-                0]
+            cube_info = self.getCubeMeta(cube_code, version)
 
             # get measures
             cube_measure_code = cube_info['measure']['code']
@@ -1235,7 +2996,7 @@ class WaPOR_API_class(object):
             "params": {
                 "cube": {
                     "code": cube_code,
-                    "workspaceCode": self.workspaces[self.version],
+                    "workspaceCode": self.workspaces[version],
                     "language": "en"
                 },
                 "dimensions": [
@@ -1252,140 +3013,625 @@ class WaPOR_API_class(object):
         }
 
         # requests
+        resq = self.request(
+            'POST',
+            request_url,
+            headers=request_headers,
+            json=request_json)
+        resq_json = resq.json()
         try:
-            resq = requests.post(
-                request_url,
-                headers=request_headers,
-                json=request_json)
-            resq.raise_for_status()
-        except requests.exceptions.HTTPError as err:
-            raise Exception("WaPOR API Http Error: {e}".format(e=err))
-        except requests.exceptions.ConnectionError as err:
-            raise Exception("WaPOR API Error Connecting: {e}".format(e=err))
-        except requests.exceptions.Timeout as err:
-            raise Exception("WaPOR API Timeout Error: {e}".format(e=err))
-        except requests.exceptions.RequestException as err:
-            raise Exception("WaPOR API OOps: Something Else {e}".format(e=err))
-        else:
-            resq_json = resq.json()
-            try:
-                resp = resq_json['response']
-                # print(resp)
+            resp = resq_json['response']
+            # print(resp)
 
-                if resq_json['message'] == 'OK':
-                    try:
-                        job_url = resp['links'][0]['href']
+            if resq_json['message'] == 'OK':
+                try:
+                    job_url = resp['links'][0]['href']
 
-                        if self.print_job:
-                            print('WaPOR API: Downloading "{c_code}" "{t}"...'.format(
-                                c_code=cube_code, t=resp['type']))
+                    if self.print_job:
+                        print('WaPOR API: Downloading "{c_code}" "{t}"...'.format(
+                            c_code=cube_code, t=resp['type']))
 
-                        output = self._query_jobOutput(job_url)
-                        return output
-                    except BaseException:
-                        print('WaPOR API ERROR: Server response is empty')
-                        return None
-                else:
-                    print(resq_json['message'])
-            except BaseException:
-                print('WaPOR API ERROR: Cannot get {url}'.format(url=request_url))
+                    return job_url
+                except BaseException:
+                    print('WaPOR API ERROR: Server response is empty')
+                    return None
+            else:
+                print(resq_json['message'])
+        except BaseException:
+            print('WaPOR API ERROR: Cannot get {url}'.format(url=request_url))
+
+    def setJobPolling(self, deadline=None, interval=None, max_interval=None):
+        """Set job polling
+
+        Jobs are polled shortly before their expected duration, learned
+        per job type, then with an interval growing with the elapsed time.
 
-    def _query_jobOutput(self, job_url):
+        Parameters
+        ----------
+        deadline: float, optional
+            Seconds after submission before a job times out,
+            default unchanged, initially 600.
+        interval: float, optional
+            Shortest poll interval in seconds, default unchanged.
+        max_interval: float, optional
+            Longest poll interval in seconds, default unchanged.
+        """
+        if deadline is not None:
+            self.jobDeadline = deadline
+        if interval is not None:
+            self.pollSchedule.interval = interval
+        if max_interval is not None:
+            self.pollSchedule.max_interval = max_interval
+
+    def _query_jobOutput(self, job_url, jobType=None, start=None):
         """Query Job output, url(str) or table(pd.DataFrame)
+
+        Raises TimeoutError when the job is not finished before the
+        deadline, see :meth:`setJobPolling`.
         """
         print('WaPOR API:   _query_jobOutput')
 
         request_url = job_url
+        if start is None:
+            start = time.time()
 
-        ijob = 0
-        contiue = True
-        wait_time = 0
         if self.print_job:
             print(request_url)
 
-        while contiue:
-            # requests
-            try:
-                resq = requests.get(
-                    request_url)
-                resq.raise_for_status()
-            except requests.exceptions.HTTPError as err:
-                raise Exception("WaPOR API Http Error: {e}".format(e=err))
-            except requests.exceptions.ConnectionError as err:
-                raise Exception("WaPOR API Error Connecting: {e}".format(e=err))
-            except requests.exceptions.Timeout as err:
-                raise Exception("WaPOR API Timeout Error: {e}".format(e=err))
-            except requests.exceptions.RequestException as err:
-                raise Exception("WaPOR API OOps: Something Else {e}".format(e=err))
+        ijob = 0
+        last_time = 0.0
+        wait_time = 0.0
+        while True:
+            time.sleep(self._query_jobDelay(jobType, wait_time))
+            wait_time = time.time() - start
+
+            resp = self._query_jobStatus(request_url)
+            if resp is not None:
+                jobType = resp.get('type', jobType)
+
+                isDone, output = self._query_jobCheck(
+                    resp, jobType, last_time, wait_time, ijob)
+                if isDone:
+                    return output
+
+            self._query_jobDeadline(request_url, resp, wait_time)
+            last_time = wait_time
+            ijob += 1
+
+    def _query_jobCheck(self, resp, jobType, last_time, wait_time, ijob=0):
+        """Check Job status, return (finished, output)
+
+        Duration of completed jobs is added to the poll schedule,
+        between the last two polls.
+        """
+        if self.print_job:
+            print('WaPOR API:   {i} {t:.1f}sec {s}'.format(
+                i=ijob, t=wait_time, s=resp['status']))
+
+        if resp['status'] == 'COMPLETED':
+            print('WaPOR API:   {t:.1f}sec {s}'.format(
+                t=wait_time, s=resp['status']))
+
+            self.pollSchedule.observe(jobType, (last_time + wait_time) / 2)
+            return True, self._query_jobResult(resp)
+        elif resp['status'] == 'COMPLETED WITH ERRORS':
+            print('WaPOR API:   {t:.1f}sec {s}'.format(
+                t=wait_time, s=resp['status']))
+
+            print(resp['log'][-1])
+            return True, None
+        elif resp['status'] in ['WAITING', 'RUNNING']:
+            if int(wait_time // 60) > int(last_time // 60):
+                print('WaPOR API:   {t:.1f}sec {s}'.format(
+                    t=wait_time, s=resp['status']))
+            return False, None
+        else:
+            raise Exception('WaPOR API ERROR:'
+                            ' Unkown status'
+                            ' "{s}".'.format(s=resp['status']))
+
+    def _query_jobDelay(self, jobType, wait_time):
+        """Seconds to wait before the next Job poll, until the deadline
+        """
+        delay = self.pollSchedule.delay(jobType, wait_time)
+        return max(min(delay, self.jobDeadline - wait_time), 0.0)
+
+    def _query_jobDeadline(self, job_url, resp, wait_time):
+        """Raise TimeoutError when Job deadline is passed
+        """
+        if wait_time <= self.jobDeadline:
+            return
+
+        status, log = None, None
+        if resp is not None:
+            status = resp.get('status')
+            if resp.get('log'):
+                log = resp['log'][-1]
+        raise TimeoutError(
+            'WaPOR API ERROR: Job {url} not finished after {t:.0f}sec,'
+            ' status "{s}", {log}'.format(
+                url=job_url, t=wait_time, s=status, log=log))
+
+    def _query_jobStatus(self, job_url):
+        """Query Job status once
+        """
+        request_url = job_url
+
+        # requests
+        resq = self.request(
+            'GET',
+            request_url)
+        resq_json = resq.json()
+        try:
+            resp = resq_json['response']
+            # print(resp)
+
+            if resq_json['message'] == 'OK':
+                return resp
             else:
-                resq_json = resq.json()
+                print(resq_json['message'])
+        except BaseException:
+            print('WaPOR API ERROR: Cannot get {url}'.format(url=request_url))
+
+    def _query_jobResult(self, resp):
+        """Job output of a completed job, url(str) or table(pd.DataFrame)
+        """
+        jobType = resp['type']
+
+        output = None
+        if jobType == 'CROP RASTER':
+            output = resp['output']['downloadUrl']
+        elif jobType == 'AREA STATS':
+            results = resp['output']
+            output = pd.DataFrame(
+                results['items'], columns=results['header'])
+        else:
+            print('WaPOR API ERROR: Invalid jobType {t}'.format(
+                t=jobType))
+        return output
+
+    def downloadFile(self, download_url, filename,
+                     chunk_size=DOWNLOAD_CHUNK_SIZE, refresh=None):
+        """Download file to disk in chunks, resume interrupted downloads
+
+        The response is streamed in chunks of ``chunk_size`` bytes to
+        ``filename.part``, renamed to ``filename`` when complete, memory
+        use does not grow with the file size.
+
+        An existing ``filename.part`` is resumed with an HTTP Range
+        request, validated by the ETag and size kept in
+        ``filename.part.json``. Dropped connections are resumed from
+        the last written byte.
+
+        Large files are downloaded in segments over several connections,
+        see :meth:`setDownloadSegments`.
+
+        Parameters
+        ----------
+        download_url: str
+            Download url, ex. from :meth:`getCropRasterURL`.
+        filename: str
+            Local file name.
+        chunk_size: int, optional
+            Chunk size in bytes, default 1 MB.
+        refresh: callable, optional
+            Returns a new download url of the same file when the url has
+            expired, ex. :meth:`refreshCropRasterURL`, default None.
+
+        Returns
+        -------
+        size: int
+            Downloaded bytes of the file, bytes of a resumed part file
+            are not counted.
+        """
+        dt_start = time.time()
+        size = None
+        if self.downloadSegments > 1:
+            size = self._downloadSegmented(download_url, filename,
+                                           chunk_size, refresh)
+        if size is None:
+            size = self._downloadStream(download_url, filename,
+                                        chunk_size, refresh)
+
+        seconds = time.time() - dt_start
+        with self._stats_lock:
+            self.stats['download_bytes'] += size
+            self.stats['download_seconds'] += seconds
+
+        print('WaPOR API: Downloaded {s:.1f}MB in {t:.1f}sec,'
+              ' {r:.1f}MB/s'.format(s=size / 1048576.0, t=seconds,
+                                    r=size / 1048576.0 / max(seconds, 1e-6)))
+        return size
+
+    def _downloadStream(self, download_url, filename, chunk_size,
+                        refresh=None):
+        """Download over one connection, resume from the part file
+        """
+        part = '{0}.part'.format(filename)
+        part_meta = '{0}.json'.format(part)
+
+        meta = self._readPartMeta(part, part_meta)
+        if 'ranges' in meta:
+            # Segmented download, start again
+            meta = {}
+
+        size = 0
+        attempt = 0
+        while True:
+            offset = 0
+            if meta and os.path.exists(part):
+                offset = os.path.getsize(part)
+
+            request_headers = {}
+            if offset > 0:
+                request_headers['Range'] = 'bytes={0}-'.format(offset)
+                etag = meta.get('etag')
+                if etag and not etag.startswith('W/'):
+                    request_headers['If-Range'] = etag
+
+            resq = self.request('GET', download_url, raise_for_status=False,
+                                stream=True, headers=request_headers)
+            try:
+                if resq.status_code in DOWNLOAD_EXPIRED_STATUS:
+                    if refresh is None or attempt >= self.retry['total']:
+                        raise Exception(
+                            'WaPOR API ERROR: Download url expired,'
+                            ' status {s}'.format(s=resq.status_code))
+                    print('WaPOR API: Download url expired, refresh')
+                    download_url = refresh()
+                    attempt += 1
+                    continue
+
+                if resq.status_code == 416:
+                    # Range not satisfiable, start again
+                    meta = {}
+                    continue
+
                 try:
-                    resp = resq_json['response']
-                    # print(resp)
-
-                    if resq_json['message'] == 'OK':
-                        jobType = resp['type']
-
-                        if self.print_job:
-                            print('WaPOR API:   {i} {t}sec {s}'.format(
-                                i=ijob, t=wait_time, s=resp['status']))
-
-                        if resp['status'] == 'COMPLETED':
-                            contiue = False
-                            print('WaPOR API:   {t}sec {s}'.format(
-                                t=wait_time, s=resp['status']))
-
-                            if jobType == 'CROP RASTER':
-                                output = resp['output']['downloadUrl']
-                            elif jobType == 'AREA STATS':
-                                results = resp['output']
-                                output = pd.DataFrame(
-                                    results['items'], columns=results['header'])
-                            else:
-                                print('WaPOR API ERROR: Invalid jobType {t}'.format(
-                                    t=jobType))
-                            return output
-                        elif resp['status'] == 'COMPLETED WITH ERRORS':
-                            contiue = False
-                            print('WaPOR API:   {t}sec {s}'.format(
-                                t=wait_time, s=resp['status']))
-
-                            print(resp['log'][-1])
-                        elif resp['status'] == 'WAITING':
-                            contiue = True
-                            if wait_time % 60 == 0:
-                                print('WaPOR API:   {t}sec {s}'.format(
-                                    t=wait_time, s=resp['status']))
-
-                            time.sleep(TIME_SLEEP_SECOND)
-                            wait_time += TIME_SLEEP_SECOND
-                            if wait_time > TIME_REQUEST_AFTER_SECOND:
-                                contiue = False
-                                print(resp['log'][-1])
-                        elif resp['status'] == 'RUNNING':
-                            contiue = True
-                            if wait_time % 60 == 0:
-                                print('WaPOR API:   {t}sec {s}'.format(
-                                    t=wait_time, s=resp['status']))
-
-                            time.sleep(TIME_SLEEP_SECOND)
-                            wait_time += TIME_SLEEP_SECOND
-                            if wait_time > TIME_REQUEST_AFTER_SECOND:
-                                contiue = False
-                                print(resp['log'][-1])
-                        else:
-                            raise Exception('WaPOR API ERROR:'
-                                            ' Unkown status'
-                                            ' "{s}".'.format(s=resp['status']))
+                    resq.raise_for_status()
+                except requests.exceptions.HTTPError as err:
+                    raise Exception("WaPOR API Http Error: {e}".format(e=err))
+
+                mode = 'wb'
+                etag = resq.headers.get('ETag')
+                total = self._contentTotal(resq)
+                if resq.status_code == 206 and offset > 0:
+                    start = self._contentStart(resq)
+                    if start == offset and etag == meta.get('etag'):
+                        mode = 'ab'
+                        print('WaPOR API: Resume download at'
+                              ' {s:.1f}MB'.format(s=offset / 1048576.0))
                     else:
-                        print(resq_json['message'])
-                except BaseException:
-                    print('WaPOR API ERROR: Cannot get {url}'.format(url=request_url))
+                        resq.close()
+                        meta = {}
+                        continue
+
+                meta = {'etag': etag, 'size': total}
+                with open(part_meta, 'w') as fp:
+                    json.dump(meta, fp)
+
+                if mode == 'wb':
+                    # Bytes of earlier attempts are overwritten
+                    size = 0
+                with open(part, mode) as fp:
+                    for chunk in resq.iter_content(chunk_size=chunk_size):
+                        fp.write(chunk)
+                        size += len(chunk)
+            except (requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout) as err:
+                if attempt >= self.retry['total']:
+                    raise Exception(
+                        "WaPOR API Error Connecting: {e}".format(e=err))
+            else:
+                if total is None or os.path.getsize(part) == total:
+                    break
+                if attempt >= self.retry['total']:
+                    raise Exception(
+                        'WaPOR API ERROR: Download incomplete,'
+                        ' {n} of {t} bytes'.format(
+                            n=os.path.getsize(part), t=total))
+            finally:
+                resq.close()
+
+            wait = self._retryBackoff(attempt)
+            print('WaPOR API: Resume download {i}/{n} in {t:.1f}sec'.format(
+                i=attempt + 1, n=self.retry['total'], t=wait))
+            with self._stats_lock:
+                self.stats['retries'] += 1
+                self.stats['backoff_seconds'] += wait
+            time.sleep(wait)
+            attempt += 1
+
+        os.replace(part, filename)
+        try:
+            os.remove(part_meta)
+        except OSError:
+            pass
+        return size
+
+    def setDownloadSegments(self, segments=DOWNLOAD_SEGMENTS,
+                            min_size=DOWNLOAD_SEGMENT_MIN_SIZE):
+        """Set segmented download of large files
+
+        Files are split into byte ranges, fetched over up to ``segments``
+        connections at once into a pre-allocated ``filename.part``.
+        Segment size starts at ``min_size``, and follows the observed
+        throughput per connection, about 5sec per segment. The download
+        starts on two connections, and adds one while the throughput per
+        connection holds, drops one when it falls.
 
-            ijob += 1
+        Parameters
+        ----------
+        segments: int, optional
+            Maximum number of connections per file, default 4, 1 disables
+            segmented download.
+        min_size: int, optional
+            Smallest segment in bytes, default 4 MB, smaller files are
+            downloaded over one connection.
+        """
+        if not isinstance(segments, int) or segments < 1:
+            raise ValueError(
+                'WaPOR API ERROR: segments "{v}"'
+                ' is not correct!'.format(v=segments))
+        self.downloadSegments = segments
+        self.downloadSegmentSize = min_size
+
+    def _downloadSegmented(self, download_url, filename, chunk_size,
+                           refresh=None):
+        """Download byte ranges over several connections
+
+        Completed ranges are kept in ``filename.part.json``, an
+        interrupted download fetches the missing ranges only.
+        Returns downloaded bytes, None if the server does not support
+        ranges, the file is small, or the url has expired, then the file
+        is downloaded over one connection, see :meth:`_downloadStream`.
+        """
+        part = '{0}.part'.format(filename)
+        part_meta = '{0}.json'.format(part)
+
+        # Signed urls may only allow GET, probe with the first byte
+        resq = self.request('GET', download_url, raise_for_status=False,
+                            stream=True, headers={'Range': 'bytes=0-0'})
+        resq.close()
+        if resq.status_code != 206:
+            return None
+        total = self._contentTotal(resq)
+        etag = resq.headers.get('ETag')
+        if total is None or total < 2 * self.downloadSegmentSize:
+            return None
+
+        done = []
+        meta = self._readPartMeta(part, part_meta)
+        if etag and meta.get('etag') == etag and meta.get('size') == total:
+            done = meta.get('ranges', [])
+        else:
+            with open(part, 'wb') as fp:
+                fp.truncate(total)
+
+        state = {
+            'url': download_url,
+            'etag': etag,
+            'size': total,
+            'ranges': done,
+            'gaps': self._rangeGaps(done, total),
+            'segment': self.downloadSegmentSize,
+            'streams': min(2, self.downloadSegments),
+            'rate': None,
+            'best': None,
+            'bytes': 0,
+            'expired': False,
+            'stop': False
+        }
+        lock = threading.Condition()
+        self._writePartMeta(part_meta, state)
+
+        def worker(stream):
+            try:
+                with open(part, 'r+b') as fp:
+                    while True:
+                        with lock:
+                            while (stream >= state['streams'] and
+                                   state['gaps'] and not state['stop']):
+                                lock.wait()
+                            if not state['gaps'] or state['stop']:
+                                return
+                            start, end = state['gaps'][0]
+                            stop = min(end, start + state['segment'] - 1)
+                            if stop == end:
+                                state['gaps'].pop(0)
+                            else:
+                                state['gaps'][0] = [stop + 1, end]
+                        self._downloadRange(fp, start, stop, chunk_size,
+                                            state, lock, part_meta)
+            except BaseException:
+                # Wake paused connections
+                with lock:
+                    state['stop'] = True
+                    lock.notify_all()
+                raise
+
+        print('WaPOR API: Download {s:.1f}MB in segments, up to {n}'
+              ' connections'.format(s=total / 1048576.0,
+                                    n=self.downloadSegments))
+        with ThreadPoolExecutor(max_workers=self.downloadSegments) as executor:
+            futures = [executor.submit(worker, i)
+                       for i in range(self.downloadSegments)]
+            try:
+                for future in futures:
+                    future.result()
+            finally:
+                with lock:
+                    state['stop'] = True
+                    lock.notify_all()
+
+        if state['expired']:
+            # Refreshed url is a new object, ranges do not match
+            print('WaPOR API: Download url expired, download again'
+                  ' over one connection')
+            return None
+
+        os.replace(part, filename)
+        try:
+            os.remove(part_meta)
+        except OSError:
+            pass
+        return state['bytes']
+
+    def _downloadRange(self, fp, start, end, chunk_size,
+                       state, lock, part_meta):
+        """Download one byte range into the part file at its offset
+
+        An expired url stops the segmented download, see
+        :meth:`_downloadSegmented`.
+        """
+        attempt = 0
+        pos = start
+        dt_start = time.time()
+        while pos <= end:
+            request_headers = {'Range': 'bytes={0}-{1}'.format(pos, end)}
+            if state['etag'] and not state['etag'].startswith('W/'):
+                request_headers['If-Range'] = state['etag']
+
+            resq = self.request('GET', state['url'], raise_for_status=False,
+                                stream=True, headers=request_headers)
+            try:
+                if resq.status_code in DOWNLOAD_EXPIRED_STATUS:
+                    with lock:
+                        state['expired'] = True
+                        state['stop'] = True
+                        lock.notify_all()
+                    return
+
+                if (resq.status_code != 206 or
+                        self._contentStart(resq) != pos or
+                        resq.headers.get('ETag') != state['etag']):
+                    raise Exception(
+                        'WaPOR API ERROR: Download range {a}-{b} is not'
+                        ' correct, status {s}'.format(
+                            a=pos, b=end, s=resq.status_code))
+
+                fp.seek(pos)
+                for chunk in resq.iter_content(chunk_size=chunk_size):
+                    fp.write(chunk)
+                    pos += len(chunk)
+                    with lock:
+                        state['bytes'] += len(chunk)
+            except (requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout) as err:
+                if attempt >= self.retry['total']:
+                    raise Exception(
+                        "WaPOR API Error Connecting: {e}".format(e=err))
+                wait = self._retryBackoff(attempt)
+                with self._stats_lock:
+                    self.stats['retries'] += 1
+                    self.stats['backoff_seconds'] += wait
+                print('WaPOR API: Resume segment {a}-{b} {i}/{n}'
+                      ' in {t:.1f}sec'.format(a=pos, b=end, i=attempt + 1,
+                                              n=self.retry['total'], t=wait))
+                time.sleep(wait)
+                attempt += 1
+            finally:
+                resq.close()
+        fp.flush()
+
+        rate = (end - start + 1) / max(time.time() - dt_start, 1e-6)
+        with lock:
+            self._adaptSegments(state, rate)
+            state['ranges'].append([start, end])
+            self._writePartMeta(part_meta, state)
+            lock.notify_all()
+
+    def _adaptSegments(self, state, rate):
+        """Adapt segment size and connections to throughput per connection
+
+        Segment size follows the throughput per connection. A connection
+        is added while the throughput per connection stays at 3/4 of the
+        best observed, the link is not saturated, and dropped below 1/2.
+        """
+        if state['rate'] is None:
+            state['rate'] = rate
+        else:
+            state['rate'] = 0.3 * rate + 0.7 * state['rate']
+        if state['best'] is None or state['rate'] > state['best']:
+            state['best'] = state['rate']
+
+        state['segment'] = int(min(
+            max(state['rate'] * DOWNLOAD_SEGMENT_SECOND,
+                self.downloadSegmentSize),
+            DOWNLOAD_SEGMENT_MAX_SIZE))
+
+        if state['rate'] >= 0.75 * state['best']:
+            if state['streams'] < self.downloadSegments:
+                state['streams'] += 1
+        elif state['rate'] < 0.5 * state['best']:
+            if state['streams'] > 1:
+                state['streams'] -= 1
+
+    @staticmethod
+    def _rangeGaps(ranges, size):
+        """Byte ranges of [0, size) not in ranges
+        """
+        gaps = []
+        pos = 0
+        for start, end in sorted(ranges):
+            if start > pos:
+                gaps.append([pos, start - 1])
+            pos = max(pos, end + 1)
+        if pos < size:
+            gaps.append([pos, size - 1])
+        return gaps
+
+    @staticmethod
+    def _writePartMeta(part_meta, state):
+        """Write ETag, size and completed ranges of a segmented download
+        """
+        meta = {
+            'etag': state['etag'],
+            'size': state['size'],
+            'ranges': state['ranges']
+        }
+        with open(part_meta, 'w') as fp:
+            json.dump(meta, fp)
+
+    @staticmethod
+    def _readPartMeta(part, part_meta):
+        """Read ETag and size of a partial download
+        """
+        if not os.path.exists(part):
+            return {}
+        try:
+            with open(part_meta, 'r') as fp:
+                return json.load(fp)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _contentStart(resq):
+        """First byte position of Content-Range, None if not a range
+        """
+        match = re.match(r'bytes (\d+)-\d+/',
+                         resq.headers.get('Content-Range', ''))
+        if match is None:
+            return None
+        return int(match.group(1))
+
+    @staticmethod
+    def _contentTotal(resq):
+        """Complete file size, from Content-Range or Content-Length
+        """
+        match = re.match(r'bytes \d+-\d+/(\d+)',
+                         resq.headers.get('Content-Range', ''))
+        if match is not None:
+            return int(match.group(1))
+        if resq.status_code == 200 and 'Content-Length' in resq.headers:
+            if resq.headers.get('Content-Encoding') in [None, 'identity']:
+                return int(resq.headers['Content-Length'])
+        return None
 
     def getPixelTimeseries(self, pixelCoordinates, cube_code,
-                           time_range="2009-01-01,2018-12-31"):
+                           time_range="2009-01-01,2018-12-31", version=None):
         """Get Pixel Timeseries
 
         Do not need Authorization
@@ -1398,6 +3644,8 @@ class WaPOR_API_class(object):
             Cube code.
         time_range: str, optional
             "YYYY-MM-DD,YYYY-MM-DD".
+        version: int, optional
+            WaPOR workspace version, default current version.
 
         Returns
         -------
@@ -1405,12 +3653,11 @@ class WaPOR_API_class(object):
             Point timeseries table.
         """
         self.isAPITokenSet()
+        if version is None:
+            version = self.version
 
         # get cube info
-        # cube_info = self.getCubeInfo(cube_code)
-        catalog = self.getCatalog(self.version, self.level, cubeInfo=True)
-        cube_info = catalog.loc[catalog['code'] == cube_code].to_dict('records')[
-            0]
+        cube_info = self.getCubeMeta(cube_code, version)
 
         # get measures
         cube_measure_code = cube_info['measure']['code']
@@ -1437,7 +3684,7 @@ class WaPOR_API_class(object):
             "params": {
                 "cube": {
                     "code": cube_code,
-                    "workspaceCode": self.workspaces[self.version],
+                    "workspaceCode": self.workspaces[version],
                     "language": "en"
                 },
                 "dimensions": [
@@ -1458,34 +3705,191 @@ class WaPOR_API_class(object):
         }
 
         # requests
+        resq = self.request(
+            'POST',
+            request_url,
+            # headers=request_headers,
+            json=request_json)
+        resq_json = resq.json()
         try:
-            resq = requests.post(
-                request_url,
-                # headers=request_headers,
-                json=request_json)
-            resq.raise_for_status()
-        except requests.exceptions.HTTPError as err:
-            raise Exception("WaPOR API Http Error: {e}".format(e=err))
-        except requests.exceptions.ConnectionError as err:
-            raise Exception("WaPOR API Error Connecting: {e}".format(e=err))
-        except requests.exceptions.Timeout as err:
-            raise Exception("WaPOR API Timeout Error: {e}".format(e=err))
-        except requests.exceptions.RequestException as err:
-            raise Exception("WaPOR API OOps: Something Else {e}".format(e=err))
-        else:
-            resq_json = resq.json()
-            try:
-                resp = resq_json['response']
-                # print(resp)
+            resp = resq_json['response']
+            # print(resp)
 
-                if resq_json['message'] == 'OK':
-                    try:
-                        df = pd.DataFrame(resp['items'], columns=resp['header'])
-                        return df
-                    except BaseException:
-                        print('WaPOR API ERROR: Server response is empty')
-                        return None
-                else:
-                    print(resq_json['message'])
-            except BaseException:
-                print('WaPOR API ERROR: Cannot get {url}'.format(url=request_url))
+            if resq_json['message'] == 'OK':
+                try:
+                    df = pd.DataFrame(resp['items'], columns=resp['header'])
+                    return df
+                except BaseException:
+                    print('WaPOR API ERROR: Server response is empty')
+                    return None
+            else:
+                print(resq_json['message'])
+        except BaseException:
+            print('WaPOR API ERROR: Cannot get {url}'.format(url=request_url))
+
+
+class AsyncWaPOR_API(object):
+    """Asyncio WaPOR API Class
+
+    Same surface as :class:`WaPOR_API_class`, as coroutines. Blocking
+    HTTP calls run on a thread pool of ``max_workers`` threads sharing the
+    pooled session. Job polls run on their own pool of ``max_polls``
+    threads, and wait between polls with :func:`asyncio.sleep`, so
+    hundreds of jobs can be submitted and polled on one event loop,
+    with up to ``max_polls`` status requests in flight at a time.
+    The session pool of ``api`` is grown to ``max_workers + max_polls``
+    connections, concurrency of ``api`` itself is unchanged.
+
+    Queries run concurrently, pass ``version`` to each call, the current
+    version of the wrapped client is shared by all calls.
+
+    Parameters
+    ----------
+    api: :obj:`WaPOR_API_class`, optional
+        Synchronous client to wrap, default new client.
+    print_job: bool
+        Print job details, default True.
+    max_workers: int
+        Number of concurrent HTTP calls, default 4.
+    max_polls: int
+        Number of concurrent job polls, default 32.
+    """
+
+    def __init__(self, api=None, print_job=True, max_workers=MAX_WORKERS,
+                 max_polls=ASYNC_POLLS):
+        """
+        """
+        if api is None:
+            api = WaPOR_API_class(print_job=print_job,
+                                  max_workers=max_workers)
+        self.api = api
+        workers = api.max_workers
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._pollExecutor = ThreadPoolExecutor(max_workers=max_polls)
+        api.setPoolSize(workers + max_polls)
+
+    def close(self):
+        """Shutdown the thread pools
+        """
+        self._executor.shutdown(wait=True)
+        self._pollExecutor.shutdown(wait=True)
+
+    async def _run(self, func, *args, **kwargs):
+        """Run blocking function on the thread pool
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(func, *args, **kwargs))
+
+    async def _poll(self, func, *args):
+        """Run blocking job poll on the poll thread pool
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self._pollExecutor, functools.partial(func, *args))
+
+    async def setAPIToken(self, APIToken):
+        """Initiate AccessToken and RefreshToken, see
+        :meth:`WaPOR_API_class.setAPIToken`
+        """
+        return await self._run(self.api.setAPIToken, APIToken)
+
+    async def getCatalog(self, version=None, level=None, cubeInfo=True):
+        """Get catalog from workspace, see :meth:`WaPOR_API_class.getCatalog`
+        """
+        return await self._run(self.api.getCatalog,
+                               version, level, cubeInfo=cubeInfo)
+
+    async def getCubeInfo(self, cube_code, version=None, level=None):
+        """Get cube info, see :meth:`WaPOR_API_class.getCubeInfo`
+        """
+        return await self._run(self.api.getCubeInfo,
+                               cube_code, version=version, level=level)
+
+    async def getAvailData(self, cube_code, time_range='2009-01-01,2018-12-31',
+                           location=[], season=[], stage=[],
+                           version=None, level=None):
+        """Get Available Data, see :meth:`WaPOR_API_class.getAvailData`
+        """
+        return await self._run(self.api.getAvailData,
+                               cube_code, time_range=time_range,
+                               location=location, season=season, stage=stage,
+                               version=version, level=level)
+
+    async def getAvailDataMany(self, cube_codes,
+                               time_range='2009-01-01,2018-12-31',
+                               location=[], season=[], stage=[],
+                               version=None, level=None):
+        """Get Available Data of many cubes,
+        see :meth:`WaPOR_API_class.getAvailDataMany`
+        """
+        return await self._run(self.api.getAvailDataMany,
+                               cube_codes, time_range=time_range,
+                               location=location, season=season, stage=stage,
+                               version=version, level=level)
+
+    async def getCropRasterURL(self, bbox, cube_code,
+                               time_code, rasterId, version=None):
+        """Get Crop Raster Url, see :meth:`WaPOR_API_class.getCropRasterURL`
+        """
+        key, download_url, job_url = await self._run(
+            self.api._startCropRaster, bbox, cube_code, time_code, rasterId,
+            version)
+        if download_url is not None:
+            return download_url
+        if job_url is None:
+            return None
+
+        download_url = await self._query_jobOutput(job_url,
+                                                   jobType='CROP RASTER')
+        await self._run(self.api._finishCropRaster, key, download_url)
+        return download_url
+
+    async def getAreaTimeseries(self, shapefile_fh, cube_code,
+                                time_range="2009-01-01,2018-12-31",
+                                version=None):
+        """Get Area Timeseries, see :meth:`WaPOR_API_class.getAreaTimeseries`
+        """
+        job_url = await self._run(self.api.submitAreaTimeseries,
+                                  shapefile_fh, cube_code,
+                                  time_range=time_range, version=version)
+        if job_url is None:
+            return None
+        return await self._query_jobOutput(job_url, jobType='AREA STATS')
+
+    async def getPixelTimeseries(self, pixelCoordinates, cube_code,
+                                 time_range="2009-01-01,2018-12-31",
+                                 version=None):
+        """Get Pixel Timeseries, see
+        :meth:`WaPOR_API_class.getPixelTimeseries`
+        """
+        return await self._run(self.api.getPixelTimeseries,
+                               pixelCoordinates, cube_code,
+                               time_range=time_range, version=version)
+
+    async def _query_jobOutput(self, job_url, jobType=None, start=None):
+        """Query Job output without blocking the event loop
+        """
+        api = self.api
+        if start is None:
+            start = time.time()
+
+        ijob = 0
+        last_time = 0.0
+        wait_time = 0.0
+        while True:
+            await asyncio.sleep(api._query_jobDelay(jobType, wait_time))
+            wait_time = time.time() - start
+
+            resp = await self._poll(api._query_jobStatus, job_url)
+            if resp is not None:
+                jobType = resp.get('type', jobType)
+
+                isDone, output = api._query_jobCheck(
+                    resp, jobType, last_time, wait_time, ijob)
+                if isDone:
+                    return output
+
+            api._query_jobDeadline(job_url, resp, wait_time)
+            last_time = wait_time
+            ijob += 1
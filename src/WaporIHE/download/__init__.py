@@ -3,7 +3,8 @@
 # import yaml
 # import inspect
 
-from .WaporAPI import WaPOR_API_class
+from .WaporAPI import WaPOR_API_class, AsyncWaPOR_API
+from .Manifest import Manifest
 
 __doc__ = """module for FAO WAPOR API"""
 __version__ = '0.1'
@@ -41,4 +42,4 @@ API = WaPOR_API_class(print_job=print_job)
 #
 # print(API.isAPIToken)
 
-__all__ = ['API']
+__all__ = ['API', 'AsyncWaPOR_API', 'Manifest']
@@ -0,0 +1,699 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import datetime
+import io
+import json
+import threading
+import time
+
+import pandas as pd
+import pytest
+import requests
+from WaporIHE.download.WaporAPI import AsyncWaPOR_API, WaPOR_API_class
+
+__author__ = "Quan Pan"
+__copyright__ = "Quan Pan"
+__license__ = "apache"
+
+
+def response(status, content=None, headers=None):
+    resq = requests.models.Response()
+    resq.status_code = status
+    resq._content = json.dumps(content).encode()
+    resq._content_consumed = True
+    resq.headers.update(headers or {})
+    return resq
+
+
+class Replies(object):
+    """Fake session request, replies or raises in order, records requests
+    """
+
+    def __init__(self, api, replies):
+        api.session.request = self.request
+        self.replies = list(replies)
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+
+def client():
+    api = WaPOR_API_class(print_job=False)
+    api.isAPIToken = True
+    api.token['time']['expire'] = 3600
+    return api
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(time, 'sleep', sleeps.append)
+    return sleeps
+
+
+def test_AsyncWaPOR_API_pool():
+    api = WaPOR_API_class(print_job=False)
+    session = api.session
+
+    # Pool grows once for the job polls, concurrency is unchanged
+    first = AsyncWaPOR_API(api, max_polls=32)
+    second = AsyncWaPOR_API(api, max_polls=32)
+    adapter = api.session.get_adapter('https://')
+    assert api.session is session
+    assert api.max_workers == 4
+    assert api.poolSize == 36
+    assert adapter.poolmanager.connection_pool_kw['maxsize'] == 36
+
+    api.getCubeInfo = lambda cube_code, version=None, level=None: (
+        cube_code, version, level)
+    loop = asyncio.new_event_loop()
+    assert loop.run_until_complete(
+        first.getCubeInfo('L1_AETI_D', version=1)) == ('L1_AETI_D', 1, None)
+    loop.close()
+    first.close()
+    second.close()
+
+
+def test_request_retry(sleeps):
+    api = WaPOR_API_class(print_job=False)
+    replies = Replies(api, [
+        response(503, headers={'Retry-After': '7'}),
+        requests.exceptions.ReadTimeout('read'),
+        response(200, {'message': 'OK'})])
+
+    resq = api.request('GET', api.path['catalog'])
+    assert resq.json() == {'message': 'OK'}
+    # Retry-After, then backoff within 2sec
+    assert sleeps[0] == 7
+    assert 0 <= sleeps[1] <= 2
+    assert api.getStats()['retries'] == 2
+
+    # Default (connect, read) timeout
+    assert [call[2]['timeout'] for call in replies.calls] == [
+        (10, 120)] * 3
+    api.setRetry(timeout=5)
+    replies = Replies(api, [response(200)])
+    api.request('GET', api.path['catalog'])
+    assert replies.calls[0][2]['timeout'] == 5
+
+
+def test_request_retry_total(sleeps):
+    api = WaPOR_API_class(print_job=False)
+    api.setRetry(total=2)
+    replies = Replies(api, [response(500)] * 3)
+
+    with pytest.raises(Exception, match='Http Error'):
+        api.request('GET', api.path['catalog'])
+    assert len(replies.calls) == 3
+    assert len(sleeps) == 2
+
+
+def test_request_not_idempotent(sleeps):
+    api = WaPOR_API_class(print_job=False)
+    request_json = {'type': 'CropRaster'}
+
+    # Server may have processed the job, not sent again
+    Replies(api, [response(500)])
+    with pytest.raises(Exception, match='Http Error'):
+        api.request('POST', api.path['query'], json=request_json)
+    Replies(api, [requests.exceptions.ReadTimeout('read')])
+    with pytest.raises(Exception, match='Timeout'):
+        api.request('POST', api.path['query'], json=request_json)
+
+    # Rejected or never sent, retried
+    Replies(api, [
+        response(429),
+        requests.exceptions.ConnectTimeout('connect'),
+        response(200)])
+    assert api.request('POST', api.path['query'],
+                       json=request_json).status_code == 200
+
+    # Listing queries are safe to send again
+    Replies(api, [response(500), response(200)])
+    assert api.request('POST', api.path['query'],
+                       json={'type': 'MDAQuery_Table'}).status_code == 200
+
+
+def test_refresh_single_flight():
+    api = WaPOR_API_class(print_job=False)
+    start = datetime.datetime.now().timestamp() - 3600
+    api.token = {
+        'API': 'test_refresh_single_flight',
+        'Access': 'old',
+        'Refresh': 'refresh',
+        'time': {'expire': 3600, 'start': start, 'now': start}
+    }
+    api.isAPIToken = True
+
+    calls = []
+
+    def refresh(RefreshToken):
+        calls.append(RefreshToken)
+        # Other threads arrive while the refresh is running
+        time.sleep(0.2)
+        return {'accessToken': 'new', 'refreshToken': 'refresh2',
+                'expiresIn': 3600}
+
+    api._query_refreshToken = refresh
+    threads = [threading.Thread(target=api.isAPITokenExpired)
+               for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == ['refresh']
+    assert api.token['Access'] == 'new'
+    assert api.token['Refresh'] == 'refresh2'
+
+
+def test_setAPIToken_cache(tmpdir):
+    path = str(tmpdir.join('tokens.json'))
+    calls = []
+
+    def sign_in(APIToken):
+        calls.append(APIToken)
+        return {'accessToken': 'access', 'refreshToken': 'refresh',
+                'expiresIn': 3600}
+
+    for i in range(2):
+        api = WaPOR_API_class(print_job=False)
+        api.setTokenCache(path)
+        api._query_accessToken = sign_in
+        api.setAPIToken('test_setAPIToken_cache')
+        assert api.token['Access'] == 'access'
+
+    # Second client reuses the cached token pair
+    assert calls == ['test_setAPIToken_cache']
+
+
+CATALOG = [
+    {'code': 'L1_AETI_D', 'caption': 'Actual EvapoTranspiration'},
+    {'code': 'L1_PCP_D', 'caption': 'Precipitation'}
+]
+
+
+def test_metadataCache(tmpdir):
+    path = str(tmpdir.join('metadata.sqlite'))
+    api = client()
+    api.setMetadataCache(path)
+    replies = Replies(api, [response(200, {'message': 'OK',
+                                           'response': CATALOG})])
+    assert api.getCatalog(2, 1, cubeInfo=False)['code'].tolist() == [
+        'L1_AETI_D', 'L1_PCP_D']
+    assert len(replies.calls) == 1
+
+    # Next client loads catalog and cube index from disk, offline
+    api = client()
+    api.setMetadataCache(path, mode='offline')
+    replies = Replies(api, [])
+    assert api.getCatalog(2, 1, cubeInfo=False)['code'].tolist() == [
+        'L1_AETI_D', 'L1_PCP_D']
+    assert api.metaCache.get('index', 'WAPOR_2/L1_PCP_D') is not None
+    assert api.getStats()['metadata_hits'] == 1
+    assert replies.calls == []
+
+    # Invalidated catalog is removed from disk
+    api.invalidateCatalog(2, 1)
+    assert api.metaCache.get('catalog', api._catalogURL(2, 1)) is None
+    assert api.metaCache.get('index', 'WAPOR_2/L1_PCP_D') is None
+    with pytest.raises(Exception, match='offline'):
+        api.getCatalog(2, 1, cubeInfo=False)
+    api.setMetadataCache()
+
+
+class Routes(object):
+    """Fake session request, reply by url, records requests
+    """
+
+    def __init__(self, api, routes):
+        api.session.request = self.request
+        self.routes = routes
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append(url)
+        items = self.routes.get(url, [{'code': 'OTHER', 'caption': ''}])
+        return response(200, {'message': 'OK', 'response': items})
+
+
+def test_resolveCube():
+    api = client()
+    routes = Routes(api, {
+        api._catalogURL(2, 1): CATALOG,
+        api._catalogURL(1, 1): CATALOG,
+        api._catalogURL(1, 2): [{'code': 'L2_V1_D', 'caption': 'v1 only'}]
+    })
+
+    # Loaded v1 catalog does not shadow v2
+    api.getCatalog(1, 1, cubeInfo=False)
+    assert api.resolveCube('L1_AETI_D') == {
+        'version': 2, 'workspace': 'WAPOR_2', 'level': 1}
+    assert routes.calls == [api._catalogURL(1, 1), api._catalogURL(2, 1)]
+
+    # Prefix level first, v2 before v1
+    del routes.calls[:]
+    assert api.resolveCube('L2_V1_D') == {
+        'version': 1, 'workspace': 'WAPOR', 'level': 2}
+    assert routes.calls == [api._catalogURL(2, 2), api._catalogURL(2, 3),
+                            api._catalogURL(1, 2)]
+
+    # Index hit, no catalog request
+    del routes.calls[:]
+    assert api._resolveVersion('L1_PCP_D') == (2, 1)
+    assert api._resolveVersion('L1_PCP_D', 1, 1) == (1, 1)
+    assert api.resolveCube('L3_NONE_D') is None
+    assert routes.calls == [api._catalogURL(1, 3)]
+
+
+TIME_MEMBERS = pd.DataFrame({
+    'code': ['[2009-01-01,2009-01-11)', '[2009-01-11,2009-01-21)'],
+    'caption': ['2009-01 D1', '2009-01 D2']
+})
+
+
+def header(value):
+    return {'type': 'ROW_HEADER', 'value': value}
+
+
+def data(raster_id):
+    return {
+        'type': 'DATA_CELL',
+        'value': 1.0,
+        'metadata': {
+            'raster': {
+                'id': raster_id,
+                'bbox': [{'srid': 'EPSG:4326', 'value': [0, 0, 1, 1]}]
+            }
+        }
+    }
+
+
+ITEMS = [
+    [header('S1'), header('2009-01 D1'), data('L2_S1_0901'), data('x')],
+    [header('S1'), header('2009-01 D2'), data('L2_S1_0902'), data('x')],
+    [header('S2'), header('2009-01 D1'), data('L2_S2_0901'), data('x')],
+]
+KEYS = ['SEASON', 'DEKAD', 'raster_id', 'bbox', 'time_code']
+
+
+def parse_iterrows(df, keys, time_dims_code, df_time):
+    """Available Data parsing before vectorization
+    """
+    df_dict = {i: [] for i in keys}
+    for irow, row in df.iterrows():
+        for i in range(len(row) - 1):
+            if row[i]['type'] == 'ROW_HEADER':
+                key_info = row[i]['value']
+
+                df_dict[keys[i]].append(key_info)
+                if keys[i] == time_dims_code:
+                    time_info = df_time.loc[
+                        df_time['caption'] == key_info].to_dict(
+                        orient='records')
+                    df_dict['time_code'].append(time_info[0]['code'])
+            if row[i]['type'] == 'DATA_CELL':
+                raster_info = row[i]['metadata']['raster']
+
+                df_dict['raster_id'].append(raster_info['id'])
+                df_dict['bbox'].append(raster_info['bbox'])
+    return pd.DataFrame.from_dict(df_dict)
+
+
+def test_parse_availData_objects():
+    api = client()
+    df = pd.DataFrame(ITEMS)
+
+    expected = parse_iterrows(df, KEYS, 'DEKAD', TIME_MEMBERS)
+    result = api._parse_availData(df, KEYS, 'DEKAD', TIME_MEMBERS)
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_parse_availData_flattened():
+    api = client()
+    df = pd.DataFrame(ITEMS)
+    df_flat = pd.DataFrame([
+        WaPOR_API_class._flattenRecord(dict(enumerate(item)))
+        for item in ITEMS])
+
+    expected = parse_iterrows(df, KEYS, 'DEKAD', TIME_MEMBERS)
+    result = api._parse_availData(df_flat, KEYS, 'DEKAD', TIME_MEMBERS)
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_parse_availData_refresh_time():
+    api = client()
+    df = pd.DataFrame(ITEMS)
+    calls = []
+
+    def refresh_time():
+        calls.append(True)
+        return TIME_MEMBERS
+
+    result = api._parse_availData(df, KEYS, 'DEKAD', TIME_MEMBERS.iloc[:1],
+                                  refresh_time=refresh_time)
+    assert len(calls) == 1
+    assert result['time_code'].tolist() == [
+        '[2009-01-01,2009-01-11)',
+        '[2009-01-11,2009-01-21)',
+        '[2009-01-01,2009-01-11)']
+
+
+def streamed(content):
+    resq = response(200)
+    resq.raw = io.BytesIO(json.dumps(content).encode())
+    return resq
+
+
+def test_streamJSON():
+    pytest.importorskip('ijson')
+    api = client()
+    content = {
+        'message': 'OK',
+        'response': {
+            'header': ['SEASON'],
+            'items': [
+                [header('S1'), data('L2_S1_0901')],
+                [header('S2')]
+            ]
+        }
+    }
+
+    # Records become columns, missing values are None
+    resq_json = api._streamJSON(streamed(content), 'response.items')
+    assert resq_json['message'] == 'OK'
+    items = resq_json['response']['items']
+    assert items[0] == [header('S1'), header('S2')]
+    assert items[1] == [data('L2_S1_0901'), None]
+    assert 'header' not in resq_json['response']
+
+    # Flattened nested objects, columns by path
+    items = api._streamJSON(streamed(content), 'response.items',
+                            flatten=True)['response']['items']
+    assert items['0.value'] == ['S1', 'S2']
+    assert items['1.metadata.raster.id'] == ['L2_S1_0901', None]
+
+    # Streaming request, same rows as resq.json()
+    api.setStreamDecode()
+    replies = Replies(api, [streamed({'message': 'OK', 'response': ITEMS})])
+    resq_json = api._query_json('POST', api.path['query'],
+                                stream_items='response', json={})
+    assert replies.calls[0][2]['stream']
+    pd.testing.assert_frame_equal(pd.DataFrame(resq_json['response']),
+                                  pd.DataFrame(ITEMS))
+
+
+def test_pageRequest():
+    url, request_json = WaPOR_API_class._pageRequest(
+        'http://a/cubes?overview=false&paged=false', None, 10, 3)
+    assert url == ('http://a/cubes?overview=false'
+                   '&paged=true&pageSize=10&pageNo=3')
+    assert request_json is None
+    assert WaPOR_API_class._pageRequest('http://a/cubes', None, 10, 1)[0] == \
+        'http://a/cubes?paged=true&pageSize=10&pageNo=1'
+
+    query = {'type': 'MDAQuery_Table', 'params': {'properties': {}}}
+    url, request_json = WaPOR_API_class._pageRequest('http://a', query, 10, 2)
+    assert request_json['params']['properties'] == {
+        'paged': True, 'pageSize': 10, 'pageNo': 2}
+    # Request json of the caller is not changed
+    assert query['params']['properties'] == {}
+
+
+class Pages(object):
+    """Fake session request, replies pages of items by pageNo
+    """
+
+    def __init__(self, api, items, message='OK'):
+        api.session.request = self.request
+        self.items = items
+        self.message = message
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        properties = kwargs['json']['params']['properties']
+        self.calls.append(properties.get('pageNo'))
+        if not properties['paged']:
+            items = self.items
+        else:
+            size, no = properties['pageSize'], properties['pageNo']
+            items = self.items[(no - 1) * size:no * size]
+        return response(200, {'message': self.message,
+                              'response': {'items': items}})
+
+
+def test_iterPages():
+    api = client()
+    pages = Pages(api, list(range(7)))
+    query = {'type': 'MDAQuery_Table', 'params': {'properties': {}}}
+
+    assert list(api._iterPages('POST', api.path['query'], page_size=3,
+                               json=query)) == [[0, 1, 2], [3, 4, 5], [6]]
+    # Up to max_workers pages requested ahead
+    assert sorted(pages.calls)[:3] == [1, 2, 3]
+    assert len(pages.calls) <= 3 + api.max_workers
+
+    pages = Pages(api, list(range(6)))
+    assert list(api._iterPages('POST', api.path['query'], page_size=3,
+                               json=query)) == [[0, 1, 2], [3, 4, 5]]
+
+    Pages(api, list(range(6)), message='Error')
+    with pytest.raises(Exception, match='Cannot get page 1'):
+        list(api._iterPages('POST', api.path['query'], page_size=3,
+                            json=query))
+
+
+def availability(api):
+    api.getCubeInfo = lambda cube_code, version=None, level=None: {
+        'measure': {'code': 'WATER_MM'},
+        'dimension': [{'type': 'WHAT', 'code': 'SEASON'},
+                      {'type': 'TIME', 'code': 'DEKAD'}]
+    }
+    api._query_dimensionsMembers = lambda cube_code, dims_code, version=None, \
+        refresh=False: TIME_MEMBERS if dims_code == 'DEKAD' else \
+        pd.DataFrame({'code': ['S1', 'S2']})
+
+
+def test_iterAvailData():
+    api = client()
+    availability(api)
+    expected = parse_iterrows(pd.DataFrame(ITEMS), KEYS, 'DEKAD',
+                              TIME_MEMBERS)
+
+    # Page size not set, one paged=false query
+    pages = Pages(api, ITEMS)
+    dfs = list(api.iterAvailData('L2_CTY_PHE_S', version=2, level=2))
+    assert pages.calls == [None]
+    assert len(dfs) == 1
+    pd.testing.assert_frame_equal(dfs[0], expected)
+
+    api.setPageSize(2)
+    pages = Pages(api, ITEMS)
+    dfs = list(api.iterAvailData('L2_CTY_PHE_S', version=2, level=2))
+    assert [len(df) for df in dfs] == [2, 1]
+    pd.testing.assert_frame_equal(pd.concat(dfs), expected)
+
+    # Errors are raised, not an empty table
+    for page_size in [None, 2]:
+        api.setPageSize(page_size)
+        Pages(api, ITEMS, message='Error')
+        with pytest.raises(Exception):
+            list(api.iterAvailData('L2_CTY_PHE_S', version=2, level=2))
+    assert api.getAvailData('L2_CTY_PHE_S', version=2, level=2) is None
+
+
+def test_getAvailDataMany():
+    api = client()
+    availability(api)
+    cubes = {
+        'L1_AETI_D': {'version': 2, 'workspace': 'WAPOR_2', 'level': 1},
+        'L1_V1_D': {'version': 1, 'workspace': 'WAPOR', 'level': 1}
+    }
+    api.resolveCube = cubes.get
+    metas = []
+    api._query_cubesMeta = lambda codes, version: metas.append(
+        (version, list(codes)))
+    pages = Pages(api, ITEMS)
+    request = pages.request
+    workspaces = []
+
+    def query(method, url, **kwargs):
+        cube = kwargs['json']['params']['cube']
+        workspaces.append((cube['code'], cube['workspaceCode']))
+        return request(method, url, **kwargs)
+
+    api.session.request = query
+    df = api.getAvailDataMany(['L1_V1_D', 'MISSING', 'L1_AETI_D'])
+
+    # Metadata once per workspace, each cube queried in its workspace
+    assert sorted(metas) == [(1, ['L1_V1_D']), (2, ['L1_AETI_D'])]
+    assert sorted(workspaces) == [('L1_AETI_D', 'WAPOR_2'),
+                                  ('L1_V1_D', 'WAPOR')]
+    assert api.version == 2
+    assert df.index.names == ['cube_code', 'time_code']
+    assert df.index.get_level_values(0).tolist() == ['L1_V1_D'] * 3 + \
+        ['L1_AETI_D'] * 3
+    assert df.loc['L1_AETI_D']['raster_id'].tolist() == [
+        'L2_S1_0901', 'L2_S1_0902', 'L2_S2_0901']
+
+
+@pytest.fixture
+def api():
+    api = client()
+    api.cubes[(2, 'L1_AETI_D')] = {
+        'measure': {'code': 'WATER_MM'},
+        'dimension': [{'type': 'TIME', 'code': 'DEKAD'}]
+    }
+    api.cubes[(1, 'L1_AETI_D')] = api.cubes[(2, 'L1_AETI_D')]
+    api.setJobPolling(interval=0.01, max_interval=0.01)
+    return api
+
+
+class Jobs(object):
+    """Fake CropRaster jobs, a job completes after a number of polls
+    """
+
+    def __init__(self, api, polls, failed=()):
+        api.submitCropRaster = self.submit
+        api._query_jobStatus = self.status
+        self.polls = dict(polls)
+        self.failed = failed
+        self.submitted = []
+        self.running = set()
+        self.max_running = 0
+
+    def submit(self, bbox, cube_code, time_code, rasterId, version=None):
+        self.submitted.append(rasterId)
+        self.running.add(rasterId)
+        self.max_running = max(self.max_running, len(self.running))
+        return 'https://jobs/{0}'.format(rasterId)
+
+    def status(self, job_url):
+        raster_id = job_url.rsplit('/', 1)[1]
+        if raster_id not in self.polls:
+            raise Exception('Job {0} not found'.format(job_url))
+
+        self.polls[raster_id] -= 1
+        if self.polls[raster_id] > 0:
+            return {'type': 'CROP RASTER', 'status': 'RUNNING'}
+
+        self.running.discard(raster_id)
+        if raster_id in self.failed:
+            return {'type': 'CROP RASTER', 'status': 'COMPLETED WITH ERRORS',
+                    'log': ['Error']}
+        return {'type': 'CROP RASTER', 'status': 'COMPLETED',
+                'output': {'downloadUrl': url(raster_id)}}
+
+
+def url(raster_id, expires=3600):
+    return 'https://download/{0}.tif?Expires={1:.0f}'.format(
+        raster_id, time.time() + expires)
+
+
+BBOX = [37.95, 7.89, 43.35, 12.4]
+AVAIL = pd.DataFrame({
+    'raster_id': ['L1_AETI_0901', 'L1_AETI_0902', 'L1_AETI_0903',
+                  'L1_AETI_0904', 'L1_AETI_0905'],
+    'time_code': ['[2009-01-01,2009-01-11)', '[2009-01-11,2009-01-21)',
+                  '[2009-01-21,2009-02-01)', '[2009-02-01,2009-02-11)',
+                  '[2009-02-11,2009-02-21)']
+})
+POLLS = dict(zip(AVAIL['raster_id'], [4, 1, 2, 1, 3]))
+
+
+def test_iterCropRasterURLs(api):
+    jobs = Jobs(api, POLLS)
+    results = list(api.iterCropRasterURLs(BBOX, 'L1_AETI_D', AVAIL,
+                                          window=2))
+
+    # All jobs, up to window running, yielded as completed
+    assert jobs.submitted == AVAIL['raster_id'].tolist()
+    assert jobs.max_running == 2
+    assert sorted(index for index, row, download in results) == [
+        0, 1, 2, 3, 4]
+    assert [index for index, row, download in results] != [0, 1, 2, 3, 4]
+    for index, row, download in results:
+        assert row['raster_id'] == AVAIL['raster_id'][index]
+        assert download.startswith(
+            'https://download/{0}.tif'.format(row['raster_id']))
+
+    # Table order, pages of iterAvailData
+    api.setUrlCache(0)
+    jobs = Jobs(api, POLLS, failed=['L1_AETI_0903'])
+    pages = [AVAIL.iloc[:2], AVAIL.iloc[2:]]
+    results = list(api.iterCropRasterURLs(BBOX, 'L1_AETI_D', iter(pages),
+                                          window=2, ordered=True))
+    assert [index for index, row, download in results] == [0, 1, 2, 3, 4]
+    assert [download is None for index, row, download in results] == [
+        False, False, True, False, False]
+
+
+def test_iterCropRasterURLs_error(api):
+    jobs = Jobs(api, POLLS)
+    jobs.polls.pop('L1_AETI_0902')
+
+    with pytest.raises(Exception, match='not found'):
+        list(api.iterCropRasterURLs(BBOX, 'L1_AETI_D', AVAIL, window=2))
+
+
+def test_jobJournal_reattach(api, tmpdir):
+    path = str(tmpdir.join('jobs.sqlite'))
+    api.setJobJournal(path)
+    jobs = Jobs(api, POLLS)
+    rows = AVAIL.iloc[:4]
+    key = [api._cropRasterKey(BBOX, 'L1_AETI_D', row['time_code'],
+                              row['raster_id'], 2)
+           for index, row in rows.iterrows()]
+
+    # Crashed run: running job, valid and expired urls, lost job
+    journal = api.jobJournal
+    job_urls = ['https://jobs/L1_AETI_0901', 'https://jobs/L1_AETI_0902',
+                'https://jobs/L1_AETI_0903', 'https://jobs/lost']
+    for i, raster_id in enumerate(rows['raster_id']):
+        journal.submitted(key[i], 'WAPOR_2/L1_AETI_D', rows['time_code'][i],
+                          raster_id, BBOX, job_urls[i])
+    journal.completed(key[1], url('L1_AETI_0902'), time.time() + 3600)
+    journal.completed(key[2], url('L1_AETI_0903', 60), time.time() + 60)
+    api.setJobJournal()
+
+    # Restarted run, new client
+    api.setUrlCache(0)
+    api.setJobJournal(path)
+    results = {index: download for index, row, download in
+               api.iterCropRasterURLs(BBOX, 'L1_AETI_D', rows, window=2)}
+
+    assert jobs.submitted == ['L1_AETI_0903', 'L1_AETI_0904']
+    assert all(results[i].startswith('https://download/') for i in range(4))
+    assert api.jobJournal.pending() == []
+    assert api.jobJournal.get(key[0])['download_url'] == results[0]
+    api.setJobJournal()
+
+
+def test_cropRasterKey(api):
+    time_code = '[2009-01-01,2009-01-11)'
+    key = api._cropRasterKey([37.95, 7.89, 43.35, 12.4], 'L1_AETI_D',
+                             time_code, 'L1_AETI_0901', 2)
+
+    # Corner order and float noise
+    assert key == api._cropRasterKey(
+        [43.35, 12.4, 37.95, 7.89], 'L1_AETI_D',
+        time_code, 'L1_AETI_0901', 2)
+    assert key == api._cropRasterKey(
+        ['37.9500000001', 7.89, 43.35, 12.4000000001], 'L1_AETI_D',
+        time_code, 'L1_AETI_0901', 2)
+
+    assert key != api._cropRasterKey(
+        [37.95, 7.89, 43.36, 12.4], 'L1_AETI_D',
+        time_code, 'L1_AETI_0901', 2)
+    assert key != api._cropRasterKey(
+        [37.95, 7.89, 43.35, 12.4], 'L1_AETI_D',
+        '[2009-01-11,2009-01-21)', 'L1_AETI_0902', 2)
+    assert key != api._cropRasterKey(
+        [37.95, 7.89, 43.35, 12.4], 'L1_AETI_D',
+        time_code, 'L1_AETI_0901', 1)
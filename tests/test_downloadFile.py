@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+import http.server
+import os
+import socketserver
+import threading
+import time
+
+import pytest
+from WaporIHE.download.WaporAPI import WaPOR_API_class
+
+__author__ = "Quan Pan"
+__copyright__ = "Quan Pan"
+__license__ = "apache"
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """Raster server with Range and If-Range, drops connections on demand
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.log.append((self.path, self.headers.get('Range'),
+                               self.headers.get('If-Range')))
+            drop = server.drop > 0
+            if drop:
+                server.drop -= 1
+            server.active += 1
+            server.peak = max(server.peak, server.active)
+        try:
+            self.reply(server, drop)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def reply(self, server, drop):
+
+        if 'expired' in self.path:
+            self.send_response(403)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        data = server.data
+        start, end, status = 0, len(data) - 1, 200
+        byte_range = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if byte_range and if_range in [None, server.etag]:
+            first, last = byte_range[len('bytes='):].split('-')
+            start = int(first)
+            if last:
+                end = min(int(last), end)
+            status = 206
+
+        body = data[start:end + 1]
+        if server.delay:
+            # Slow link, time.sleep is patched by the tests
+            server.pause.wait(server.delay)
+        self.send_response(status)
+        self.send_header('ETag', server.etag)
+        self.send_header('Content-Length', str(len(body)))
+        if status == 206:
+            self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(
+                start, end, len(data)))
+        self.end_headers()
+
+        if drop and len(body) > 1:
+            # Connection lost in the middle of the body
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            if server.update is not None:
+                # File replaced on server before the download resumes
+                server.data, server.etag = server.update, '"v2"'
+            return
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def server():
+    server = Server(('127.0.0.1', 0), Handler)
+    server.data = os.urandom(1024 * 1024)
+    server.etag = '"v1"'
+    server.drop = 0
+    server.update = None
+    server.log = []
+    server.lock = threading.Lock()
+    server.active = 0
+    server.peak = 0
+    server.delay = 0
+    server.pause = threading.Event()
+    server.url = 'http://127.0.0.1:{0}/raster.tif'.format(
+        server.server_address[1])
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def api(monkeypatch):
+    monkeypatch.setattr(time, 'sleep', lambda seconds: None)
+    return WaPOR_API_class(print_job=False)
+
+
+def read(filename):
+    with open(filename, 'rb') as fp:
+        return fp.read()
+
+
+def test_downloadFile(api, server, tmpdir):
+    filename = str(tmpdir.join('raster.tif'))
+
+    size = api.downloadFile(server.url, filename, chunk_size=4096)
+    assert size == len(server.data)
+    assert read(filename) == server.data
+    assert os.listdir(str(tmpdir)) == ['raster.tif']
+    assert api.getStats()['download_bytes'] == len(server.data)
+
+
+def test_downloadFile_resume(api, server, tmpdir):
+    filename = str(tmpdir.join('raster.tif'))
+
+    # Dropped connection, resumed from the last written byte
+    server.drop = 2
+    size = api.downloadFile(server.url, filename, chunk_size=4096)
+    assert read(filename) == server.data
+    assert [rng for path, rng, if_range in server.log] == [
+        None, 'bytes=524288-', 'bytes=786432-']
+    assert server.log[1][2] == '"v1"'
+    # Resumed bytes counted once
+    assert size == len(server.data)
+    assert api.getStats()['download_bytes'] == len(server.data)
+
+
+def test_downloadFile_part(api, server, tmpdir):
+    filename = str(tmpdir.join('raster.tif'))
+    part = '{0}.part'.format(filename)
+
+    # Part file of an interrupted run
+    server.drop = 1
+    api.retry['total'] = 0
+    with pytest.raises(Exception, match='Connecting'):
+        api.downloadFile(server.url, filename, chunk_size=4096)
+    assert os.path.getsize(part) == len(server.data) // 2
+
+    api.retry['total'] = 5
+    del server.log[:]
+    size = api.downloadFile(server.url, filename, chunk_size=4096)
+    assert read(filename) == server.data
+    assert server.log[0][1] == 'bytes=524288-'
+    assert size == len(server.data) // 2
+
+    # File changed on server, If-Range fails, start again
+    server.drop = 1
+    server.update = os.urandom(len(server.data))
+    del server.log[:]
+    stats = api.getStats()
+    size = api.downloadFile(server.url, filename, chunk_size=4096)
+    assert read(filename) == server.update
+    assert server.log[1][1:] == ('bytes=524288-', '"v1"')
+    # Bytes of the replaced file are not counted
+    assert size == len(server.data)
+    assert api.getStats()['download_bytes'] - stats['download_bytes'] == \
+        len(server.data)
+
+
+def test_downloadFile_refresh(api, server, tmpdir):
+    filename = str(tmpdir.join('raster.tif'))
+    expired = '{0}?expired=1'.format(server.url)
+    calls = []
+
+    def refresh():
+        calls.append(True)
+        return server.url
+
+    api.downloadFile(expired, filename, refresh=refresh)
+    assert read(filename) == server.data
+    assert calls == [True]
+
+    with pytest.raises(Exception, match='expired'):
+        api.downloadFile(expired, str(tmpdir.join('other.tif')))
+
+
+def test_rangeGaps():
+    assert WaPOR_API_class._rangeGaps([], 10) == [[0, 9]]
+    assert WaPOR_API_class._rangeGaps([[0, 9]], 10) == []
+    assert WaPOR_API_class._rangeGaps([[6, 9], [0, 3]], 10) == [[4, 5]]
+    assert WaPOR_API_class._rangeGaps([[2, 5], [3, 4]], 10) == [
+        [0, 1], [6, 9]]
+
+
+def test_downloadFile_segments(api, server, tmpdir):
+    filename = str(tmpdir.join('raster.tif'))
+    api.setDownloadSegments(4, min_size=64 * 1024)
+    server.delay = 0.05
+
+    size = api.downloadFile(server.url, filename, chunk_size=4096)
+    assert read(filename) == server.data
+    assert size == len(server.data)
+    assert os.listdir(str(tmpdir)) == ['raster.tif']
+    # Probed with the first byte, then ranges over several connections
+    assert server.log[0][1] == 'bytes=0-0'
+    assert all(rng.startswith('bytes=') for path, rng, if_range
+               in server.log[1:])
+    assert server.peak >= 2
+
+    with pytest.raises(ValueError):
+        api.setDownloadSegments(0)
+
+
+def test_downloadFile_segments_resume(api, server, tmpdir):
+    filename = str(tmpdir.join('raster.tif'))
+    api.setDownloadSegments(2, min_size=64 * 1024)
+    server.delay = 0.05
+
+    # One range dropped, the other connection completes its range
+    server.drop = 2
+    api.retry['total'] = 0
+    with pytest.raises(Exception, match='Connecting'):
+        api.downloadFile(server.url, filename, chunk_size=4096)
+    assert os.path.exists('{0}.part.json'.format(filename))
+
+    # Missing ranges only
+    api.retry['total'] = 5
+    size = api.downloadFile(server.url, filename, chunk_size=4096)
+    assert read(filename) == server.data
+    assert 0 < size < len(server.data)
+
+
+def test_downloadFile_segments_expired(api, server, tmpdir):
+    filename = str(tmpdir.join('raster.tif'))
+    api.setDownloadSegments(4, min_size=64 * 1024)
+
+    # Expired url, downloaded over one connection after refresh
+    api.downloadFile('{0}?expired=1'.format(server.url), filename,
+                     refresh=lambda: server.url)
+    assert read(filename) == server.data
+    assert [(path.endswith('expired=1'), rng)
+            for path, rng, if_range in server.log] == [
+        (True, 'bytes=0-0'), (True, None), (False, None)]
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sqlite3
+
+import pandas as pd
+import pytest
+from WaporIHE.download import Engine
+from WaporIHE.download.JobJournal import JobJournal
+from WaporIHE.download.WaporAPI import WaPOR_API_class
+
+__author__ = "Quan Pan"
+__copyright__ = "Quan Pan"
+__license__ = "apache"
+
+
+BBOX = [37.95, 7.89, 43.35, 12.4]
+AVAIL = pd.DataFrame({
+    'raster_id': ['L1_AETI_0901', 'L1_AETI_0902', 'L1_AETI_0903'],
+    'time_code': ['[2009-01-01,2009-01-11)', '[2009-01-11,2009-01-21)',
+                  '[2009-01-21,2009-02-01)']
+})
+
+
+def fileName(row, version, level):
+    return 'AET_WAPOR.v{0}_l{1}_{2}.tif'.format(
+        version, level, row['raster_id'])
+
+
+def scaleRaster(download_file, outfilename, multiplier, nan_values=False):
+    shutil.copyfile(download_file, outfilename)
+    return 10, 20
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """Client with fake availability, jobs and downloads
+    """
+    monkeypatch.setattr(Engine, 'scaleRaster', scaleRaster)
+    monkeypatch.setattr(Engine.gis, 'GetShape', lambda fh: (10, 20))
+
+    api = WaPOR_API_class(print_job=False)
+    api.getCubeInfo = lambda cube_code, version=None, level=None: {
+        'measure': {'code': 'WATER_MM', 'multiplier': 0.1}
+    }
+    api.iterAvailData = lambda cube_code, **kwargs: iter(
+        [AVAIL.iloc[:2], AVAIL.iloc[2:]])
+    api.journals = []
+    api.downloads = []
+    api.failed = set()
+
+    def iterCropRasterURLs(bbox, cube_code, df_avail, ordered=False,
+                           version=None):
+        api.journals.append(api.jobJournal)
+        pages = [df_avail] if isinstance(df_avail, pd.DataFrame) else df_avail
+        for page in pages:
+            for index, row in page.iterrows():
+                download_url = 'https://download/{0}.tif'.format(
+                    row['raster_id'])
+                if api.jobJournal is not None:
+                    key = row['raster_id']
+                    api.jobJournal.submitted(
+                        key, 'WAPOR_2/L1_AETI_D', row['time_code'],
+                        row['raster_id'], bbox, 'https://jobs/' + key)
+                    api.jobJournal.completed(key, download_url, 2e9)
+                yield index, row, download_url
+
+    def downloadFile(download_url, filename, refresh=None):
+        api.downloads.append(download_url)
+        if os.path.basename(filename) in api.failed:
+            raise Exception('Download failed')
+        with open(filename, 'wb') as fp:
+            fp.write(b'raster')
+
+    api.iterCropRasterURLs = iterCropRasterURLs
+    api.downloadFile = downloadFile
+    return api
+
+
+def run(api, Dir, **kwargs):
+    return Engine.run(api, str(Dir), 'L1_AETI_D', BBOX,
+                      '2009-01-01,2009-02-01', fileName, tag='WaPOR AET',
+                      **kwargs)
+
+
+def jobs(Dir):
+    journal = JobJournal(str(Dir.join(Engine.JOURNAL_FILE)))
+    keys = [key for key in AVAIL['raster_id'] if journal.get(key)]
+    journal.close()
+    return keys
+
+
+def test_run(api, tmpdir, monkeypatch):
+    manifests = []
+
+    class Manifest(Engine.Manifest):
+        def __init__(self, path):
+            super(Manifest, self).__init__(path)
+            manifests.append(self)
+
+    monkeypatch.setattr(Engine, 'Manifest', Manifest)
+    session = api.session
+    api.setDownloadSegments(2)
+
+    outfilenames = run(api, tmpdir, workers=3)
+    assert outfilenames == [
+        str(tmpdir.join('L1_AETI_D', fileName(row, 2, 1)))
+        for index, row in AVAIL.iterrows()]
+    assert sorted(os.listdir(str(tmpdir.join('L1_AETI_D')))) == sorted(
+        [Engine.MANIFEST_FILE] + [os.path.basename(f) for f in outfilenames])
+
+    # Pool grown in place for 3 workers of 2 segments and the poller
+    assert api.max_workers == WaPOR_API_class(print_job=False).max_workers
+    assert api.session is session
+    assert api.poolSize == 7
+
+    # Valid outputs in the manifest are skipped
+    assert run(api, tmpdir) == []
+    assert len(api.downloads) == 3
+
+    # Manifest closed after each run
+    assert len(manifests) == 2
+    for manifest in manifests:
+        with pytest.raises(sqlite3.ProgrammingError):
+            manifest.get('WAPOR_2/L1_AETI_D', 'L1_AETI_0901', BBOX)
+
+
+def test_run_incremental(api, tmpdir):
+    api.commits = []
+    api.syncAvailData = lambda cube_code, bbox, **kwargs: None
+    api.commitAvailData = lambda cube_code, bbox, row, version=None: \
+        api.commits.append(row['raster_id'])
+
+    with pytest.raises(Exception, match='Cannot get list of available'):
+        run(api, tmpdir, incremental=True)
+    assert api.commits == []
+
+    # Rasters committed in time order
+    api.syncAvailData = lambda cube_code, bbox, **kwargs: AVAIL
+    assert len(run(api, tmpdir, incremental=True)) == 3
+    assert api.commits == list(AVAIL['raster_id'])
+    assert api.syncState.path == str(tmpdir.join(Engine.SYNC_FILE))
+
+
+def test_run_journal(api, tmpdir):
+    previous = JobJournal(str(tmpdir.join('previous.sqlite')))
+    api.jobJournal = previous
+
+    # Interrupted run keeps download urls to resume
+    api.failed.add('L1_AETI_0903.tif')
+    with pytest.raises(Exception, match='Download failed'):
+        run(api, tmpdir)
+    assert api.jobJournal is previous
+    assert api.journals[0] is not previous
+    with pytest.raises(sqlite3.ProgrammingError):
+        api.journals[0].pending()
+    assert jobs(tmpdir) == ['L1_AETI_0901', 'L1_AETI_0902', 'L1_AETI_0903']
+
+    # Finished run purges its jobs, journal of API is restored
+    api.failed.clear()
+    assert len(run(api, tmpdir, skip_existing=False)) == 3
+    assert api.jobJournal is previous
+    assert jobs(tmpdir) == []
+
+    # No journal in this run
+    run(api, tmpdir, skip_existing=False, journal=False)
+    assert api.journals[-1] is None
+    assert api.jobJournal is previous
+    previous.close()
@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import json
+import os
+import stat
+import time
+
+import pandas as pd
+import pytest
+from WaporIHE.download import PollSchedule as poll_schedule
+from WaporIHE.download.JobJournal import JobJournal
+from WaporIHE.download.Manifest import Manifest
+from WaporIHE.download.MetadataCache import MetadataCache
+from WaporIHE.download.PollSchedule import PollSchedule
+from WaporIHE.download.RateLimiter import RateLimiter
+from WaporIHE.download.SyncState import SyncState
+from WaporIHE.download.TokenCache import TokenCache
+from WaporIHE.download.UrlCache import UrlCache
+
+__author__ = "Quan Pan"
+__copyright__ = "Quan Pan"
+__license__ = "apache"
+
+
+class Clock(object):
+    """Fake time, sleep moves the clock
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, 'time', clock.time)
+    monkeypatch.setattr(time, 'sleep', clock.sleep)
+    return clock
+
+
+def test_RateLimiter(clock):
+    limiter = RateLimiter({'query': (2, 2), 'catalog': (None, None)})
+
+    # Burst, then one token every 1/rate sec
+    assert limiter.acquire('query') == 0.0
+    assert limiter.acquire('query') == 0.0
+    assert limiter.acquire('query') == pytest.approx(0.5)
+    assert clock.now == pytest.approx(1000.5)
+
+    clock.sleep(10)
+    assert limiter.acquire('query') == 0.0
+    assert limiter.acquire('query') == 0.0
+
+    assert limiter.acquire('catalog') == 0.0
+    assert limiter.acquire('unknown') == 0.0
+
+
+def test_RateLimiter_file(clock, tmpdir):
+    path = str(tmpdir.join('rate.json'))
+    RateLimiter({'query': (1, 1)}, path=path).acquire('query')
+
+    # Bucket state shared by another process
+    assert RateLimiter({'query': (1, 1)}, path=path).acquire(
+        'query') == pytest.approx(1.0)
+
+
+def token(access, start, expire=3600):
+    return {
+        'Access': access,
+        'Refresh': 'refresh',
+        'time': {'expire': expire, 'start': start}
+    }
+
+
+def test_TokenCache(tmpdir):
+    path = str(tmpdir.join('tokens.json'))
+    now = datetime.datetime.now().timestamp()
+    cache = TokenCache(path)
+    cache.put('test_TokenCache', token('a', now))
+
+    assert cache.get('test_TokenCache')['Access'] == 'a'
+    assert TokenCache().get('test_TokenCache')['Access'] == 'a'
+    assert cache.get('other') is None
+
+    # Shared file, owner only, API key is hashed
+    TokenCache(path).put('test_TokenCache', token('b', now))
+    assert cache.get('test_TokenCache')['Access'] == 'b'
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    with open(path) as fp:
+        assert 'test_TokenCache' not in json.dumps(json.load(fp))
+
+    # Expires within before_second
+    cache.put('test_TokenCache', token('c', now - 3000))
+    assert cache.get('test_TokenCache')['Access'] == 'c'
+    assert cache.get('test_TokenCache', before_second=600) is None
+
+
+def test_MetadataCache_ttl(clock, tmpdir):
+    path = str(tmpdir.join('metadata.sqlite'))
+    cache = MetadataCache(path, ttl={'members': 100})
+    cache.put('members', 'L1_AETI_D', [1, 2])
+    cache.put('catalog', 'WAPOR_2', {'items': []})
+
+    assert cache.get('members', 'L1_AETI_D') == [1, 2]
+    assert cache.get('members', 'L1_PCP_D') is None
+
+    # Time-to-live per entity
+    clock.sleep(101)
+    assert cache.get('members', 'L1_AETI_D') is None
+    assert cache.get('catalog', 'WAPOR_2') == {'items': []}
+    cache.close()
+
+    # Expired entries are used offline, never in refresh mode
+    offline = MetadataCache(path, ttl={'members': 100}, mode='offline')
+    assert offline.get('members', 'L1_AETI_D') == [1, 2]
+    offline.close()
+    refresh = MetadataCache(path, mode='refresh')
+    assert refresh.get('catalog', 'WAPOR_2') is None
+    refresh.close()
+
+    with pytest.raises(ValueError):
+        MetadataCache(path, mode='other')
+
+
+def test_MetadataCache_evict(clock, tmpdir):
+    cache = MetadataCache(str(tmpdir.join('metadata.sqlite')), max_size=25)
+    cache.put('catalog', 'a', '0123456789')
+    clock.sleep(1)
+    cache.put('catalog', 'b', '0123456789')
+    clock.sleep(1)
+    assert cache.get('catalog', 'a') == '0123456789'
+
+    # Least recently used is evicted above max_size
+    clock.sleep(1)
+    cache.put('catalog', 'c', '0123456789')
+    assert cache.get('catalog', 'b') is None
+    assert cache.get('catalog', 'a') == '0123456789'
+    assert cache.get('catalog', 'c') == '0123456789'
+    cache.close()
+
+
+def test_MetadataCache_invalidate(tmpdir):
+    cache = MetadataCache(str(tmpdir.join('metadata.sqlite')))
+    cache.putMany('index', {'WAPOR_2/L1_AETI_D': [2, 1],
+                            'WAPOR/L1_AETI_D': [1, 1]})
+    cache.put('catalog', 'WAPOR_2/cubes', [])
+
+    cache.invalidate('index', 'WAPOR_2/')
+    assert cache.get('index', 'WAPOR_2/L1_AETI_D') is None
+    assert cache.get('index', 'WAPOR/L1_AETI_D') == [1, 1]
+    assert cache.get('catalog', 'WAPOR_2/cubes') == []
+
+    cache.invalidate()
+    assert cache.get('index', 'WAPOR/L1_AETI_D') is None
+    assert cache.get('catalog', 'WAPOR_2/cubes') is None
+    cache.close()
+
+
+def test_SyncState_timeEnd():
+    assert SyncState.timeEnd('[2009-01-01,2009-01-11)') == '2009-01-11'
+    assert SyncState.timeEnd('[2009-01-01, 2010-01-01)') == '2010-01-01'
+
+
+def test_SyncState_update(tmpdir):
+    state = SyncState(str(tmpdir.join('sync.json')))
+    cube = 'WAPOR_2/L1_AETI_D'
+    bbox = [37.95, 7.89, 43.35, 12.4]
+    assert state.get(cube, bbox) is None
+
+    state.update(cube, bbox, '[2009-01-11,2009-01-21)', 'L1_AETI_0902')
+    # Earlier time code does not move the state back
+    state.update(cube, bbox, '[2009-01-01,2009-01-11)', 'L1_AETI_0901')
+
+    last = SyncState(str(tmpdir.join('sync.json'))).get(cube, bbox)
+    assert last['time_code'] == '[2009-01-11,2009-01-21)'
+    assert last['raster_id'] == 'L1_AETI_0902'
+    assert last['end'] == '2009-01-21'
+
+    assert state.get(cube, [37.95, 7.89, 43.35, 12.5]) is None
+    assert state.get('WAPOR/L1_AETI_D', bbox) is None
+
+    state.reset(cube)
+    assert state.get(cube, bbox) is None
+
+
+def test_PollSchedule():
+    schedule = PollSchedule(interval=0.5, max_interval=30)
+
+    # Not observed, poll interval grows with elapsed time
+    assert schedule.expected('CROP RASTER') is None
+    assert schedule.delay('CROP RASTER', 0) == 0.5
+    assert schedule.delay('CROP RASTER', 40) == 40 * poll_schedule.POLL_BACKOFF
+    assert schedule.delay('CROP RASTER', 1000) == 30
+
+    # First poll at expected completion
+    schedule.observe('CROP RASTER', 10)
+    assert schedule.delay('CROP RASTER', 2) == 8
+    assert schedule.delay('CROP RASTER', 20) == 5
+    assert schedule.delay('AREA STATS', 2) == 0.5
+
+    schedule.observe('CROP RASTER', 20)
+    assert schedule.expected('CROP RASTER') == pytest.approx(
+        poll_schedule.POLL_EWMA_ALPHA * 20 +
+        (1 - poll_schedule.POLL_EWMA_ALPHA) * 10)
+
+
+def test_JobJournal(clock, tmpdir):
+    path = str(tmpdir.join('jobs.sqlite'))
+    journal = JobJournal(path)
+    bbox = [37.95, 7.89, 43.35, 12.4]
+    for key, cube in [('a', 'WAPOR_2/L1_AETI_D'), ('b', 'WAPOR_2/L1_AETI_D'),
+                      ('c', 'WAPOR_2/L1_AETI_D'), ('d', 'WAPOR_2/L1_PCP_D'),
+                      ('e', 'WAPOR_2/L1_AETI_D')]:
+        journal.submitted(key, cube, '[2009-01-01,2009-01-11)',
+                          'L1_AETI_0901', bbox, 'https://jobs/' + key)
+        clock.sleep(1)
+    journal.completed('a', 'https://download/a.tif', clock.now + 100)
+    journal.completed('b', 'https://download/b.tif', clock.now + 10)
+    journal.failed('c')
+    journal.completed('d', 'https://download/d.tif', clock.now + 100)
+    journal.close()
+
+    # Pending jobs of a restarted run
+    journal = JobJournal(path)
+    assert [job['key'] for job in journal.pending()] == ['e']
+    assert journal.get('e')['bbox'] == bbox
+    assert journal.get('a')['status'] == 'COMPLETED'
+
+    # Failed and expired only
+    clock.sleep(50)
+    journal.purge(cube='WAPOR_2/L1_AETI_D', expired=True)
+    assert [journal.get(key) is None for key in 'abcde'] == [
+        False, True, True, False, False]
+
+    # All completed of the cube, submitted are kept
+    journal.purge(cube='WAPOR_2/L1_AETI_D')
+    assert [journal.get(key) is None for key in 'abcde'] == [
+        True, True, True, False, False]
+    journal.purge()
+    assert journal.get('d') is None
+    assert journal.get('e')['status'] == 'SUBMITTED'
+    journal.close()
+
+
+def test_UrlCache_expiry(clock):
+    cache = UrlCache()
+    cache.put('a', 'http://a', clock.now + 100)
+
+    assert cache.get('a') == 'http://a'
+    # Expires within margin, not evicted
+    assert cache.get('a', margin=200) is None
+    assert len(cache) == 1
+    assert cache.get('a', margin=50) == 'http://a'
+
+    # Expired url is removed
+    clock.sleep(100)
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_UrlCache_lru(clock):
+    cache = UrlCache(max_size=2)
+    cache.put('a', 'http://a', clock.now + 100)
+    cache.put('b', 'http://b', clock.now + 100)
+    assert cache.get('a') == 'http://a'
+
+    cache.put('c', 'http://c', clock.now + 100)
+    assert len(cache) == 2
+    assert cache.get('b') is None
+    assert cache.get('a') == 'http://a'
+    assert cache.get('c') == 'http://c'
+
+    cache.pop('a')
+    assert cache.get('a') is None
+
+
+def write(filename, content):
+    with open(filename, 'wb') as fp:
+        fp.write(content)
+
+
+def test_Manifest_isValid(tmpdir):
+    manifest = Manifest(str(tmpdir.join('manifest.sqlite')))
+    cube = 'WAPOR_2/L1_AETI_D'
+    bbox = [37.95, 7.89, 43.35, 12.4]
+    filename = str(tmpdir.join('AET_WAPOR.v2_l1-dekad-1_L1_AETI_0901.tif'))
+
+    def shape(fh):
+        return 10, 20
+
+    write(filename, b'0123456789')
+    manifest.record(filename, cube, 'L1_AETI_0901', bbox, 0.1, (10, 20))
+
+    assert manifest.isValid(cube, 'L1_AETI_0901', bbox, 0.1, shape=shape,
+                            filename=filename)
+    assert manifest.isValid(cube, 'L1_AETI_0901', bbox, 0.1, checksum=True)
+
+    # Not recorded, or recorded with other workspace, bbox, multiplier
+    assert not manifest.isValid(cube, 'L1_AETI_0902', bbox, 0.1)
+    assert not manifest.isValid('WAPOR/L1_AETI_D', 'L1_AETI_0901', bbox, 0.1)
+    assert not manifest.isValid(cube, 'L1_AETI_0901', [0, 0, 1, 1], 0.1)
+    assert not manifest.isValid(cube, 'L1_AETI_0901', bbox, 1.0)
+
+    # Other output file name
+    assert not manifest.isValid(
+        cube, 'L1_AETI_0901', bbox, 0.1,
+        filename=str(tmpdir.join('AET_WAPOR.v1_l1-dekad-1_L1_AETI_0901.tif')))
+
+    # GDAL header shape
+    assert not manifest.isValid(cube, 'L1_AETI_0901', bbox, 0.1,
+                                shape=lambda fh: None)
+
+    # Modified, same content
+    stat = os.stat(filename)
+    os.utime(filename, (stat.st_atime, stat.st_mtime + 10))
+    assert manifest.isValid(cube, 'L1_AETI_0901', bbox, 0.1)
+
+    # Modified, same size
+    write(filename, b'9876543210')
+    os.utime(filename, (time.time(), stat.st_mtime + 20))
+    assert not manifest.isValid(cube, 'L1_AETI_0901', bbox, 0.1)
+
+    # Other size, removed
+    write(filename, b'0')
+    assert not manifest.isValid(cube, 'L1_AETI_0901', bbox, 0.1)
+    os.remove(filename)
+    assert not manifest.isValid(cube, 'L1_AETI_0901', bbox, 0.1)
+    manifest.close()
+
+
+def test_Manifest_missing(tmpdir):
+    manifest = Manifest(str(tmpdir.join('manifest.sqlite')))
+    cube = 'WAPOR_2/L1_AETI_D'
+    bbox = [37.95, 7.89, 43.35, 12.4]
+    filename = str(tmpdir.join('L1_AETI_0901.tif'))
+    write(filename, b'0123456789')
+    manifest.record(filename, cube, 'L1_AETI_0901', bbox, 0.1, (10, 20))
+
+    df_avail = pd.DataFrame({'raster_id': ['L1_AETI_0901', 'L1_AETI_0902']})
+    assert list(manifest.missing(cube, bbox, 0.1, df_avail)[
+        'raster_id']) == ['L1_AETI_0902']
+
+    manifest.remove(cube)
+    assert len(manifest.missing(cube, bbox, 0.1, df_avail)) == 2
+    manifest.close()